@@ -5,6 +5,10 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+
+Los webhooks (webhook_endpoint, long_webhook) y ConnectionTrackingMiddleware son
+async: servidos con un servidor ASGI (p. ej. `uvicorn connection_manager.asgi:application`)
+un solo proceso mantiene miles de webhooks abiertos sin un hilo por request.
 """
 
 import os
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -79,12 +81,71 @@ WSGI_APPLICATION = 'connection_manager.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+def env_bool(name, default=False):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+# Perfil de base de datos elegido con la variable de entorno DATABASE_PROFILE:
+# - sqlite: SQLite con la configuración por defecto (desarrollo)
+# - sqlite-wal: SQLite en modo WAL con los PRAGMA de SQLITE_PRAGMAS
+# - postgresql: PostgreSQL con conexiones persistentes y pooler opcional
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+# PRAGMA aplicados al abrir cada conexión SQLite (webhook_manager.db)
+SQLITE_PRAGMAS = {}
+
+if DATABASE_PROFILE in ('sqlite', 'sqlite-wal'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+        }
     }
-}
+    
+    if DATABASE_PROFILE == 'sqlite-wal':
+        busy_timeout_ms = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+        SQLITE_PRAGMAS = {
+            'journal_mode': 'WAL',  # lectores y un escritor en paralelo
+            'synchronous': 'NORMAL',  # fsync solo en checkpoints (seguro con WAL)
+            'busy_timeout': busy_timeout_ms,  # esperar el lock en lugar de "database is locked"
+            'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+            'cache_size': -20000,  # ~20 MB de caché de páginas
+            'temp_store': 'MEMORY',
+        }
+        # El timeout del módulo sqlite3 también espera el lock al abrir transacciones
+        DATABASES['default']['OPTIONS'] = {'timeout': busy_timeout_ms / 1000}
+
+elif DATABASE_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'connection_manager'),
+            'USER': os.environ.get('POSTGRES_USER', 'connection_manager'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Conexiones persistentes con verificación antes de reutilizarlas
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': env_bool('DB_CONN_HEALTH_CHECKS', True),
+            'OPTIONS': {
+                'connect_timeout': int(os.environ.get('POSTGRES_CONNECT_TIMEOUT', 5)),
+                'application_name': 'connection_manager',
+            },
+        }
+    }
+    
+    # Pooler externo opcional (DB_POOLER=pgbouncer, modo transaction)
+    if os.environ.get('DB_POOLER') == 'pgbouncer':
+        DATABASES['default'].update({
+            'HOST': os.environ.get('PGBOUNCER_HOST', DATABASES['default']['HOST']),
+            'PORT': os.environ.get('PGBOUNCER_PORT', '6432'),
+            # Los cursores con nombre no sobreviven al cambio de conexión del pooler
+            'DISABLE_SERVER_SIDE_CURSORS': True,
+        })
+
+else:
+    raise ImproperlyConfigured(
+        f"DATABASE_PROFILE desconocido: {DATABASE_PROFILE!r} (sqlite, sqlite-wal o postgresql)"
+    )
 
 
 # Password validation
@@ -142,8 +203,116 @@ REST_FRAMEWORK = {
 CONNECTION_TIMEOUT = 30  # segundos
 MAX_CONNECTIONS = 200
 CLEANUP_PERCENTAGE = 0.5  # 50%
+CLEANUP_LEASE_TTL = 300  # segundos que dura el lease de limpieza entre procesos
+CLEANUP_BATCH_SIZE = 500  # conexiones cerradas por sentencia UPDATE dentro de la transacción
+CLEANUP_LOG_COMPRESS = True  # comprimir con zlib la lista empaquetada de conexiones cerradas
+
+# Tiempos simulados de procesamiento de los webhooks (asyncio.sleep en ASGI)
+WEBHOOK_PROCESSING_SECONDS = 2
+LONG_WEBHOOK_SECONDS = 45
+
+# Cola de webhooks: responder 202 y procesar en un pool de workers (tabla WebhookJob)
+WEBHOOK_QUEUE_ENABLED = False
+WEBHOOK_QUEUE_WORKERS = 4
+WEBHOOK_QUEUE_MAX_SIZE = 1000  # trabajos sin terminar antes de responder 429
+WEBHOOK_QUEUE_MAX_ATTEMPTS = 5
+WEBHOOK_QUEUE_RETRY_BACKOFF = 2.0  # segundos base del backoff exponencial
+WEBHOOK_QUEUE_RETRY_AFTER = 5  # cabecera Retry-After de las respuestas 429
+WEBHOOK_QUEUE_POLL_INTERVAL = 0.5
+WEBHOOK_QUEUE_LEASE_SECONDS = 60  # tiempo antes de reintentar un trabajo de un worker caído
+WEBHOOK_JOB_HANDLER = 'webhook_manager.jobs.process_webhook_payload'
+
+# Backend de rastreo de conexiones: ORM (tabla ActiveConnection) o registro en memoria
+CONNECTION_TRACKING_BACKEND = 'webhook_manager.backends.ORMTrackingBackend'
+# CONNECTION_TRACKING_BACKEND = 'webhook_manager.backends.InMemoryTrackingBackend'
+CONNECTION_REGISTRY_SHARDS = 16  # particiones con lock propio del registro en memoria
+CONNECTION_REGISTRY_PERSIST_INTERVAL = 5.0  # segundos entre volcados a ActiveConnection
+
+# Planificador de expiración (rueda de tiempo jerárquica), iniciado con la primera request de cada proceso
+EXPIRY_SCHEDULER_ENABLED = True
+EXPIRY_SCHEDULER_TICK = 1.0  # segundos por tick de la rueda
+EXPIRY_SCHEDULER_CLEANUP_INTERVAL = 5.0  # separación mínima entre limpiezas automáticas
+EXPIRY_SCHEDULER_RECONCILE_INTERVAL = 60.0  # segundos entre comprobaciones de las conexiones inactivas en el backend
+
+# Retención: conexiones CLOSED y logs de limpieza viejos pasan a tablas de archivo
+RETENTION_ARCHIVE = True  # False: borrar sin archivar
+RETENTION_CLOSED_CONNECTIONS_SECONDS = 24 * 3600  # antigüedad (last_activity) de las conexiones CLOSED
+RETENTION_CLEANUP_LOG_SECONDS = 30 * 24 * 3600  # antigüedad de los logs de limpieza
+RETENTION_WEBHOOK_JOBS_SECONDS = 7 * 24 * 3600  # antigüedad (updated_at) de los WebhookJob DONE/FAILED; se borran
+RETENTION_BATCH_SIZE = 500  # filas por transacción de copia y borrado
+RETENTION_BATCH_PAUSE = 0.0  # segundos de pausa entre lotes
+RETENTION_INTERVAL = 3600  # segundos entre ejecuciones desde el planificador (0 la desactiva)
+RETENTION_MAX_BATCHES = 100  # lotes por tabla en cada ejecución del planificador
+
+# Modo write-behind del backend ORM: la actividad se escribe en lotes en segundo plano
+CONNECTION_WRITE_BEHIND = False
+CONNECTION_WRITE_BEHIND_INTERVAL = 1.0  # segundos entre vaciados
+CONNECTION_WRITE_BEHIND_BATCH_SIZE = 500  # eventos que disparan un vaciado anticipado
+CONNECTION_WRITE_BEHIND_MAX_SIZE = 10000  # tope del buffer antes de vaciar en la request
+CONNECTION_WRITE_BEHIND_RETRY_BACKOFF = 5.0  # segundos sin vaciar en la request tras un vaciado fallido
+
+# Contadores incrementales por segundo de last_activity (backend ORM)
+CONNECTION_COUNTERS_ENABLED = False
+CONNECTION_COUNTERS_FLUSH_INTERVAL = 1.0  # segundos entre volcados de deltas a ConnectionCountBucket
+
+# Bloqueo de IPs en ConnectionTrackingMiddleware (403 antes de registrar la conexión)
+IP_BLOCKING_ENABLED = True
+TRUSTED_PROXIES = []  # IPs o rangos CIDR de los proxies inversos; solo a ellos se les acepta X-Forwarded-For
+BLOCKED_IP_RANGES = []  # rangos CIDR IPv4/IPv6 bloqueados además de SuspiciousIP.is_blocked
+IP_BLOCKLIST_REFRESH_INTERVAL = 30.0  # segundos entre recargas de las IPs bloqueadas de otros procesos
+IP_AUTOBLOCK_ENABLED = False  # bloquear automáticamente las IPs que superan el umbral
+IP_AUTOBLOCK_THRESHOLD = 100  # conexiones de una IP dentro de la ventana
+IP_AUTOBLOCK_WINDOW = 60.0  # segundos de la ventana deslizante
+
+# Límite de tasa por IP en ConnectionTrackingMiddleware (429 con Retry-After)
+RATE_LIMIT_ENABLED = False
+RATE_LIMIT_BACKEND = 'local'  # 'local' (tabla del proceso) o 'django' (caché compartida)
+RATE_LIMIT_CACHE_ALIAS = 'default'  # alias de CACHES usado con RATE_LIMIT_BACKEND = 'django'
+RATE_LIMIT_SHARDS = 16  # particiones con lock propio de la tabla local
+RATE_LIMIT_MAX_ENTRIES = 100000  # buckets en memoria antes de descartar los menos usados
+RATE_LIMITS = {
+    # ruta exacta: tokens por segundo y ráfaga máxima por IP
+    '/api/webhook/': {'rate': 5.0, 'burst': 20},
+    '/api/webhook/long/': {'rate': 0.1, 'burst': 3},
+}
+
+# Control de admisión: webhooks en curso por clase de endpoint (límites por proceso)
+ADMISSION_CONTROL_ENABLED = False
+ADMISSION_CLASSES = {
+    # max_in_flight: requests admitidas a la vez; max_per_ip: admitidas + en cola por IP;
+    # max_queue: requests esperando hueco antes de responder 503
+    'webhook': {'paths': ['/api/webhook/'], 'max_in_flight': 500, 'max_per_ip': 50, 'max_queue': 200},
+    'long_webhook': {'paths': ['/api/webhook/long/'], 'max_in_flight': 100, 'max_per_ip': 10, 'max_queue': 50},
+}
+ADMISSION_QUEUE_TIMEOUT = 5.0  # segundos en cola antes de descartar con 503
+ADMISSION_RETRY_AFTER = 5  # cabecera Retry-After de las respuestas 503
+
+# Incrementos write-behind de SuspiciousIP en lugar de un upsert por webhook (backend ORM)
+IP_REPUTATION_CACHE_ENABLED = False
+IP_REPUTATION_CACHE_FLUSH_INTERVAL = 1.0  # segundos entre volcados de incrementos a SuspiciousIP
+
+# Snapshot cacheado de estadísticas para connection_status y system_stats
+STATS_CACHE_BACKEND = 'local'  # 'local' (por proceso) o 'django' (caché compartida)
+STATS_CACHE_ALIAS = 'default'  # alias de CACHES usado con STATS_CACHE_BACKEND = 'django'
+STATS_CACHE_TTL = 2.0  # segundos que el snapshot se sirve como fresco
+STATS_CACHE_STALE_TTL = 10.0  # segundos extra sirviendo el snapshot viejo mientras se refresca
+
+# Stream SSE de estadísticas (/api/connections/stream/, requiere ASGI)
+STATS_STREAM_INTERVAL = 1.0  # segundos entre cálculos compartidos por todos los suscriptores
+STATS_STREAM_HEARTBEAT = 15.0  # segundos sin eventos antes de enviar un heartbeat
+STATS_STREAM_MAX_SECONDS = 300.0  # duración máxima de un stream antes de que el cliente reconecte
+STATS_STREAM_QUEUE_SIZE = 100  # eventos en cola por suscriptor lento
+
+# Métricas en formato Prometheus (/api/metrics/), agregadas por hilo en cada proceso
+METRICS_ENABLED = True
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
 
 # Logging
+# webhook_manager escribe a través de una cola acotada (webhook_manager.logutils):
+# un hilo QueueListener vuelca en el archivo rotativo y la consola, y las líneas
+# por request se muestrean para que la E/S no crezca con el tráfico.
+# configure_logging aplica LOGGING y entrega a la cola sus handlers de destino.
+LOGGING_CONFIG = 'webhook_manager.logutils.configure_logging'
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -157,11 +326,24 @@ LOGGING = {
             'style': '{',
         },
     },
+    'filters': {
+        'sample_per_request': {
+            '()': 'webhook_manager.logutils.SamplingFilter',
+            'prefixes': [
+                'Actividad registrada', 'Webhook recibido', 'Nueva conexión webhook', 'RAID 1 Backup', 'Petición bloqueada',
+                'Petición limitada', 'Petición descartada'
+            ],
+            'max_per_second': 10,  # líneas por segundo y prefijo antes de muestrear
+            'sample_every': 100,  # superado el ritmo, se escribe 1 de cada 100
+        },
+    },
     'handlers': {
         'file': {
             'level': 'INFO',
-            'class': 'logging.FileHandler',
+            'class': 'logging.handlers.RotatingFileHandler',
             'filename': BASE_DIR / 'logs' / 'connections.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
             'formatter': 'verbose',
         },
         'console': {
@@ -169,10 +351,17 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        'queue': {
+            # '()' en lugar de 'class': evita el tratamiento especial de QueueHandler en dictConfig
+            '()': 'webhook_manager.logutils.BoundedQueueHandler',
+            'handlers': ['file', 'console'],
+            'maxsize': 10000,  # registros en cola; al llenarse se descartan y se cuentan
+            'filters': ['sample_per_request'],
+        },
     },
     'loggers': {
         'webhook_manager': {
-            'handlers': ['file', 'console'],
+            'handlers': ['queue'],
             'level': 'INFO',
             'propagate': True,
         },
@@ -181,4 +370,4 @@ LOGGING = {
             'level': 'INFO',
         },
     },
-}
\ No newline at end of file
+}
@@ -0,0 +1,10 @@
+"""
+Settings para ejecutar la suite de tests (pytest-django o manage.py test --settings).
+
+Los tests arrancan y detienen por su cuenta el planificador y los workers que
+necesitan: las requests del cliente de pruebas no deben ponerlos en marcha.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+EXPIRY_SCHEDULER_ENABLED = False
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark del volumen de escrituras en la base de datos durante una tormenta de
+polling de /api/connections/status/ con el umbral de limpieza superado.
+
+Cada poller dispara una limpieza, como hace connection_status. Se comparan dos
+modos sobre una base SQLite temporal con las mismas conexiones inactivas:
+
+- sin_guardia: cada disparo ejecuta la limpieza directamente (comportamiento
+  anterior, un hilo por petición)
+- single_flight: cada disparo pasa por ConnectionCleanupService.cleanup_connections
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'connection_manager.settings')
+
+import django
+from django.conf import settings
+
+# Sin planificador en segundo plano: el benchmark controla cuándo se limpia
+settings.EXPIRY_SCHEDULER_ENABLED = False
+django.setup()
+
+from datetime import timedelta
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Sum
+from django.utils import timezone
+from webhook_manager.models import ActiveConnection, ConnectionCleanupLog, SuspiciousIP
+from webhook_manager.services import ConnectionCleanupService
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class WriteCounter:
+    """Cuenta sentencias de escritura en todas las conexiones del proceso"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(WRITE_PREFIXES):
+            with self.lock:
+                self.writes += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+def prepare_database(path, inactive_connections):
+    connections.close_all()
+    connections['default'].settings_dict['NAME'] = path
+    connections['default'].settings_dict.setdefault('OPTIONS', {})['timeout'] = 60
+    call_command('migrate', verbosity=0)
+
+    stale = timezone.now() - timedelta(seconds=settings.CONNECTION_TIMEOUT + 60)
+    ActiveConnection.objects.bulk_create([
+        ActiveConnection(
+            client_ip=f'10.0.{i // 250}.{i % 250}',
+            is_webhook=True,
+            last_activity=stale - timedelta(seconds=i)
+        ) for i in range(inactive_connections)
+    ], batch_size=500)
+
+
+def run_storm(mode, pollers, inactive_connections):
+    path = os.path.join(tempfile.mkdtemp(), f'{mode}.sqlite3')
+    prepare_database(path, inactive_connections)
+
+    counter = WriteCounter()
+    connection_created.connect(counter.install)
+    barrier = threading.Barrier(pollers)
+    errors = []
+
+    def poll():
+        service = ConnectionCleanupService()
+        trigger = service.run_cleanup if mode == 'sin_guardia' else service.cleanup_connections
+        try:
+            barrier.wait()
+            trigger()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=poll) for _ in range(pollers)]
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - started
+    connection_created.disconnect(counter.install)
+
+    return {
+        'modo': mode,
+        'escrituras': counter.writes,
+        'conexiones_cerradas': ActiveConnection.objects.filter(status='CLOSED').count(),
+        'logs_de_limpieza': ConnectionCleanupLog.objects.count(),
+        'conteo_ips_sospechosas': SuspiciousIP.objects.aggregate(total=Sum('connection_count'))['total'] or 0,
+        'errores': len(errors),
+        'segundos': round(elapsed, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pollers', type=int, default=20, help='peticiones de estado concurrentes')
+    parser.add_argument('--inactive', type=int, default=2000, help='conexiones inactivas iniciales')
+    args = parser.parse_args()
+
+    logging.getLogger('webhook_manager').setLevel(logging.ERROR)
+
+    print("BENCHMARK - TORMENTA DE POLLING DE ESTADO")
+    print("=" * 50)
+    print(f"Pollers concurrentes: {args.pollers} - Conexiones inactivas: {args.inactive}")
+    print(f"Cierre esperado de una sola limpieza: {int(args.inactive * settings.CLEANUP_PERCENTAGE)}")
+
+    for mode in ('sin_guardia', 'single_flight'):
+        result = run_storm(mode, args.pollers, args.inactive)
+        print("-" * 50)
+        for key, value in result.items():
+            print(f"{key}: {value}")
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Benchmark de throughput de escritura por perfil de base de datos.
+
+Reproduce la carga del simulador (simulate_webhooks.py) sin servidor HTTP:
+varios hilos registran webhooks con ORMTrackingBackend, como hace el
+middleware en cada request (INSERT de ActiveConnection + upsert de
+SuspiciousIP), mientras un hilo consulta el estado como monitor_experiment.py.
+
+Perfiles comparados:
+- sqlite: SQLite con la configuración por defecto
+- sqlite-wal: SQLite con los PRAGMA del perfil sqlite-wal
+- postgresql: solo si POSTGRES_HOST está definido (usa POSTGRES_* como settings.py)
+
+La configuración de cada perfil (DATABASES y SQLITE_PRAGMAS) sale de evaluar
+settings.py con ese DATABASE_PROFILE, y los PRAGMA se aplican con el mismo
+receptor apply_sqlite_pragmas que en producción: el benchmark mide el perfil
+que se despliega. Solo el archivo SQLite se cambia por uno temporal.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import logging
+import os
+import runpy
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'connection_manager.settings')
+
+import django
+from django.conf import settings
+
+settings.EXPIRY_SCHEDULER_ENABLED = False
+django.setup()
+
+from django.core.management import call_command
+from django.db import connection, connections
+from webhook_manager.backends import ORMTrackingBackend
+from webhook_manager.models import ActiveConnection
+
+
+
+def profile_settings(profile):
+    """DATABASES['default'] y SQLITE_PRAGMAS que settings.py define para `profile`"""
+    previous = os.environ.get('DATABASE_PROFILE')
+    os.environ['DATABASE_PROFILE'] = profile
+    try:
+        # Ejecutar el archivo de settings de nuevo, sin tocar el módulo ya importado
+        profile_module = runpy.run_path(importlib.util.find_spec(os.environ['DJANGO_SETTINGS_MODULE']).origin)
+    finally:
+        if previous is None:
+            del os.environ['DATABASE_PROFILE']
+        else:
+            os.environ['DATABASE_PROFILE'] = previous
+    return profile_module['DATABASES']['default'], profile_module['SQLITE_PRAGMAS']
+
+
+def configure_profile(profile):
+    """Apuntar la conexión 'default' al perfil indicado sobre una base limpia"""
+    connections.close_all()
+    database, pragmas = profile_settings(profile)
+
+    settings_dict = connections['default'].settings_dict
+    settings_dict.update({'OPTIONS': {}, 'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False})
+    settings_dict.update(database)
+    if settings_dict['ENGINE'] == 'django.db.backends.sqlite3':
+        settings_dict['NAME'] = os.path.join(tempfile.mkdtemp(), f'{profile}.sqlite3')
+    # apply_sqlite_pragmas (connection_created) lee SQLITE_PRAGMAS en cada conexión nueva
+    settings.SQLITE_PRAGMAS = pragmas
+
+    call_command('migrate', verbosity=0)
+    if profile == 'postgresql':
+        ActiveConnection.objects.all().delete()
+    connections.close_all()
+
+
+def run_load(writers, requests_per_writer, poll_interval):
+    backend = ORMTrackingBackend()
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(writers + 1)
+    done = threading.Event()
+    polls = [0]
+
+    def writer(index):
+        own_latencies = []
+        own_errors = []
+        barrier.wait()
+        for i in range(requests_per_writer):
+            started = time.perf_counter()
+            try:
+                backend.register_connection(f'10.{index}.{i // 250}.{i % 250}', 'benchmark', True, '/api/webhook/')
+            except Exception as e:
+                own_errors.append(str(e))
+                continue
+            own_latencies.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            errors.extend(own_errors)
+
+    def poller():
+        barrier.wait()
+        while not done.wait(poll_interval):
+            try:
+                backend.stats()
+                polls[0] += 1
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+        connection.close()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    poll_thread = threading.Thread(target=poller)
+    for thread in threads + [poll_thread]:
+        thread.start()
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    poll_thread.join()
+
+    latencies.sort()
+    percentile = lambda p: round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+    return {
+        'webhooks_ok': len(latencies),
+        'errores': len(errors),
+        'errores_locked': sum(1 for error in errors if 'locked' in error),
+        'webhooks_por_segundo': round(len(latencies) / elapsed, 1),
+        'escrituras_por_segundo': round(2 * len(latencies) / elapsed, 1),
+        'latencia_p50_ms': percentile(0.50),
+        'latencia_p95_ms': percentile(0.95),
+        'latencia_media_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+        'consultas_de_estado': polls[0],
+        'segundos': round(elapsed, 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=16, help='hilos escritores concurrentes')
+    parser.add_argument('--requests', type=int, default=200, help='webhooks por hilo')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='segundos entre consultas de estado')
+    parser.add_argument('--profiles', nargs='+', default=None, help='perfiles a comparar')
+    args = parser.parse_args()
+
+    profiles = args.profiles or ['sqlite', 'sqlite-wal'] + (['postgresql'] if os.environ.get('POSTGRES_HOST') else [])
+    logging.getLogger('webhook_manager').setLevel(logging.ERROR)
+
+    print("BENCHMARK - THROUGHPUT DE ESCRITURA POR PERFIL DE BASE DE DATOS")
+    print("=" * 60)
+    print(f"Escritores: {args.writers} - Webhooks por escritor: {args.requests}")
+
+    for profile in profiles:
+        configure_profile(profile)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_load(args.writers, args.requests, args.poll_interval)
+        print("-" * 60)
+        print(f"perfil: {profile}")
+        for key, value in result.items():
+            print(f"{key}: {value}")
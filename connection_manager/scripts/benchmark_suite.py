@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Suite de benchmarks reproducible del gestor de conexiones.
+
+Ejecuta escenarios fijos y guarda los resultados en JSON (commit, perfil de base
+de datos, parámetros y métricas por escenario) para comparar corridas entre
+commits con --compare.
+
+Transportes:
+- asgi (por defecto): llama en el mismo proceso a connection_manager.asgi.application
+  sobre una base SQLite temporal, sin servidor HTTP
+- http: contra un servidor local ya levantado (--url http://127.0.0.1:8000); las
+  IPs de cliente van en X-Forwarded-For, así que el servidor debe tener
+  127.0.0.1 en TRUSTED_PROXIES o todas cuentan como una sola IP
+
+Escenarios:
+- webhook_burst: ráfaga de POST a /api/webhook/ desde IPs distintas
+- long_webhook_hold: long webhooks simultáneos que se mantienen abiertos
+- status_polling_storm: tormenta de GET a /api/connections/status/ desde
+  --concurrency monitores
+- cleanup_10k / cleanup_100k: una limpieza con 10k / 100k conexiones inactivas
+  (solo asgi: siembra las filas directamente en la base de datos)
+
+Por escenario se reportan p50/p95/p99, throughput y consultas a la base de
+datos (en http se leen de /api/metrics/).
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'connection_manager.settings')
+
+import django
+from django.conf import settings
+
+# Sin planificador en segundo plano: cada escenario controla cuándo se limpia
+settings.EXPIRY_SCHEDULER_ENABLED = False
+django.setup()
+
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+SCENARIOS = ('webhook_burst', 'long_webhook_hold', 'status_polling_storm', 'cleanup_10k', 'cleanup_100k')
+IN_PROCESS_ONLY = ('cleanup_10k', 'cleanup_100k')
+COMPARED_KEYS = ('peticiones_por_segundo', 'latencia_p95_ms', 'latencia_p99_ms', 'consultas_bd', 'segundos')
+
+
+class QueryCounter:
+    """Cuenta las consultas de todas las conexiones del proceso (transporte asgi)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.queries += 1
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+    def read(self):
+        return self.queries
+
+
+class ASGITransport:
+    """Peticiones contra la aplicación ASGI en el mismo event loop"""
+
+    name = 'asgi'
+
+    def __init__(self, application, counter):
+        self.application = application
+        self.counter = counter
+
+    async def request(self, method, path, payload=None, client_ip='127.0.0.1'):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'headers': [
+                (b'host', b'localhost'),
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+            'client': (client_ip, 50000),
+            'server': ('localhost', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        disconnect = asyncio.Event()
+        status = {}
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+
+        try:
+            await self.application(scope, receive, send)
+        finally:
+            disconnect.set()
+        return status.get('code')
+
+    def db_queries(self):
+        return self.counter.read()
+
+
+class HTTPTransport:
+    """Peticiones contra un servidor local, un hilo por petición en vuelo"""
+
+    name = 'http'
+
+    def __init__(self, base_url, concurrency, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def _request(self, method, path, payload, client_ip):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=data,
+            method=method,
+            headers={'Content-Type': 'application/json', 'X-Forwarded-For': client_ip}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+        except OSError:
+            return None
+
+    async def request(self, method, path, payload=None, client_ip='127.0.0.1'):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._request, method, path, payload, client_ip)
+
+    def db_queries(self):
+        """Suma de webhook_manager_request_db_queries_sum en /api/metrics/ (None si no está)"""
+        try:
+            with urllib.request.urlopen(self.base_url + '/api/metrics/', timeout=self.timeout) as response:
+                body = response.read().decode()
+        except OSError:
+            return None
+        values = re.findall(r'^webhook_manager_request_db_queries_sum(?:\{[^}]*\})? (\S+)$', body, re.MULTILINE)
+        return int(sum(float(value) for value in values))
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano, en milisegundos"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(len(sorted_values) * p)) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+async def drive(transport, requests, concurrency):
+    """Ejecutar (método, path, payload, ip) con `concurrency` peticiones en vuelo"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = Counter()
+    in_flight = [0, 0]
+
+    async def one(method, path, payload, client_ip):
+        async with semaphore:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            started = time.perf_counter()
+            try:
+                status = await transport.request(method, path, payload, client_ip)
+            finally:
+                in_flight[0] -= 1
+            latencies.append(time.perf_counter() - started)
+            statuses[status or 'error'] += 1
+
+    queries_before = transport.db_queries()
+    started = time.perf_counter()
+    await asyncio.gather(*[one(*request) for request in requests])
+    elapsed = time.perf_counter() - started
+    queries_after = transport.db_queries()
+
+    latencies.sort()
+    queries = queries_after - queries_before if None not in (queries_before, queries_after) else None
+    return {
+        'peticiones': len(latencies),
+        'concurrencia': concurrency,
+        'por_status': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'pico_en_vuelo': in_flight[1],
+        'peticiones_por_segundo': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'latencia_p50_ms': percentile(latencies, 0.50),
+        'latencia_p95_ms': percentile(latencies, 0.95),
+        'latencia_p99_ms': percentile(latencies, 0.99),
+        'latencia_max_ms': round(latencies[-1] * 1000, 2) if latencies else None,
+        'consultas_bd': queries,
+        'consultas_por_peticion': round(queries / len(latencies), 2) if queries is not None and latencies else None,
+        'segundos': round(elapsed, 3),
+    }
+
+
+def client_ip(i):
+    return f'10.{(i // 62500) % 250}.{(i // 250) % 250}.{i % 250}'
+
+
+def webhook_burst(transport, args):
+    requests = [
+        ('POST', '/api/webhook/', {'webhook_id': i, 'source': 'benchmark_suite'}, client_ip(i))
+        for i in range(args.requests)
+    ]
+    return asyncio.run(drive(transport, requests, args.concurrency))
+
+
+def long_webhook_hold(transport, args):
+    requests = [
+        ('POST', '/api/webhook/long/', {'webhook_id': i, 'source': 'benchmark_suite'}, client_ip(i))
+        for i in range(args.long_webhooks)
+    ]
+    result = asyncio.run(drive(transport, requests, args.long_webhooks))
+    result['duracion_del_webhook_s'] = settings.LONG_WEBHOOK_SECONDS if transport.name == 'asgi' else None
+    return result
+
+
+def status_polling_storm(transport, args):
+    # Un monitor por petición en vuelo, cada uno con su IP
+    requests = [
+        ('GET', '/api/connections/status/', None, f'192.168.{(i % args.concurrency) // 250}.{i % args.concurrency % 250}')
+        for i in range(args.polls)
+    ]
+    return asyncio.run(drive(transport, requests, args.concurrency))
+
+
+def cleanup_scenario(rows):
+    def run(transport, args):
+        from webhook_manager.models import ActiveConnection
+        from webhook_manager.services import ConnectionCleanupService
+
+        stale = timezone.now() - timedelta(seconds=settings.CONNECTION_TIMEOUT + 60)
+        ActiveConnection.objects.bulk_create([
+            ActiveConnection(client_ip=client_ip(i), is_webhook=True, last_activity=stale - timedelta(seconds=i))
+            for i in range(rows)
+        ], batch_size=2000)
+        connections.close_all()
+
+        queries_before = transport.db_queries()
+        started = time.perf_counter()
+        result = ConnectionCleanupService().run_cleanup()
+        elapsed = time.perf_counter() - started
+        closed = result.get('connections_closed', 0)
+        return {
+            'filas_inactivas': rows,
+            'ejecutada': result['executed'],
+            'conexiones_cerradas': closed,
+            'cierres_por_segundo': round(closed / elapsed) if elapsed else None,
+            'consultas_bd': transport.db_queries() - queries_before,
+            'segundos': round(elapsed, 3),
+        }
+    return run
+
+
+RUNNERS = {
+    'webhook_burst': webhook_burst,
+    'long_webhook_hold': long_webhook_hold,
+    'status_polling_storm': status_polling_storm,
+    'cleanup_10k': cleanup_scenario(10000),
+    'cleanup_100k': cleanup_scenario(100000),
+}
+
+
+def reset_state():
+    """Tablas vacías y caché de estadísticas limpia antes de cada escenario (asgi)"""
+    from webhook_manager.models import ActiveConnection, ConnectionCleanupLog, SuspiciousIP
+    from webhook_manager.stats_cache import get_stats_cache
+
+    for model in (ActiveConnection, ConnectionCleanupLog, SuspiciousIP):
+        model.objects.all().delete()
+    get_stats_cache().invalidate()
+    connections.close_all()
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR, capture_output=True, text=True
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def compare(results, baseline_path):
+    """Imprimir la variación de las métricas principales respecto a otra corrida"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    print("=" * 60)
+    print(f"COMPARACIÓN CON {baseline.get('commit')} ({baseline_path})")
+    for name, result in results['escenarios'].items():
+        previous = baseline.get('escenarios', {}).get(name)
+        if not previous or 'omitido' in result or 'omitido' in previous:
+            continue
+        print(f"{name}:")
+        for key in COMPARED_KEYS:
+            old, new = previous.get(key), result.get(key)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+            print(f"  {key}: {old} -> {new} ({change})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transport', choices=('asgi', 'http'), default='asgi')
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='servidor local (transporte http), con 127.0.0.1 en TRUSTED_PROXIES')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help='webhooks de la ráfaga')
+    parser.add_argument('--polls', type=int, default=2000, help='peticiones de la tormenta de estado')
+    parser.add_argument('--concurrency', type=int, default=50, help='peticiones en vuelo en ráfaga y tormenta')
+    parser.add_argument('--long-webhooks', type=int, default=500, help='long webhooks simultáneos')
+    parser.add_argument('--long-seconds', type=float, default=2.0, help='duración de cada long webhook (asgi)')
+    parser.add_argument('--timeout', type=float, default=120.0, help='timeout por petición (http)')
+    parser.add_argument('--output', help='archivo JSON de resultados (por defecto benchmark_results/)')
+    parser.add_argument('--compare', help='JSON de una corrida anterior para comparar')
+    args = parser.parse_args()
+
+    if args.transport == 'asgi':
+        settings.LONG_WEBHOOK_SECONDS = args.long_seconds
+        if connections['default'].vendor == 'sqlite':
+            # Base de datos temporal para no tocar db.sqlite3
+            connections['default'].settings_dict['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+            connections['default'].settings_dict.setdefault('OPTIONS', {})['timeout'] = 60
+        call_command('migrate', verbosity=0)
+        connections.close_all()
+
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        # La aplicación ASGI instancia el middleware (y su backend) al importarse
+        from connection_manager.asgi import application
+        transport = ASGITransport(application, counter)
+    else:
+        transport = HTTPTransport(args.url, max(args.concurrency, args.long_webhooks), args.timeout)
+
+    # Después de importar la aplicación: get_asgi_application vuelve a aplicar LOGGING
+    # Los errores de las vistas quedan contados en por_status
+    logging.getLogger('webhook_manager').setLevel(logging.ERROR)
+    logging.getLogger('django').setLevel(logging.CRITICAL)
+
+    commit, dirty = git_revision()
+    results = {
+        'commit': commit,
+        'cambios_sin_commit': dirty,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'transporte': transport.name,
+        'url': args.url if transport.name == 'http' else None,
+        'perfil_bd': getattr(settings, 'DATABASE_PROFILE', None),
+        'backend_de_rastreo': settings.CONNECTION_TRACKING_BACKEND,
+        'parametros': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'escenarios': {},
+    }
+
+    print("SUITE DE BENCHMARKS - GESTOR DE CONEXIONES")
+    print("=" * 60)
+    print(f"Commit: {commit}{' (con cambios)' if dirty else ''} - Transporte: {transport.name}")
+
+    for name in args.scenarios:
+        print("-" * 60)
+        print(f"escenario: {name}")
+        if transport.name == 'http' and name in IN_PROCESS_ONLY:
+            result = {'omitido': 'requiere el transporte asgi'}
+        else:
+            if transport.name == 'asgi':
+                reset_state()
+            # Sin las alertas que la limpieza imprime por consola
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = RUNNERS[name](transport, args)
+        results['escenarios'][name] = result
+        for key, value in result.items():
+            print(f"  {key}: {value}")
+
+    output = args.output or os.path.join(
+        BASE_DIR, 'benchmark_results', f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'sin-git'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print("=" * 60)
+    print(f"Resultados guardados en {output}")
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de long webhooks concurrentes sobre la aplicación ASGI.
+
+Llama directamente a connection_manager.asgi.application (sin servidor HTTP)
+con miles de POST a /api/webhook/long/ en paralelo en un solo proceso y un
+solo event loop, y mide cuántos se mantienen abiertos a la vez.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'connection_manager.settings')
+
+import django
+from django.conf import settings
+
+settings.EXPIRY_SCHEDULER_ENABLED = False
+django.setup()
+
+from django.core.management import call_command
+from django.db import connections
+
+
+class InFlight:
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+
+    def enter(self):
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+
+    def exit(self):
+        self.current -= 1
+
+
+async def asgi_post(application, path, payload, client_ip):
+    """Ejecutar un POST contra la aplicación ASGI y devolver el status"""
+    body = json.dumps(payload).encode()
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'headers': [
+            (b'host', b'localhost'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': (client_ip, 50000),
+        'server': ('localhost', 80),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    disconnect = asyncio.Event()
+    status = {}
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status['code'] = message['status']
+
+    try:
+        await application(scope, receive, send)
+    finally:
+        disconnect.set()
+    return status.get('code')
+
+
+async def run_load(application, concurrency, hold_seconds):
+    in_flight = InFlight()
+
+    async def one(i):
+        in_flight.enter()
+        try:
+            return await asgi_post(
+                application,
+                '/api/webhook/long/',
+                {'webhook_id': i, 'source': 'load_test'},
+                f'10.1.{i // 250}.{i % 250}'
+            )
+        finally:
+            in_flight.exit()
+
+    started = time.perf_counter()
+    statuses = await asyncio.gather(*[one(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - started
+
+    return {
+        'webhooks': concurrency,
+        'duracion_simulada_s': hold_seconds,
+        'pico_en_vuelo': in_flight.peak,
+        'respuestas_200': sum(1 for status in statuses if status == 200),
+        'tiempo_total_s': round(elapsed, 2),
+        'tiempo_serial_equivalente_s': concurrency * hold_seconds,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=2000, help='long webhooks simultáneos')
+    parser.add_argument('--hold', type=float, default=5.0, help='segundos que se mantiene cada webhook')
+    parser.add_argument(
+        '--backend',
+        default=settings.CONNECTION_TRACKING_BACKEND,
+        help='backend de rastreo (p. ej. webhook_manager.backends.InMemoryTrackingBackend)'
+    )
+    args = parser.parse_args()
+
+    settings.LONG_WEBHOOK_SECONDS = args.hold
+    settings.CONNECTION_TRACKING_BACKEND = args.backend
+
+    # La aplicación ASGI instancia el middleware (y su backend) al importarse
+    from connection_manager.asgi import application
+    logging.getLogger('webhook_manager').setLevel(logging.ERROR)
+
+    # Base de datos temporal para no tocar db.sqlite3
+    connections['default'].settings_dict['NAME'] = os.path.join(tempfile.mkdtemp(), 'load_test.sqlite3')
+    connections['default'].settings_dict.setdefault('OPTIONS', {})['timeout'] = 60
+    call_command('migrate', verbosity=0)
+    connections.close_all()
+
+    print("PRUEBA DE CARGA - LONG WEBHOOKS ASGI")
+    print("=" * 50)
+    print(f"Backend de rastreo: {args.backend}")
+    result = asyncio.run(run_load(application, args.concurrency, args.hold))
+    for key, value in result.items():
+        print(f"{key}: {value}")
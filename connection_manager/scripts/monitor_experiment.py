@@ -14,6 +14,7 @@ class ExperimentMonitor:
         self.status_url = f"{self.server_url}/api/connections/status/"
         self.stats_url = f"{self.server_url}/api/system/stats/"
         self.cleanup_url = f"{self.server_url}/api/connections/cleanup/"
+        self.stream_url = f"{self.server_url}/api/connections/stream/"
         
     def check_status(self):
         """Verificar estado del sistema"""
@@ -77,6 +78,59 @@ class ExperimentMonitor:
                 
         except KeyboardInterrupt:
             print("\nMonitoreo detenido.")
+    
+    def read_events(self, response):
+        """Recorrer los eventos SSE de una respuesta en streaming"""
+        event = {}
+        for line in response.iter_lines(decode_unicode=True):
+            if line is None:
+                continue
+            if not line:
+                if 'data' in event:
+                    yield event.get('event', 'message'), json.loads(event['data'])
+                event = {}
+            elif line.startswith(':'):
+                continue  # heartbeat
+            else:
+                field, _, value = line.partition(':')
+                event[field] = value.lstrip()
+                if field == 'retry':
+                    self.retry_seconds = int(value) / 1000
+    
+    def monitor_stream(self):
+        """Monitorear con el stream SSE en lugar de consultar el estado en bucle"""
+        print("Iniciando monitoreo por streaming (SSE)...")
+        print("Presiona Ctrl+C para detener")
+        
+        self.retry_seconds = 1
+        state = {}
+        try:
+            while True:
+                try:
+                    with requests.get(self.stream_url, stream=True, timeout=(5, 60)) as response:
+                        for event, data in self.read_events(response):
+                            timestamp = datetime.now().strftime('%H:%M:%S')
+                            if event == 'snapshot' and data == {**state, 'cleanups': []}:
+                                continue  # reconexión sin cambios
+                            
+                            state.update({key: value for key, value in data.items() if key not in ('cleanups', 'timestamp')})
+                            print(f"\n[{timestamp}] {'Estado inicial' if event == 'snapshot' else 'Cambio'}:")
+                            print(f"  Conexiones activas: {state.get('total')}")
+                            print(f"  Conexiones inactivas: {state.get('inactive')}")
+                            print(f"  Conexiones webhook: {state.get('webhook')}")
+                            print(f"  Umbral alcanzado: {state.get('threshold_reached')}")
+                            
+                            for cleanup in data.get('cleanups', []):
+                                print(f"  🧹 Limpieza: {cleanup['connections_closed']} conexiones cerradas "
+                                      f"de {cleanup['inactive_connections_found']} inactivas")
+                except requests.RequestException as e:
+                    print(f"Stream interrumpido: {e}")
+                
+                # El servidor cierra el stream periódicamente: reconectar
+                time.sleep(self.retry_seconds)
+                
+        except KeyboardInterrupt:
+            print("\nMonitoreo detenido.")
 
 if __name__ == "__main__":
     SERVER_URL = "http://35.193.220.139:8080"  # Cambiar por IP de GCP
@@ -89,7 +143,8 @@ if __name__ == "__main__":
     print("2. Ver estadísticas completas")
     print("3. Ejecutar limpieza manual")
     print("4. Monitoreo continuo")
-    print("5. Salir")
+    print("5. Monitoreo por streaming (SSE)")
+    print("6. Salir")
     
     while True:
         try:
@@ -114,6 +169,9 @@ if __name__ == "__main__":
                 monitor.monitor_continuously()
             
             elif option == "5":
+                monitor.monitor_stream()
+            
+            elif option == "6":
                 break
             
             else:
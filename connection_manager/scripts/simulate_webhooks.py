@@ -1,134 +1,480 @@
 #!/usr/bin/env python3
 """
-Script para simular webhooks y probar el experimento de conexiones inactivas
+Script para simular webhooks y probar el experimento de conexiones inactivas.
+
+Generador de carga asyncio de lazo abierto: las llegadas siguen un modelo
+(constant, poisson o ramp) independiente de las respuestas, así un servidor
+lento acumula peticiones en vuelo en lugar de frenar al generador. Las
+peticiones comparten un pool de conexiones HTTP/1.1 keep-alive (solo librería
+estándar), lo que permite decenas de miles de peticiones simultáneas desde un
+proceso.
+
+La latencia se mide desde el instante de llegada programado, incluyendo la
+espera por una conexión libre del pool.
+
+Ejemplos:
+    python scripts/simulate_webhooks.py --url http://127.0.0.1:8000
+    python scripts/simulate_webhooks.py --local --requests 10000 --rate 2000 --arrival poisson
+
+--client-ips reparte las peticiones entre IPs simuladas con X-Forwarded-For.
+El servidor solo acepta esa cabecera de TRUSTED_PROXIES: --local confía en
+127.0.0.1; un servidor externo necesita la IP del generador en esa lista.
 """
 
-import requests
-import threading
-import time
-import random
+import argparse
+import asyncio
 import json
+import os
+import random
+import sys
+import threading
+from collections import Counter
 from datetime import datetime
+from urllib.parse import urlsplit
+
+# Límites de los buckets del histograma de latencia (ms)
+HISTOGRAM_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+
+class HTTPConnectionPool:
+    """Pool de conexiones HTTP/1.1 keep-alive sobre asyncio"""
+
+    def __init__(self, base_url, max_connections=10000):
+        parts = urlsplit(base_url)
+        if parts.scheme != 'http':
+            raise ValueError(f"Solo se soporta http:// ({base_url})")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.host_header = parts.netloc
+        self.base_path = parts.path.rstrip('/')
+        self.limit = asyncio.Semaphore(max_connections)
+        self.idle = []
+        self.opened = 0
+        self.reused = 0
+
+    async def request(self, method, path, payload=None, headers=None, timeout=30.0):
+        """Enviar una petición y devolver (status, cuerpo)"""
+        async with self.limit:
+            for attempt in range(2):
+                reused = bool(self.idle)
+                if reused:
+                    connection = self.idle.pop()
+                    self.reused += 1
+                else:
+                    connection = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+                    self.opened += 1
+
+                try:
+                    status, body, keep_alive = await asyncio.wait_for(
+                        self._exchange(connection, method, path, payload, headers or {}), timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    connection[1].close()
+                    # El servidor pudo cerrar una conexión ociosa: reintentar una vez con una nueva
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    connection[1].close()
+                    raise
+
+                if keep_alive:
+                    self.idle.append(connection)
+                else:
+                    connection[1].close()
+                return status, body
+
+    async def _exchange(self, connection, method, path, payload, headers):
+        reader, writer = connection
+        body = json.dumps(payload).encode() if payload is not None else b''
+        lines = [
+            f"{method} {self.base_path}{path} HTTP/1.1",
+            f"Host: {self.host_header}",
+            "Connection: keep-alive",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("Conexión cerrada por el servidor")
+        version, status = status_line.split(b' ', 2)[:2]
+
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == b'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+        if 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self._read_chunked(reader)
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return int(status), data, keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await reader.readline()
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+
+    def close(self):
+        while self.idle:
+            self.idle.pop()[1].close()
+
+
+def arrival_offsets(model, rate, count, ramp_from=1.0, ramp_seconds=10.0, rng=None):
+    """Instantes de llegada (segundos desde el inicio) según el modelo de lazo abierto"""
+    rng = rng or random.Random()
+    offset = 0.0
+    for _ in range(count):
+        yield offset
+        if model == 'poisson':
+            offset += rng.expovariate(rate)
+        elif model == 'ramp':
+            current = ramp_from + (rate - ramp_from) * min(1.0, offset / ramp_seconds) if ramp_seconds else rate
+            offset += 1.0 / max(current, 0.001)
+        else:
+            offset += 1.0 / rate
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(len(sorted_values) * p)) - 1))
+    return round(sorted_values[index] * 1000, 2)
+
+
+def render_histogram(latencies, width=40):
+    """Histograma de latencias en texto con buckets logarítmicos"""
+    counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+    for latency in latencies:
+        ms = latency * 1000
+        index = next((i for i, bound in enumerate(HISTOGRAM_BOUNDS_MS) if ms <= bound), len(HISTOGRAM_BOUNDS_MS))
+        counts[index] += 1
+
+    peak = max(counts) or 1
+    lines = []
+    for i, count in enumerate(counts):
+        if not count:
+            continue
+        label = f"<= {HISTOGRAM_BOUNDS_MS[i]} ms" if i < len(HISTOGRAM_BOUNDS_MS) else f"> {HISTOGRAM_BOUNDS_MS[-1]} ms"
+        lines.append(f"  {label:>12} | {'#' * max(1, round(count / peak * width)):<{width}} {count}")
+    return lines
+
+
+class LoadResult:
+    """Latencias, status y errores por tipo de webhook"""
+
+    def __init__(self):
+        self.latencies = {'normal': [], 'long': []}
+        self.statuses = {'normal': Counter(), 'long': Counter()}
+        self.scheduler_lag = []
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.elapsed = 0.0
+
+    def summary(self):
+        summary = {}
+        for kind, latencies in self.latencies.items():
+            if not latencies:
+                continue
+            latencies.sort()
+            summary[kind] = {
+                'peticiones': len(latencies),
+                'por_status': dict(self.statuses[kind]),
+                'latencia_p50_ms': percentile(latencies, 0.50),
+                'latencia_p95_ms': percentile(latencies, 0.95),
+                'latencia_p99_ms': percentile(latencies, 0.99),
+                'latencia_max_ms': round(latencies[-1] * 1000, 2),
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        summary['total'] = {
+            'peticiones': total,
+            'peticiones_por_segundo': round(total / self.elapsed, 1) if self.elapsed else None,
+            'pico_en_vuelo': self.peak_in_flight,
+            'retraso_max_del_generador_ms': round(max(self.scheduler_lag, default=0.0) * 1000, 2),
+            'segundos': round(self.elapsed, 2),
+        }
+        return summary
+
 
 class WebhookSimulator:
-    def __init__(self, server_url):
+    def __init__(self, server_url, max_connections=10000, timeout=10.0, long_timeout=60.0, client_ips=0):
         self.server_url = server_url.rstrip('/')
-        self.webhook_url = f"{self.server_url}/api/webhook/"
-        self.long_webhook_url = f"{self.server_url}/api/webhook/long/"
-        self.status_url = f"{self.server_url}/api/connections/status/"
-        
-    def send_webhook(self, webhook_id, data=None, long_webhook=False):
-        """Enviar un webhook individual"""
-        
-        url = self.long_webhook_url if long_webhook else self.webhook_url
-        
-        payload = data or {
+        self.webhook_path = "/api/webhook/"
+        self.long_webhook_path = "/api/webhook/long/"
+        self.status_path = "/api/connections/status/"
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.long_timeout = long_timeout
+        self.client_ips = client_ips
+
+    def client_headers(self, webhook_id):
+        """
+        IP simulada por X-Forwarded-For.
+
+        El middleware solo la usa como IP del cliente si la conexión llega desde
+        TRUSTED_PROXIES: --local ya confía en 127.0.0.1; contra un servidor
+        externo hay que añadir la IP del generador a su TRUSTED_PROXIES o todas
+        las peticiones cuentan como una sola IP.
+        """
+        if not self.client_ips:
+            return {}
+        i = webhook_id % self.client_ips
+        return {'X-Forwarded-For': f"10.{(i // 62500) % 250}.{(i // 250) % 250}.{i % 250}"}
+
+    async def send_webhook(self, pool, result, webhook_id, scheduled, long_webhook=False):
+        """Enviar un webhook individual y registrar su latencia desde la llegada programada"""
+
+        kind = 'long' if long_webhook else 'normal'
+        payload = {
             'webhook_id': webhook_id,
             'timestamp': datetime.now().isoformat(),
             'data': f'Simulación webhook #{webhook_id}',
             'source': 'webhook_simulator'
         }
-        
+
+        loop = asyncio.get_running_loop()
+        result.in_flight += 1
+        result.peak_in_flight = max(result.peak_in_flight, result.in_flight)
         try:
-            print(f"Enviando webhook #{webhook_id} {'(LONG)' if long_webhook else ''} a {url}")
-            
-            response = requests.post(
-                url,
-                json=payload,
-                timeout=60 if long_webhook else 10
+            status, _ = await pool.request(
+                'POST',
+                self.long_webhook_path if long_webhook else self.webhook_path,
+                payload,
+                headers=self.client_headers(webhook_id),
+                timeout=self.long_timeout if long_webhook else self.timeout
             )
-            
-            print(f"Webhook #{webhook_id} - Status: {response.status_code}")
-            return response.status_code == 200
-            
-        except requests.exceptions.Timeout:
-            print(f"Webhook #{webhook_id} - TIMEOUT")
-            return False
+            result.statuses[kind][status] += 1
+        except asyncio.TimeoutError:
+            result.statuses[kind]['TIMEOUT'] += 1
         except Exception as e:
-            print(f"Webhook #{webhook_id} - ERROR: {e}")
-            return False
-    
-    def simulate_inactive_connections(self, num_connections=220):
-        """Simular múltiples conexiones que se volverán inactivas"""
-        
-        print(f"Iniciando simulación de {num_connections} webhooks...")
-        print("Esto creará conexiones que se volverán inactivas después de 30 segundos")
-        
-        threads = []
-        
-        # Crear threads para simular conexiones concurrentes
-        for i in range(num_connections):
-            # 10% de webhooks serán "long webhooks" que tardan más
-            is_long = i % 10 == 0
-            
-            thread = threading.Thread(
-                target=self.send_webhook,
-                args=(i + 1, None, is_long)
-            )
-            
-            threads.append(thread)
-            thread.start()
-            
-            # Pequeña pausa para no saturar el servidor
-            time.sleep(0.1)
-        
-        print(f"Todos los webhooks iniciados. Esperando respuestas...")
-        
-        # Esperar a que terminen todos los webhooks
-        for thread in threads:
-            thread.join()
-        
-        print("Todos los webhooks completados.")
-        print("Esperando 35 segundos para que las conexiones se vuelvan inactivas...")
-        
-        # Esperar para que las conexiones se vuelvan inactivas
-        for i in range(35):
-            print(f"Esperando... {35-i} segundos restantes")
-            time.sleep(1)
-        
-        print("Verificando estado del sistema...")
-        self.check_system_status()
-    
-    def check_system_status(self):
+            result.statuses[kind][type(e).__name__] += 1
+        finally:
+            result.in_flight -= 1
+            result.latencies[kind].append(loop.time() - scheduled)
+
+    async def run_load(self, num_requests, rate, arrival='constant', long_ratio=0.1,
+                       ramp_from=1.0, ramp_seconds=10.0, seed=None):
+        """Lanzar `num_requests` webhooks con llegadas de lazo abierto"""
+
+        rng = random.Random(seed)
+        pool = HTTPConnectionPool(self.server_url, self.max_connections)
+        result = LoadResult()
+        loop = asyncio.get_running_loop()
+        tasks = []
+
+        started = loop.time()
+        for webhook_id, offset in enumerate(arrival_offsets(arrival, rate, num_requests, ramp_from, ramp_seconds, rng), 1):
+            scheduled = started + offset
+            delay = scheduled - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                # Llegadas que el generador no pudo lanzar a tiempo
+                result.scheduler_lag.append(-delay)
+
+            is_long = rng.random() < long_ratio
+            tasks.append(asyncio.create_task(self.send_webhook(pool, result, webhook_id, scheduled, is_long)))
+
+        await asyncio.gather(*tasks)
+        result.elapsed = loop.time() - started
+        pool.close()
+        return result
+
+    async def check_system_status(self):
         """Verificar el estado actual del sistema"""
-        
+
+        pool = HTTPConnectionPool(self.server_url, 1)
         try:
-            response = requests.get(self.status_url)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                print("\n" + "="*50)
-                print("ESTADO DEL SISTEMA")
-                print("="*50)
-                print(f"Conexiones activas totales: {data['total_active_connections']}")
-                print(f"Conexiones inactivas: {data['inactive_connections']}")
-                print(f"Conexiones webhook: {data['webhook_connections']}")
-                print(f"Umbral alcanzado: {data['threshold_reached']}")
-                print(f"Limpieza necesaria: {data['cleanup_needed']}")
-                print("="*50)
-                
-                if data['cleanup_needed']:
-                    print("SISTEMA ACTIVARÁ LIMPIEZA AUTOMÁTICA")
-                    print("El 50% de las conexiones inactivas serán cerradas")
-                
-            else:
-                print(f"Error obteniendo estado: {response.status_code}")
-                
+            status, body = await pool.request('GET', self.status_path, timeout=self.timeout)
         except Exception as e:
             print(f"Error verificando estado: {e}")
+            return None
+        finally:
+            pool.close()
+
+        if status != 200:
+            print(f"Error obteniendo estado: {status}")
+            return None
+
+        data = json.loads(body)
+        print("\n" + "=" * 50)
+        print("ESTADO DEL SISTEMA")
+        print("=" * 50)
+        print(f"Conexiones activas totales: {data['total_active_connections']}")
+        print(f"Conexiones inactivas: {data['inactive_connections']}")
+        print(f"Conexiones webhook: {data['webhook_connections']}")
+        print(f"Umbral alcanzado: {data['threshold_reached']}")
+        print(f"Limpieza necesaria: {data['cleanup_needed']}")
+        print("=" * 50)
+
+        if data['cleanup_needed']:
+            print("SISTEMA ACTIVARÁ LIMPIEZA AUTOMÁTICA")
+            print("El 50% de las conexiones inactivas serán cerradas")
+        return data
+
+    async def simulate_inactive_connections(self, num_connections=220, rate=10.0, wait_inactive=35, **load_options):
+        """Simular múltiples conexiones que se volverán inactivas"""
+
+        print(f"Iniciando simulación de {num_connections} webhooks a {rate}/s ({load_options.get('arrival', 'constant')})...")
+        result = await self.run_load(num_connections, rate, **load_options)
+        print_report(result)
+
+        if wait_inactive:
+            print(f"Esperando {wait_inactive} segundos para que las conexiones se vuelvan inactivas...")
+            await asyncio.sleep(wait_inactive)
+
+        print("Verificando estado del sistema...")
+        await self.check_system_status()
+        return result
+
+
+def print_report(result):
+    summary = result.summary()
+    print("\n" + "=" * 50)
+    print("RESULTADOS DE CARGA")
+    print("=" * 50)
+    for kind in ('normal', 'long'):
+        if kind not in summary:
+            continue
+        print(f"Webhooks {kind}:")
+        for key, value in summary[kind].items():
+            print(f"  {key}: {value}")
+        for line in render_histogram(result.latencies[kind]):
+            print(line)
+    for key, value in summary['total'].items():
+        print(f"{key}: {value}")
+    if summary['total']['retraso_max_del_generador_ms'] > 100:
+        print("AVISO: el generador no mantuvo el ritmo de llegadas; los resultados subestiman la carga")
+
+
+def raise_file_limit():
+    """Subir el límite de descriptores abiertos al máximo permitido (una conexión por petición en vuelo)"""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        return hard
+    except (ImportError, ValueError, OSError):
+        return None
+
+
+def start_local_server(long_seconds):
+    """Levantar la aplicación Django en un hilo del mismo proceso sobre una base temporal"""
+
+    import tempfile
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'connection_manager.settings')
+
+    import django
+    from django.conf import settings
+
+    settings.EXPIRY_SCHEDULER_ENABLED = False
+    settings.LONG_WEBHOOK_SECONDS = long_seconds
+    # El generador conecta por loopback: confiar en su X-Forwarded-For para --client-ips
+    settings.TRUSTED_PROXIES = ['127.0.0.1/32']
+    django.setup()
+
+    import logging
+    from django.core.management import call_command
+    from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+    from django.core.wsgi import get_wsgi_application
+    from django.db import connections
+
+    connections['default'].settings_dict['NAME'] = os.path.join(tempfile.mkdtemp(), 'simulate_webhooks.sqlite3')
+    connections['default'].settings_dict.setdefault('OPTIONS', {})['timeout'] = 60
+    call_command('migrate', verbosity=0)
+    connections.close_all()
+
+    application = get_wsgi_application()
+    logging.getLogger('webhook_manager').setLevel(logging.ERROR)
+    logging.getLogger('django').setLevel(logging.CRITICAL)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=True)
+    server.set_app(application)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
 
 if __name__ == "__main__":
-    # Configurar la URL del servidor
-    SERVER_URL = "http://35.193.220.139:8080"  # Cambiar por la IP externa de GCP
-    
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help='URL del servidor Django')
+    parser.add_argument('--local', action='store_true', help='levantar el servidor en este proceso (base temporal)')
+    parser.add_argument('--requests', type=int, default=220, help='webhooks a enviar')
+    parser.add_argument('--rate', type=float, default=10.0, help='llegadas por segundo (final en ramp)')
+    parser.add_argument('--arrival', choices=('constant', 'poisson', 'ramp'), default='constant')
+    parser.add_argument('--ramp-from', type=float, default=1.0, help='llegadas por segundo al inicio de la rampa')
+    parser.add_argument('--ramp-seconds', type=float, default=10.0, help='duración de la rampa')
+    parser.add_argument('--long-ratio', type=float, default=0.1, help='fracción de long webhooks')
+    parser.add_argument('--long-seconds', type=float, default=45.0, help='duración de los long webhooks (--local)')
+    parser.add_argument('--max-connections', type=int, default=10000, help='conexiones keep-alive del pool')
+    parser.add_argument('--timeout', type=float, default=10.0, help='timeout de webhooks normales')
+    parser.add_argument('--long-timeout', type=float, default=60.0, help='timeout de long webhooks')
+    parser.add_argument('--client-ips', type=int, default=0, help='IPs simuladas por X-Forwarded-For (0 = IP real); con --url, el servidor '
+                             'debe tener la IP del generador en TRUSTED_PROXIES')
+    parser.add_argument('--wait-inactive', type=float, default=35, help='segundos de espera antes de consultar el estado')
+    parser.add_argument('--seed', type=int, help='semilla de llegadas y mezcla de long webhooks')
+    parser.add_argument('--json', help='guardar el resumen en este archivo')
+    args = parser.parse_args()
+
+    file_limit = raise_file_limit()
+    if file_limit and args.max_connections > file_limit:
+        print(f"AVISO: --max-connections {args.max_connections} supera el límite de descriptores ({file_limit})")
+
+    server_url = args.url
+    if args.local:
+        server, server_url = start_local_server(args.long_seconds)
+
     print("SIMULADOR DE WEBHOOKS - EXPERIMENTO DJANGO")
-    print("="*50)
-    
-    simulator = WebhookSimulator(SERVER_URL)
-    
-    # Simular 220 conexiones inactivas
-    simulator.simulate_inactive_connections(220)
-    
+    print("=" * 50)
+    print(f"Servidor: {server_url}")
+
+    simulator = WebhookSimulator(
+        server_url,
+        max_connections=args.max_connections,
+        timeout=args.timeout,
+        long_timeout=args.long_timeout,
+        client_ips=args.client_ips
+    )
+
+    result = asyncio.run(simulator.simulate_inactive_connections(
+        args.requests,
+        args.rate,
+        wait_inactive=args.wait_inactive,
+        arrival=args.arrival,
+        long_ratio=args.long_ratio,
+        ramp_from=args.ramp_from,
+        ramp_seconds=args.ramp_seconds,
+        seed=args.seed
+    ))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(result.summary(), parametros=vars(args)), f, indent=2)
+        print(f"Resumen guardado en {args.json}")
+
+    if args.local:
+        server.shutdown()
+
     print("\nExperimento completado.")
-    print("Revisar logs del servidor Django para ver la limpieza automática.")
\ No newline at end of file
+    print("Revisar logs del servidor Django para ver la limpieza automática.")
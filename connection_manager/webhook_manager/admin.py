@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import ActiveConnection, ConnectionCleanupLog, SuspiciousIP
+from django.template.defaultfilters import linebreaksbr
+from .models import (
+    ActiveConnection, ArchivedCleanupLog, ArchivedConnection, CleanupLease, ConnectionCleanupLog,
+    ConnectionCountBucket, SuspiciousIP, WebhookJob
+)
 
 @admin.register(ActiveConnection)
 class ActiveConnectionAdmin(admin.ModelAdmin):
@@ -12,10 +16,59 @@ class ActiveConnectionAdmin(admin.ModelAdmin):
 class ConnectionCleanupLogAdmin(admin.ModelAdmin):
     list_display = ['timestamp', 'total_connections_before', 'inactive_connections_found', 'connections_closed']
     list_filter = ['timestamp']
-    readonly_fields = ['timestamp']
+    readonly_fields = ['timestamp', 'closed_connections_preview']
+    
+    def get_queryset(self, request):
+        # El listado no necesita la lista empaquetada; el detalle la carga al pedirla
+        return super().get_queryset(request).defer('closed_connections_data')
+    
+    @admin.display(description='Conexiones cerradas')
+    def closed_connections_preview(self, obj):
+        closed = obj.connections_closed_list
+        lines = [
+            f"{conn['connection_id']} - {conn['client_ip']} - {conn['inactive_time']:.1f}s - Webhook: {conn['is_webhook']}"
+            for conn in closed[:50]
+        ]
+        if len(closed) > 50:
+            lines.append(f"... y {len(closed) - 50} más")
+        return linebreaksbr('\n'.join(lines))
 
 @admin.register(SuspiciousIP)
 class SuspiciousIPAdmin(admin.ModelAdmin):
     list_display = ['ip_address', 'connection_count', 'backup_connection_count', 'is_blocked', 'last_seen']
     list_filter = ['is_blocked', 'last_seen']
-    search_fields = ['ip_address']
\ No newline at end of file
+    search_fields = ['ip_address']
+
+@admin.register(CleanupLease)
+class CleanupLeaseAdmin(admin.ModelAdmin):
+    list_display = ['name', 'owner', 'expires_at']
+    readonly_fields = ['name', 'owner', 'expires_at']
+
+@admin.register(WebhookJob)
+class WebhookJobAdmin(admin.ModelAdmin):
+    list_display = ['job_id', 'client_ip', 'status', 'attempts', 'next_attempt_at', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['job_id', 'client_ip']
+    readonly_fields = ['job_id', 'created_at']
+
+@admin.register(ConnectionCountBucket)
+class ConnectionCountBucketAdmin(admin.ModelAdmin):
+    list_display = ['second', 'is_webhook', 'count']
+    list_filter = ['is_webhook']
+    readonly_fields = ['second', 'is_webhook', 'count']
+
+@admin.register(ArchivedConnection)
+class ArchivedConnectionAdmin(admin.ModelAdmin):
+    list_display = ['connection_id', 'client_ip', 'is_webhook', 'last_activity', 'archive_day']
+    list_filter = ['archive_day', 'is_webhook']
+    search_fields = ['client_ip', 'connection_id']
+    date_hierarchy = 'archive_day'
+
+@admin.register(ArchivedCleanupLog)
+class ArchivedCleanupLogAdmin(admin.ModelAdmin):
+    list_display = ['timestamp', 'total_connections_before', 'inactive_connections_found', 'connections_closed']
+    list_filter = ['archive_day']
+    date_hierarchy = 'archive_day'
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('closed_connections_data')
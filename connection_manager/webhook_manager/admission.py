@@ -0,0 +1,242 @@
+"""
+Control de admisión de webhooks en curso por clase de endpoint.
+
+Cada clase de ADMISSION_CLASSES agrupa rutas exactas y admite como mucho
+`max_in_flight` requests a la vez en el proceso. Cuando no hay hueco la
+request espera en una cola acotada (`max_queue`) hasta
+ADMISSION_QUEUE_TIMEOUT segundos; con la cola llena o al vencer la espera
+el middleware responde 503 con Retry-After.
+
+Reparto justo por IP:
+- una IP no puede tener más de `max_per_ip` requests admitidas o en cola en
+  la clase, así que una sola IP no llena la clase ni la cola;
+- cada hueco liberado pasa a la request en cola cuya IP tiene menos requests
+  admitidas (FIFO entre empates): con contención las IPs convergen a partes
+  iguales de la capacidad.
+
+Sirve tanto al camino WSGI (espera en un threading.Event) como al ASGI (espera
+en un Future del event loop). Los límites son por proceso.
+"""
+
+from collections import Counter, deque
+from django.conf import settings
+from . import metrics
+import asyncio
+import itertools
+import threading
+import time
+
+
+def metrics_enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+class AdmissionRejected(Exception):
+    """La request no se admite: `reason` es 'ip_share', 'queue_full' o 'timeout'"""
+
+    def __init__(self, class_name, reason):
+        super().__init__(f"{class_name}: {reason}")
+        self.class_name = class_name
+        self.reason = reason
+
+
+class _Waiter:
+    def __init__(self, client_ip, seq, loop=None):
+        self.client_ip = client_ip
+        self.seq = seq
+        self.granted = False
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionClass:
+    """Capacidad, cola y conteos por IP de una clase de endpoints"""
+
+    def __init__(self, name, max_in_flight, max_per_ip=None, max_queue=0):
+        self.name = name
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_per_ip = int(max_per_ip) if max_per_ip else self.max_in_flight
+        self.max_queue = int(max_queue)
+
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self.in_flight = 0
+        self.by_ip = Counter()  # requests admitidas por IP
+        self.queued_by_ip = Counter()
+        self.waiters = deque()
+
+        self.admitted = 0
+        self.queued = 0
+        self.shed = Counter()
+
+    def try_acquire(self, client_ip, loop=None):
+        """True si se admite ya, un _Waiter si queda en cola; AdmissionRejected si se descarta"""
+        with self._lock:
+            if self.by_ip[client_ip] + self.queued_by_ip[client_ip] >= self.max_per_ip:
+                raise self._reject('ip_share')
+
+            if self.in_flight < self.max_in_flight and not self.waiters:
+                self._grant(client_ip)
+                return True
+
+            if len(self.waiters) >= self.max_queue:
+                raise self._reject('queue_full')
+
+            waiter = _Waiter(client_ip, next(self._seq), loop)
+            self.waiters.append(waiter)
+            self.queued_by_ip[client_ip] += 1
+            self.queued += 1
+            return waiter
+
+    def acquire(self, client_ip, timeout):
+        """Admitir la request bloqueando el hilo hasta `timeout` segundos"""
+        waiter = self.try_acquire(client_ip)
+        if waiter is True:
+            return
+
+        started = time.perf_counter()
+        waiter.event.wait(timeout)
+        self._settle(waiter, started)
+
+    async def aacquire(self, client_ip, timeout):
+        """Admitir la request esperando en el event loop hasta `timeout` segundos"""
+        waiter = self.try_acquire(client_ip, loop=asyncio.get_running_loop())
+        if waiter is True:
+            return
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # Cliente desconectado: salir de la cola o devolver el hueco ya asignado
+            self._abandon(waiter)
+            raise
+        self._settle(waiter, started)
+
+    def release(self, client_ip):
+        with self._lock:
+            self.in_flight -= 1
+            self.by_ip[client_ip] -= 1
+            if not self.by_ip[client_ip]:
+                del self.by_ip[client_ip]
+
+            if self.waiters and self.in_flight < self.max_in_flight:
+                # La IP en cola con menos requests admitidas recibe el hueco
+                waiter = min(self.waiters, key=lambda w: (self.by_ip.get(w.client_ip, 0), w.seq))
+                self.waiters.remove(waiter)
+                self._dequeue(waiter)
+                self._grant(waiter.client_ip)
+                waiter.granted = True
+                waiter.wake()
+
+    def _settle(self, waiter, started):
+        """Tras la espera: admitida si se le asignó hueco, si no sale de la cola y se descarta"""
+        with self._lock:
+            rejected = None
+            if not waiter.granted:
+                self.waiters.remove(waiter)
+                self._dequeue(waiter)
+                rejected = self._reject('timeout')
+
+        if metrics_enabled():
+            metrics.admission_wait.observe(time.perf_counter() - started, (self.name,))
+        if rejected is not None:
+            raise rejected
+
+    def _abandon(self, waiter):
+        with self._lock:
+            if not waiter.granted:
+                self.waiters.remove(waiter)
+                self._dequeue(waiter)
+                return
+        self.release(waiter.client_ip)
+
+    def _grant(self, client_ip):
+        self.in_flight += 1
+        self.by_ip[client_ip] += 1
+        self.admitted += 1
+
+    def _dequeue(self, waiter):
+        self.queued_by_ip[waiter.client_ip] -= 1
+        if not self.queued_by_ip[waiter.client_ip]:
+            del self.queued_by_ip[waiter.client_ip]
+
+    def _reject(self, reason):
+        self.shed[reason] += 1
+        if metrics_enabled():
+            metrics.admission_shed.inc(labels=(self.name, reason))
+        return AdmissionRejected(self.name, reason)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'queued': len(self.waiters),
+                'max_queue': self.max_queue,
+                'max_per_ip': self.max_per_ip,
+                'ips_in_flight': len(self.by_ip),
+                'top_ips': dict(self.by_ip.most_common(5)),
+                'admitted_total': self.admitted,
+                'queued_total': self.queued,
+                'shed_total': dict(self.shed),
+            }
+
+
+class AdmissionController:
+    """Clases de ADMISSION_CLASSES indexadas por ruta exacta"""
+
+    def __init__(self, classes=None, queue_timeout=None):
+        classes = classes if classes is not None else getattr(settings, 'ADMISSION_CLASSES', {})
+        self.queue_timeout = (
+            queue_timeout if queue_timeout is not None
+            else getattr(settings, 'ADMISSION_QUEUE_TIMEOUT', 5.0)
+        )
+        self.classes = {}
+        self.by_path = {}
+        for name, config in classes.items():
+            admission_class = AdmissionClass(
+                name, config['max_in_flight'], config.get('max_per_ip'), config.get('max_queue', 0)
+            )
+            self.classes[name] = admission_class
+            for path in config['paths']:
+                self.by_path[path] = admission_class
+
+    def class_for(self, path):
+        return self.by_path.get(path)
+
+    def stats(self):
+        return {
+            'enabled': True,
+            'queue_timeout': self.queue_timeout,
+            'classes': {name: admission_class.stats() for name, admission_class in self.classes.items()},
+        }
+
+
+_admission_controller = None
+_admission_controller_lock = threading.Lock()
+
+
+def get_admission_controller():
+    """Obtener (y crear si no existe) el control de admisión del proceso"""
+    global _admission_controller
+
+    with _admission_controller_lock:
+        if _admission_controller is None:
+            _admission_controller = AdmissionController()
+        return _admission_controller
@@ -4,4 +4,28 @@ from django.apps import AppConfig
 class WebhookManagerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'webhook_manager'
-    verbose_name = 'Webhook Manager'
\ No newline at end of file
+    verbose_name = 'Webhook Manager'
+    
+    def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from .blocking import sync_suspicious_ip
+        from .db import apply_sqlite_pragmas
+        from .metrics import install_query_recorder
+        from .models import SuspiciousIP
+        
+        # PRAGMA del perfil sqlite-wal en cada conexión nueva
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid='webhook_manager.sqlite_pragmas')
+        
+        # Cambios de SuspiciousIP (admin, etc.) actualizan la lista de IPs bloqueadas del middleware
+        post_save.connect(sync_suspicious_ip, sender=SuspiciousIP, dispatch_uid='webhook_manager.blocklist_save')
+        post_delete.connect(sync_suspicious_ip, sender=SuspiciousIP, dispatch_uid='webhook_manager.blocklist_delete')
+        
+        # Consultas y tiempo en la base de datos por request para /api/metrics/
+        if getattr(settings, 'METRICS_ENABLED', True):
+            connection_created.connect(install_query_recorder, dispatch_uid='webhook_manager.query_metrics')
+        
+        # El planificador y el pool de la cola arrancan con la primera request de
+        # cada proceso (ConnectionTrackingMiddleware), no aquí: con gunicorn --preload
+        # este código corre en el maestro y los workers no heredan sus hilos
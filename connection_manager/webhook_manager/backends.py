@@ -0,0 +1,674 @@
+"""
+Backends de rastreo de conexiones.
+
+ConnectionTrackingMiddleware, ConnectionCleanupService y las vistas acceden a
+las conexiones vivas a través de la interfaz BaseTrackingBackend. El backend se
+elige con settings.CONNECTION_TRACKING_BACKEND:
+
+- ORMTrackingBackend (por defecto): la tabla ActiveConnection es la fuente de
+  verdad, con escritura síncrona o write-behind (CONNECTION_WRITE_BEHIND) y
+  contadores incrementales opcionales (CONNECTION_COUNTERS_ENABLED).
+- InMemoryTrackingBackend: registro en memoria del proceso, particionado por
+  connection_id, que persiste periódicamente en ActiveConnection para el admin
+  y la auditoría.
+"""
+
+from collections import Counter, deque
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .buffer import get_activity_buffer
+from .counters import get_connection_counters
+from .models import ActiveConnection, SuspiciousIP
+from .reputation import get_ip_reputation_cache
+import atexit
+import heapq
+import logging
+import threading
+import uuid
+
+logger = logging.getLogger('webhook_manager')
+
+# Máximo de valores por cláusula IN (límite de parámetros de SQLite)
+LOOKUP_BATCH_SIZE = 500
+
+
+class BaseTrackingBackend:
+    """Interfaz común para registrar y consultar conexiones vivas"""
+
+    # Si record_request accede a la base de datos (en ASGI se ejecuta fuera del event loop)
+    requires_db = True
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout if timeout is not None else getattr(settings, 'CONNECTION_TIMEOUT', 30)
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """Suscribir un objeto con on_activity(connection_id, last_activity) y on_close(connection_ids)"""
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify_activity(self, connection_id, last_activity):
+        for listener in self.listeners:
+            listener.on_activity(connection_id, last_activity)
+
+    def notify_close(self, connection_ids):
+        if connection_ids:
+            for listener in self.listeners:
+                listener.on_close(connection_ids)
+
+    def start(self):
+        """Arrancar tareas en segundo plano del backend (si las tiene)"""
+
+    def stop(self):
+        """Detener tareas en segundo plano y persistir lo pendiente"""
+
+    def record_request(self, client_ip, user_agent, is_webhook, webhook_endpoint):
+        """Registrar la actividad de una request y devolver su connection_id"""
+        raise NotImplementedError
+
+    def active_count(self):
+        """Número de conexiones con estado ACTIVE"""
+        raise NotImplementedError
+
+    def webhook_count(self):
+        """Número de conexiones webhook con estado ACTIVE"""
+        raise NotImplementedError
+
+    def inactive_count(self):
+        """Número de conexiones ACTIVE sin actividad en los últimos `timeout` segundos"""
+        raise NotImplementedError
+
+    def oldest_inactive(self, limit):
+        """
+        Las `limit` conexiones inactivas más antiguas, ordenadas por last_activity,
+        como tuplas (connection_id, client_ip, last_activity, is_webhook)
+        """
+        raise NotImplementedError
+
+    def close(self, connection_ids):
+        """Cerrar las conexiones indicadas y devolver el conjunto de las que se cerraron"""
+        raise NotImplementedError
+
+    def iter_activity(self):
+        """Recorrer (connection_id, last_activity) de todas las conexiones activas"""
+        raise NotImplementedError
+
+    def activity_of(self, connection_ids):
+        """last_activity de las conexiones indicadas que siguen activas, por connection_id"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Conteos de conexiones activas, inactivas y webhook"""
+        return {
+            'total': self.active_count(),
+            'inactive': self.inactive_count(),
+            'webhook': self.webhook_count(),
+        }
+
+
+class ORMTrackingBackend(BaseTrackingBackend):
+    """Backend basado en la tabla ActiveConnection"""
+
+    def __init__(self, timeout=None):
+        super().__init__(timeout)
+
+        # Contadores incrementales opcionales en lugar de recontar en cada lectura
+        self.counters = None
+        if getattr(settings, 'CONNECTION_COUNTERS_ENABLED', False):
+            self.counters = get_connection_counters()
+
+        # Modo write-behind opcional: la actividad se escribe en lotes en segundo plano
+        self.activity_buffer = None
+        if getattr(settings, 'CONNECTION_WRITE_BEHIND', False):
+            self.activity_buffer = get_activity_buffer()
+
+        # Caché de reputación opcional: los incrementos de SuspiciousIP se vuelcan en lotes
+        self.reputation = None
+        if getattr(settings, 'IP_REPUTATION_CACHE_ENABLED', False):
+            self.reputation = get_ip_reputation_cache()
+
+    def start(self):
+        if self.counters is not None:
+            self.counters.start()
+        if self.activity_buffer is not None:
+            self.activity_buffer.start()
+        if self.reputation is not None:
+            self.reputation.start()
+
+    def stop(self):
+        if self.activity_buffer is not None:
+            self.activity_buffer.stop()
+        if self.counters is not None:
+            self.counters.stop()
+        if self.reputation is not None:
+            self.reputation.stop()
+
+    def record_request(self, client_ip, user_agent, is_webhook, webhook_endpoint):
+        if self.activity_buffer is not None:
+            connection_id = self.activity_buffer.record_request(client_ip, user_agent, is_webhook, webhook_endpoint)
+        else:
+            connection_id = self.register_connection(client_ip, user_agent, is_webhook, webhook_endpoint)
+
+        self.notify_activity(connection_id, timezone.now())
+        return connection_id
+
+    def register_connection(self, client_ip, user_agent, is_webhook, webhook_endpoint):
+        """Registrar la conexión de forma síncrona y devolver su connection_id"""
+
+        # CAMBIO CLAVE: Crear SIEMPRE una nueva conexión para webhooks
+        # Esto simula múltiples clientes/sesiones diferentes
+        now = timezone.now()
+        previous = None
+        if is_webhook:
+            # Para webhooks, crear siempre una nueva conexión única
+            connection = ActiveConnection.objects.create(
+                client_ip=client_ip,
+                user_agent=user_agent,
+                webhook_endpoint=webhook_endpoint,
+                is_webhook=True,
+                status='ACTIVE',
+                last_activity=now
+            )
+            logger.info(f"Nueva conexión webhook creada: {connection.connection_id} desde {client_ip}")
+        else:
+            # Para requests normales, una conexión ACTIVE por IP. Con la restricción
+            # única parcial, get_or_create resuelve la carrera entre requests
+            # concurrentes de la misma IP (IntegrityError y lectura de la ganadora);
+            # si la ganadora se cerró antes de leerla, se reintenta una vez.
+            for attempt in range(2):
+                try:
+                    connection, created = ActiveConnection.objects.get_or_create(
+                        client_ip=client_ip,
+                        is_webhook=False,
+                        status='ACTIVE',
+                        defaults={
+                            'user_agent': user_agent,
+                            'webhook_endpoint': webhook_endpoint,
+                            'last_activity': now
+                        }
+                    )
+                    break
+                except IntegrityError:
+                    if attempt:
+                        raise
+
+            if not created:
+                # Actualizar actividad de conexión existente
+                previous = connection.last_activity
+                ActiveConnection.objects.filter(pk=connection.pk).update(last_activity=now)
+
+        if self.counters is not None:
+            self.counters.activity(now, is_webhook, previous)
+
+        # Registrar en IP sospechosas si es necesario
+        if is_webhook:
+            self.track_suspicious_ip(client_ip)
+
+        return connection.connection_id
+
+    def track_suspicious_ip(self, ip_address):
+        """Rastrear IPs que usan webhooks frecuentemente"""
+        try:
+            if self.reputation is not None:
+                # Incremento en la caché; el hilo de volcado lo aplica en lote
+                self.reputation.increment(ip_address)
+            else:
+                # Incremento atómico en una sola sentencia (primario y backup RAID 1)
+                SuspiciousIP.objects.increment(ip_address)
+
+            logger.info(f"RAID 1 Backup: IP {ip_address} actualizada en ambas bases de datos")
+
+        except Exception as e:
+            logger.error(f"Error tracking suspicious IP {ip_address}: {e}")
+
+    def _active(self):
+        return ActiveConnection.objects.filter(status='ACTIVE').order_by()
+
+    def _inactive(self):
+        cutoff = timezone.now() - timedelta(seconds=self.timeout)
+        return self._active().filter(last_activity__lt=cutoff)
+
+    def active_count(self):
+        return self._active().count()
+
+    def webhook_count(self):
+        return self._active().filter(is_webhook=True).count()
+
+    def inactive_count(self):
+        return self._inactive().count()
+
+    def stats(self):
+        if self.counters is not None:
+            # Suma de buckets por segundo: O(buckets) en lugar de O(filas)
+            return self.counters.snapshot(self.timeout)
+
+        # Una sola consulta con agregación condicional
+        cutoff = timezone.now() - timedelta(seconds=self.timeout)
+        counts = self._active().aggregate(
+            total=Count('id'),
+            inactive=Count('id', filter=Q(last_activity__lt=cutoff)),
+            webhook=Count('id', filter=Q(is_webhook=True))
+        )
+        return {key: value or 0 for key, value in counts.items()}
+
+    def oldest_inactive(self, limit):
+        # ORDER BY + LIMIT sobre el índice (status, last_activity)
+        return list(
+            self._inactive().order_by('last_activity').values_list(
+                'connection_id', 'client_ip', 'last_activity', 'is_webhook'
+            )[:limit]
+        )
+
+    def close(self, connection_ids):
+        # UPDATE ... WHERE connection_id IN (...) por lotes
+        connection_ids = list(connection_ids)
+        closed = set()
+        for start in range(0, len(connection_ids), LOOKUP_BATCH_SIZE):
+            batch = connection_ids[start:start + LOOKUP_BATCH_SIZE]
+            try:
+                with transaction.atomic():
+                    # Solo las filas aún ACTIVE (bloqueadas): otro proceso pudo cerrar el resto
+                    rows = list(
+                        ActiveConnection.objects.select_for_update()
+                        .filter(connection_id__in=batch, status='ACTIVE')
+                        .values_list('connection_id', 'last_activity', 'is_webhook')
+                    )
+                    ids = [row[0] for row in rows]
+                    if ids:
+                        ActiveConnection.objects.filter(connection_id__in=ids).update(status='CLOSED')
+                    if self.counters is not None:
+                        # Descontar solo si la transacción exterior se confirma
+                        activity = [row[1:] for row in rows]
+                        transaction.on_commit(lambda activity=activity: self.counters.closed(activity))
+                closed.update(ids)
+            except Exception as e:
+                logger.error(f"Error cerrando lote de {len(batch)} conexiones: {e}")
+
+        self.notify_close(closed)
+        return closed
+
+    def iter_activity(self):
+        return self._active().values_list('connection_id', 'last_activity').iterator(chunk_size=2000)
+
+    def activity_of(self, connection_ids):
+        connection_ids = list(connection_ids)
+        activity = {}
+        for start in range(0, len(connection_ids), LOOKUP_BATCH_SIZE):
+            activity.update(self._active().filter(
+                connection_id__in=connection_ids[start:start + LOOKUP_BATCH_SIZE]
+            ).values_list('connection_id', 'last_activity'))
+        return activity
+
+
+class TrackedConnection:
+    """Estado en memoria de una conexión del registro"""
+
+    __slots__ = (
+        'connection_id', 'client_ip', 'user_agent', 'webhook_endpoint', 'is_webhook',
+        'created_at', 'last_activity', 'status', 'version', 'inactive', 'pk'
+    )
+
+    def __init__(self, connection_id, client_ip, user_agent, webhook_endpoint, is_webhook, now):
+        self.connection_id = connection_id
+        self.client_ip = client_ip
+        self.user_agent = user_agent
+        self.webhook_endpoint = webhook_endpoint
+        self.is_webhook = is_webhook
+        self.created_at = now
+        self.last_activity = now
+        self.status = 'ACTIVE'
+        self.version = 0
+        self.inactive = False
+        self.pk = None
+
+
+class _RegistryShard:
+    """
+    Partición del registro protegida por su propio lock.
+
+    `heap` es un min-heap (last_activity, version, connection_id) de las
+    conexiones activas recientes; al expirar pasan, en orden, a la cola
+    `inactive`. Las entradas obsoletas se descartan comparando la versión.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = {}
+        self.heap = []
+        self.inactive = deque()
+        self.inactive_count = 0
+        self.webhook_count = 0
+        self.dirty = set()
+        self.closed = []
+
+    def push(self, record):
+        record.version += 1
+        heapq.heappush(self.heap, (record.last_activity, record.version, record.connection_id))
+
+    def expire(self, cutoff):
+        """Mover a `inactive` las conexiones con last_activity < cutoff: O(log n) cada una"""
+        while self.heap and self.heap[0][0] < cutoff:
+            last_activity, version, connection_id = heapq.heappop(self.heap)
+            record = self.connections.get(connection_id)
+            if record is None or record.version != version or record.inactive:
+                continue
+            record.inactive = True
+            self.inactive.append((last_activity, version, connection_id))
+            self.inactive_count += 1
+
+    def is_current(self, entry):
+        record = self.connections.get(entry[2])
+        return record is not None and record.inactive and record.version == entry[1]
+
+    def oldest_inactive(self, limit):
+        # Descartar entradas obsoletas al frente de la cola
+        while self.inactive and not self.is_current(self.inactive[0]):
+            self.inactive.popleft()
+
+        oldest = []
+        for entry in self.inactive:
+            if len(oldest) >= limit:
+                break
+            if self.is_current(entry):
+                record = self.connections[entry[2]]
+                oldest.append((record.last_activity, record.connection_id, record.client_ip, record.is_webhook))
+        return oldest
+
+
+class InMemoryTrackingBackend(BaseTrackingBackend):
+    """
+    Registro en memoria particionado por connection_id.
+
+    El estado es local al proceso: con varios workers cada uno lleva su propio
+    registro y ActiveConnection refleja la unión tras cada persistencia.
+    """
+
+    requires_db = False
+
+    def __init__(self, timeout=None, shards=None, persist_interval=None):
+        super().__init__(timeout)
+        shards = shards or getattr(settings, 'CONNECTION_REGISTRY_SHARDS', 16)
+        self.persist_interval = persist_interval or getattr(settings, 'CONNECTION_REGISTRY_PERSIST_INTERVAL', 5.0)
+        self.shards = [_RegistryShard() for _ in range(shards)]
+
+        self._ip_lock = threading.Lock()
+        self._connections_by_ip = {}
+        self._suspicious = Counter()
+        self._persist_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _shard(self, connection_id):
+        return self.shards[connection_id.int % len(self.shards)]
+
+    def _cutoff(self):
+        return timezone.now() - timedelta(seconds=self.timeout)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='connection-registry-persist',
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+        logger.info(f"Registro de conexiones en memoria iniciado ({len(self.shards)} particiones)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.persist()
+
+    def record_request(self, client_ip, user_agent, is_webhook, webhook_endpoint):
+        now = timezone.now()
+
+        if not is_webhook:
+            with self._ip_lock:
+                connection_id = self._connections_by_ip.get(client_ip)
+            if connection_id is not None:
+                shard = self._shard(connection_id)
+                with shard.lock:
+                    record = shard.connections.get(connection_id)
+                    if record is not None:
+                        # Refrescar actividad de conexión existente
+                        if record.inactive:
+                            record.inactive = False
+                            shard.inactive_count -= 1
+                        record.last_activity = now
+                        shard.push(record)
+                        shard.dirty.add(connection_id)
+                if record is not None:
+                    self.notify_activity(connection_id, now)
+                    return connection_id
+
+        connection_id = uuid.uuid4()
+        record = TrackedConnection(connection_id, client_ip, user_agent, webhook_endpoint, is_webhook, now)
+        shard = self._shard(connection_id)
+        with shard.lock:
+            shard.connections[connection_id] = record
+            shard.push(record)
+            shard.dirty.add(connection_id)
+            if is_webhook:
+                shard.webhook_count += 1
+
+        if is_webhook:
+            with self._ip_lock:
+                self._suspicious[client_ip] += 1
+        else:
+            with self._ip_lock:
+                self._connections_by_ip[client_ip] = connection_id
+
+        self.notify_activity(connection_id, now)
+        return connection_id
+
+    def active_count(self):
+        return sum(len(shard.connections) for shard in self.shards)
+
+    def webhook_count(self):
+        return sum(shard.webhook_count for shard in self.shards)
+
+    def inactive_count(self):
+        cutoff = self._cutoff()
+        total = 0
+        for shard in self.shards:
+            with shard.lock:
+                shard.expire(cutoff)
+                total += shard.inactive_count
+        return total
+
+    def oldest_inactive(self, limit):
+        cutoff = self._cutoff()
+        candidates = []
+        for shard in self.shards:
+            with shard.lock:
+                shard.expire(cutoff)
+                candidates.append(shard.oldest_inactive(limit))
+
+        # Mezcla k-way de las colas ya ordenadas de cada partición
+        return [
+            (connection_id, client_ip, last_activity, is_webhook)
+            for last_activity, connection_id, client_ip, is_webhook
+            in heapq.merge(*candidates)
+        ][:limit]
+
+    def close(self, connection_ids):
+        closed = set()
+        for connection_id in connection_ids:
+            shard = self._shard(connection_id)
+            with shard.lock:
+                record = shard.connections.pop(connection_id, None)
+                if record is None:
+                    continue
+                if record.inactive:
+                    shard.inactive_count -= 1
+                if record.is_webhook:
+                    shard.webhook_count -= 1
+                record.status = 'CLOSED'
+                shard.dirty.discard(connection_id)
+                shard.closed.append(record)
+
+            if not record.is_webhook:
+                with self._ip_lock:
+                    if self._connections_by_ip.get(record.client_ip) == connection_id:
+                        del self._connections_by_ip[record.client_ip]
+            closed.add(connection_id)
+
+        self.notify_close(closed)
+        return closed
+
+    def iter_activity(self):
+        for shard in self.shards:
+            with shard.lock:
+                activity = [(record.connection_id, record.last_activity) for record in shard.connections.values()]
+            yield from activity
+
+    def activity_of(self, connection_ids):
+        activity = {}
+        for connection_id in connection_ids:
+            shard = self._shard(connection_id)
+            with shard.lock:
+                record = shard.connections.get(connection_id)
+                if record is not None:
+                    activity[connection_id] = record.last_activity
+        return activity
+
+    def persist(self):
+        """Volcar el registro a ActiveConnection y SuspiciousIP"""
+        with self._persist_lock:
+            records = []
+            taken = []
+            for shard in self.shards:
+                with shard.lock:
+                    dirty, closed = shard.dirty, shard.closed
+                    records.extend(shard.connections[cid] for cid in dirty)
+                    records.extend(closed)
+                    taken.append((shard, dirty, closed))
+                    shard.dirty = set()
+                    shard.closed = []
+            with self._ip_lock:
+                suspicious, self._suspicious = self._suspicious, Counter()
+
+            if not records and not suspicious:
+                return 0
+
+            unsaved = [record for record in records if record.pk is None]
+            try:
+                with transaction.atomic():
+                    self._persist_records(records)
+                    SuspiciousIP.objects.increment_many(suspicious)
+            except Exception as e:
+                # Los pks asignados se perdieron con el rollback: devolver todo al siguiente ciclo
+                for record in unsaved:
+                    record.pk = None
+                for shard, dirty, closed in taken:
+                    with shard.lock:
+                        shard.dirty.update(cid for cid in dirty if cid in shard.connections)
+                        shard.closed[:0] = closed
+                with self._ip_lock:
+                    self._suspicious.update(suspicious)
+                logger.error(f"Error persistiendo registro de conexiones ({len(records)} conexiones): {e}")
+                return 0
+
+            return len(records)
+
+    def _persist_records(self, records):
+        new_records = [record for record in records if record.pk is None]
+
+        # Recuperar pks de conexiones ya persistidas por otra vía
+        if new_records:
+            ids = [record.connection_id for record in new_records]
+            known = {}
+            for start in range(0, len(ids), LOOKUP_BATCH_SIZE):
+                known.update(
+                    ActiveConnection.objects.filter(connection_id__in=ids[start:start + LOOKUP_BATCH_SIZE])
+                    .values_list('connection_id', 'pk')
+                )
+            for record in new_records:
+                record.pk = known.get(record.connection_id)
+
+            # Conexiones normales que otro proceso ya persistió para la misma IP:
+            # se actualiza su fila (una sola ACTIVE por IP, ver ActiveConnection.Meta)
+            ips = [
+                record.client_ip for record in new_records
+                if record.pk is None and not record.is_webhook and record.status == 'ACTIVE'
+            ]
+            existing = {}
+            for start in range(0, len(ips), LOOKUP_BATCH_SIZE):
+                existing.update(
+                    ActiveConnection.objects.filter(
+                        status='ACTIVE', is_webhook=False, client_ip__in=ips[start:start + LOOKUP_BATCH_SIZE]
+                    ).values_list('client_ip', 'pk')
+                )
+            for record in new_records:
+                if record.pk is None and not record.is_webhook and record.status == 'ACTIVE':
+                    record.pk = existing.get(record.client_ip)
+
+        to_create = []
+        to_update = []
+        for record in records:
+            connection = ActiveConnection(
+                pk=record.pk,
+                connection_id=record.connection_id,
+                client_ip=record.client_ip,
+                user_agent=record.user_agent,
+                webhook_endpoint=record.webhook_endpoint,
+                is_webhook=record.is_webhook,
+                status=record.status,
+                created_at=record.created_at,
+                last_activity=record.last_activity
+            )
+            (to_update if record.pk is not None else to_create).append((record, connection))
+
+        if to_create:
+            created = ActiveConnection.objects.bulk_create(
+                [connection for _, connection in to_create],
+                batch_size=LOOKUP_BATCH_SIZE
+            )
+            for (record, _), connection in zip(to_create, created):
+                record.pk = connection.pk
+        if to_update:
+            ActiveConnection.objects.bulk_update(
+                [connection for _, connection in to_update],
+                ['last_activity', 'status'],
+                batch_size=LOOKUP_BATCH_SIZE
+            )
+
+    def _run(self):
+        while not self._stopped.wait(self.persist_interval):
+            close_old_connections()
+            self.persist()
+        close_old_connections()
+
+
+_tracking_backend = None
+_tracking_backend_lock = threading.Lock()
+
+
+def get_tracking_backend():
+    """Obtener (y crear si no existe) el backend de rastreo configurado"""
+    global _tracking_backend
+
+    with _tracking_backend_lock:
+        if _tracking_backend is None:
+            backend_path = getattr(
+                settings,
+                'CONNECTION_TRACKING_BACKEND',
+                'webhook_manager.backends.ORMTrackingBackend'
+            )
+            _tracking_backend = import_string(backend_path)()
+        return _tracking_backend
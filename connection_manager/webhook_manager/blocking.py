@@ -0,0 +1,306 @@
+"""
+Bloqueo de IPs en el camino rápido de ConnectionTrackingMiddleware.
+
+Las IPs con SuspiciousIP.is_blocked y los rangos CIDR de BLOCKED_IP_RANGES se
+cargan en memoria: las direcciones exactas en un set y los rangos en un trie
+binario de prefijos por familia (IPv4 e IPv6), así que comprobar una IP cuesta
+como mucho un paso por bit de prefijo y no toca la base de datos. El
+middleware responde 403 antes de registrar la conexión.
+
+El conjunto se reemplaza de forma atómica: las señales de SuspiciousIP lo
+actualizan en este proceso y cada IP_BLOCKLIST_REFRESH_INTERVAL segundos se
+reconstruye en segundo plano para recoger cambios de otros procesos.
+
+Con IP_AUTOBLOCK_ENABLED, las IPs que suman más de IP_AUTOBLOCK_THRESHOLD
+conexiones (webhooks y conexiones cerradas por la limpieza) en una ventana
+deslizante de IP_AUTOBLOCK_WINDOW segundos se bloquean y se marcan en
+SuspiciousIP.
+"""
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models.signals import post_delete
+from django.utils import timezone
+from . import metrics
+from .iputils import parse_ip
+from .models import SuspiciousIP
+import ipaddress
+import logging
+import threading
+import time
+
+logger = logging.getLogger('webhook_manager')
+
+
+class PrefixTrie:
+    """Trie binario de prefijos de una familia (32 o 128 bits)"""
+
+    def __init__(self, bits):
+        self.bits = bits
+        # Nodo: [hijo 0, hijo 1, red que termina aquí]
+        self.root = [None, None, None]
+        self.size = 0
+
+    def insert(self, network):
+        value = int(network.network_address)
+        node = self.root
+        for i in range(network.prefixlen):
+            bit = (value >> (self.bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            self.size += 1
+        node[2] = network
+
+    def match(self, value):
+        """Red más corta que contiene la dirección (entero), o None"""
+        node = self.root
+        shift = self.bits - 1
+        while node is not None:
+            if node[2] is not None:
+                return node[2]
+            if shift < 0:
+                return None
+            node = node[(value >> shift) & 1]
+            shift -= 1
+        return None
+
+
+class BlockSet:
+    """Instantánea inmutable de direcciones y rangos bloqueados"""
+
+    def __init__(self, addresses=(), networks=(), tries=None):
+        self.addresses = frozenset(addresses)
+        self.networks = tuple(networks)
+        self.tries = tries
+        if tries is None:
+            self.tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+            for network in self.networks:
+                self.tries[network.version].insert(network)
+
+    def match(self, address):
+        """'ip' o 'range' si la dirección está bloqueada, None si no"""
+        if address in self.addresses:
+            return 'ip'
+        trie = self.tries[address.version]
+        if trie.size and trie.match(int(address)) is not None:
+            return 'range'
+        return None
+
+    def with_address(self, address, blocked):
+        addresses = set(self.addresses)
+        if blocked:
+            addresses.add(address)
+        else:
+            addresses.discard(address)
+        # Los rangos no cambian: compartir los tries
+        return BlockSet(addresses, self.networks, self.tries)
+
+
+class SlidingWindowCounter:
+    """
+    Conteo aproximado por clave en una ventana deslizante.
+
+    Guarda por clave el conteo de la ventana fija actual y el de la anterior,
+    y pondera la anterior por la fracción que aún solapa: memoria constante
+    por IP en lugar de un timestamp por conexión.
+    """
+
+    def __init__(self, window, max_keys=100000):
+        self.window = window
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # clave -> [índice de ventana, conteo actual, conteo anterior]
+        self._counts = {}
+
+    def add(self, key, count=1, now=None):
+        """Sumar `count` y devolver el conteo estimado en la ventana"""
+        now = time.monotonic() if now is None else now
+        index = int(now // self.window)
+
+        with self._lock:
+            entry = self._counts.get(key)
+            if entry is None or entry[0] < index - 1:
+                entry = self._counts[key] = [index, 0, 0]
+                if len(self._counts) > self.max_keys:
+                    self._prune(index)
+            elif entry[0] == index - 1:
+                entry[:] = [index, 0, entry[1]]
+            entry[1] += count
+
+            overlap = 1 - (now % self.window) / self.window
+            return entry[2] * overlap + entry[1]
+
+    def discard(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
+
+    def _prune(self, index):
+        for key in [key for key, entry in self._counts.items() if entry[0] < index - 1]:
+            del self._counts[key]
+
+
+class IPBlocklist:
+    """Conjunto de IPs y rangos bloqueados del proceso, con bloqueo automático opcional"""
+
+    def __init__(self, ranges=None, refresh_interval=None, autoblock=None, threshold=None, window=None,
+                 persist_in_background=True):
+        self.ranges = ranges if ranges is not None else getattr(settings, 'BLOCKED_IP_RANGES', [])
+        self.refresh_interval = (
+            refresh_interval if refresh_interval is not None
+            else getattr(settings, 'IP_BLOCKLIST_REFRESH_INTERVAL', 30.0)
+        )
+        self.autoblock = autoblock if autoblock is not None else getattr(settings, 'IP_AUTOBLOCK_ENABLED', False)
+        self.threshold = threshold or getattr(settings, 'IP_AUTOBLOCK_THRESHOLD', 100)
+        self.window = SlidingWindowCounter(window or getattr(settings, 'IP_AUTOBLOCK_WINDOW', 60.0))
+
+        # Marcar SuspiciousIP fuera de la request (puede estar en el event loop)
+        self.persist_in_background = persist_in_background
+
+        self.networks = [ipaddress.ip_network(cidr, strict=False) for cidr in self.ranges]
+        self._blocked = BlockSet(networks=self.networks)
+        self._built_at = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    @property
+    def ready(self):
+        """False hasta la primera carga desde la base de datos"""
+        return self._built_at is not None
+
+    def match(self, ip_address):
+        """'ip' o 'range' si la IP está bloqueada; no consulta la base de datos si ready"""
+        if not self.ready:
+            self.rebuild()
+        elif time.monotonic() - self._built_at > self.refresh_interval:
+            self._refresh_in_background()
+
+        address = parse_ip(ip_address)
+        if address is None:
+            return None
+        return self._blocked.match(address)
+
+    def rebuild(self):
+        """Recargar las IPs bloqueadas de SuspiciousIP y los rangos configurados"""
+        with self._lock:
+            try:
+                addresses = {
+                    address for address in map(
+                        parse_ip, SuspiciousIP.objects.filter(is_blocked=True).values_list('ip_address', flat=True)
+                    ) if address is not None
+                }
+            except Exception as e:
+                # Sin tabla (migraciones pendientes) o base caída: reintentar en el siguiente intervalo
+                logger.error(f"Error cargando IPs bloqueadas: {e}")
+                addresses = set(self._blocked.addresses)
+
+            self._blocked = BlockSet(addresses, self.networks)
+            self._built_at = time.monotonic()
+            return len(addresses)
+
+    def set_blocked(self, ip_address, blocked):
+        """Aplicar en memoria el cambio de una IP (señales de SuspiciousIP)"""
+        address = parse_ip(ip_address)
+        if address is None or not self.ready:
+            return
+        with self._lock:
+            if (address in self._blocked.addresses) != blocked:
+                self._blocked = self._blocked.with_address(address, blocked)
+        if not blocked:
+            self.window.discard(str(address))
+
+    def observe(self, ip_address, count=1):
+        """Sumar conexiones de la IP a la ventana y bloquearla si supera el umbral"""
+        if not self.autoblock:
+            return False
+
+        address = parse_ip(ip_address)
+        if address is None or address in self._blocked.addresses:
+            return False
+
+        recent = self.window.add(str(address), count)
+        if recent < self.threshold:
+            return False
+
+        self.block(ip_address, f"Bloqueo automático: {int(recent)} conexiones en {self.window.window:g}s")
+        return True
+
+    def observe_many(self, counts):
+        for ip_address, count in counts.items():
+            self.observe(ip_address, count)
+
+    def block(self, ip_address, reason):
+        """Bloquear la IP en memoria de inmediato y marcarla en SuspiciousIP"""
+        address = parse_ip(ip_address)
+        with self._lock:
+            if address not in self._blocked.addresses:
+                self._blocked = self._blocked.with_address(address, True)
+
+        metrics.autoblocks.inc()
+        logger.warning(f"IP {ip_address} bloqueada. {reason}")
+
+        note = f"{timezone.now().isoformat()} {reason}"
+        if self.persist_in_background:
+            threading.Thread(target=self._persist_block, args=(ip_address, note, True), daemon=True).start()
+        else:
+            self._persist_block(ip_address, note)
+
+    def _persist_block(self, ip_address, note, close_connection=False):
+        try:
+            # UPDATE directo: la fila no dispara señales ni reconstrucciones
+            updated = SuspiciousIP.objects.filter(ip_address=ip_address).update(is_blocked=True, notes=note)
+            if not updated:
+                with transaction.atomic():
+                    SuspiciousIP.objects.create(ip_address=ip_address, is_blocked=True, notes=note)
+        except IntegrityError:
+            SuspiciousIP.objects.filter(ip_address=ip_address).update(is_blocked=True, notes=note)
+        except Exception as e:
+            logger.error(f"Error marcando la IP bloqueada {ip_address}: {e}")
+        finally:
+            if close_connection:
+                close_old_connections()
+
+    def stats(self):
+        blocked = self._blocked
+        return {
+            'blocked_ips': len(blocked.addresses),
+            'blocked_ranges': len(blocked.networks),
+            'autoblock_enabled': self.autoblock,
+        }
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                self.rebuild()
+            finally:
+                self._refreshing = False
+                close_old_connections()
+
+        threading.Thread(target=refresh, name='ip-blocklist-refresh', daemon=True).start()
+
+
+def sync_suspicious_ip(sender, instance, **kwargs):
+    """Receptor de post_save/post_delete de SuspiciousIP"""
+    if _ip_blocklist is not None:
+        blocked = instance.is_blocked and kwargs.get('signal') is not post_delete
+        _ip_blocklist.set_blocked(instance.ip_address, blocked)
+
+
+_ip_blocklist = None
+_ip_blocklist_lock = threading.Lock()
+
+
+def get_ip_blocklist():
+    """Obtener (y crear si no existe) la lista de bloqueo del proceso"""
+    global _ip_blocklist
+
+    with _ip_blocklist_lock:
+        if _ip_blocklist is None:
+            _ip_blocklist = IPBlocklist()
+        return _ip_blocklist
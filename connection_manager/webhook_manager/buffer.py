@@ -0,0 +1,284 @@
+"""
+Buffer write-behind para la actividad registrada por ConnectionTrackingMiddleware.
+
+Los eventos de actividad se acumulan en memoria y un hilo en segundo plano los
+escribe en lotes (bulk_create / bulk_update), de modo que la latencia de la
+request no depende de las escrituras en la base de datos.
+
+Si la base de datos falla, el lote vuelve al buffer, que sigue acotado a
+`max_size` eventos: se descartan los más antiguos y se cuentan. Tras un fallo
+las requests dejan de vaciar en línea durante `retry_backoff` segundos.
+"""
+
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from . import metrics
+from .models import ActiveConnection, SuspiciousIP
+import atexit
+import logging
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('webhook_manager')
+
+# Máximo de valores por cláusula IN (límite de parámetros de SQLite)
+LOOKUP_BATCH_SIZE = 500
+
+
+class ActivityBuffer:
+    """Buffer acotado de eventos de actividad con vaciado por intervalo o tamaño"""
+    
+    def __init__(self, interval=1.0, batch_size=500, max_size=10000, counters=None, retry_backoff=5.0):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.counters = counters
+        self.retry_backoff = retry_backoff
+        self.dropped = 0
+        self._retry_at = 0.0
+        
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        
+        self._size = 0
+        self._new_connections = []
+        self._touches = {}
+        self._suspicious = Counter()
+        self._connection_ids = {}
+    
+    def start(self):
+        """Iniciar el hilo de vaciado en segundo plano"""
+        if self._thread is not None:
+            return
+        
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='activity-buffer-flusher',
+            daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+        
+        logger.info(f"Buffer write-behind iniciado (intervalo {self.interval}s, lote {self.batch_size})")
+    
+    def stop(self):
+        """Detener el hilo y vaciar todo lo pendiente"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+    
+    def record_request(self, client_ip, user_agent, is_webhook, webhook_endpoint):
+        """Registrar la actividad de una request y devolver su connection_id"""
+        now = timezone.now()
+        
+        with self._lock:
+            if is_webhook:
+                connection_id = uuid.uuid4()
+                self._new_connections.append(ActiveConnection(
+                    connection_id=connection_id,
+                    client_ip=client_ip,
+                    user_agent=user_agent,
+                    webhook_endpoint=webhook_endpoint,
+                    is_webhook=True,
+                    status='ACTIVE',
+                    created_at=now,
+                    last_activity=now
+                ))
+                self._suspicious[client_ip] += 1
+            else:
+                connection_id = self._connection_ids.setdefault(client_ip, uuid.uuid4())
+                self._touches[client_ip] = (now, user_agent, connection_id)
+            
+            self._size += 1
+            size = self._size
+        
+        if size >= self.max_size:
+            if time.monotonic() >= self._retry_at:
+                # Buffer lleno: vaciar en el hilo de la request para no perder actividad
+                self.flush()
+            else:
+                # El último vaciado falló: descartar lo más antiguo en lugar de reintentar en cada request
+                with self._lock:
+                    dropped = self._trim()
+                self._report_dropped(dropped)
+        elif size >= self.batch_size:
+            self._wakeup.set()
+        
+        return connection_id
+    
+    def flush(self):
+        """Escribir en lote todos los eventos pendientes"""
+        with self._flush_lock:
+            with self._lock:
+                new_connections, self._new_connections = self._new_connections, []
+                touches, self._touches = self._touches, {}
+                suspicious, self._suspicious = self._suspicious, Counter()
+                flushed = self._size
+                self._size = 0
+            
+            if not flushed:
+                return 0
+            
+            activity = []
+            try:
+                with transaction.atomic():
+                    if new_connections:
+                        ActiveConnection.objects.bulk_create(new_connections, batch_size=self.batch_size)
+                        activity.extend((connection.last_activity, True, None) for connection in new_connections)
+                    if touches:
+                        activity.extend(self._apply_touches(touches))
+                    if suspicious:
+                        # Incremento atómico: primario y backup RAID 1 en la misma sentencia
+                        SuspiciousIP.objects.increment_many(suspicious)
+            except Exception as e:
+                # Devolver el lote para el siguiente vaciado (lo más reciente prevalece)
+                with self._lock:
+                    self._new_connections[:0] = new_connections
+                    for ip, touch in touches.items():
+                        self._touches.setdefault(ip, touch)
+                    self._suspicious.update(suspicious)
+                    self._size += flushed
+                    dropped = self._trim()
+                self._retry_at = time.monotonic() + self.retry_backoff
+                logger.error(f"Error vaciando buffer de actividad ({flushed} eventos): {e}")
+                self._report_dropped(dropped)
+                return 0
+            
+            self._retry_at = 0.0
+
+            if self.counters is not None:
+                for last_activity, is_webhook, previous in activity:
+                    self.counters.activity(last_activity, is_webhook, previous)
+            
+            return flushed
+    
+    def _trim(self):
+        """Descartar los eventos más antiguos por encima de max_size (con _lock tomado)"""
+        excess = len(self._new_connections) + len(self._touches) - self.max_size
+        if excess <= 0:
+            return 0
+
+        dropped_connections = self._new_connections[:excess]
+        del self._new_connections[:excess]
+        for connection in dropped_connections:
+            self._suspicious[connection.client_ip] -= 1
+            if self._suspicious[connection.client_ip] <= 0:
+                del self._suspicious[connection.client_ip]
+
+        excess -= len(dropped_connections)
+        oldest_touches = sorted(self._touches, key=lambda ip: self._touches[ip][0])[:max(excess, 0)]
+        for ip in oldest_touches:
+            del self._touches[ip]
+
+        dropped = len(dropped_connections) + len(oldest_touches)
+        self.dropped += dropped
+        self._size = max(self._size - dropped, len(self._new_connections) + len(self._touches))
+        return dropped
+
+    def _report_dropped(self, dropped):
+        if not dropped:
+            return
+        if getattr(settings, 'METRICS_ENABLED', True):
+            metrics.write_behind_dropped.inc(dropped)
+        logger.warning(f"Buffer de actividad lleno: {dropped} eventos descartados ({self.dropped} en total)")
+
+    def _apply_touches(self, touches):
+        """
+        Actualizar last_activity de conexiones normales o crearlas si no existen.
+        Devuelve (last_activity, is_webhook, last_activity anterior) por conexión.
+        """
+        ips = list(touches)
+        existing = {}
+        for start in range(0, len(ips), LOOKUP_BATCH_SIZE):
+            for connection in ActiveConnection.objects.filter(
+                status='ACTIVE',
+                is_webhook=False,
+                client_ip__in=ips[start:start + LOOKUP_BATCH_SIZE]
+            ):
+                existing[connection.client_ip] = connection
+        
+        # Ids cacheados sin fila ACTIVE que ya existen: la limpieza cerró esa conexión
+        missing = [connection_id for ip, (_, _, connection_id) in touches.items() if ip not in existing]
+        taken = set()
+        for start in range(0, len(missing), LOOKUP_BATCH_SIZE):
+            taken.update(ActiveConnection.objects.filter(
+                connection_id__in=missing[start:start + LOOKUP_BATCH_SIZE]
+            ).values_list('connection_id', flat=True))
+        
+        to_update = []
+        to_create = []
+        activity = []
+        connection_ids = {}
+        for ip, (last_activity, user_agent, connection_id) in touches.items():
+            connection = existing.get(ip)
+            activity.append((last_activity, False, connection.last_activity if connection else None))
+            if connection is not None:
+                connection.last_activity = last_activity
+                to_update.append(connection)
+                connection_ids[ip] = (connection_id, connection.connection_id)
+            else:
+                new_id = uuid.uuid4() if connection_id in taken else connection_id
+                connection_ids[ip] = (connection_id, new_id)
+                to_create.append(ActiveConnection(
+                    connection_id=new_id,
+                    client_ip=ip,
+                    user_agent=user_agent,
+                    is_webhook=False,
+                    status='ACTIVE',
+                    last_activity=last_activity
+                ))
+        
+        if to_update:
+            ActiveConnection.objects.bulk_update(to_update, ['last_activity'], batch_size=self.batch_size)
+        if to_create:
+            ActiveConnection.objects.bulk_create(to_create, batch_size=self.batch_size)
+        
+        with self._lock:
+            for ip, (cached_id, connection_id) in connection_ids.items():
+                # Solo si ninguna request posterior lo cambió
+                if self._connection_ids.get(ip) == cached_id:
+                    self._connection_ids[ip] = connection_id
+        return activity
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+        close_old_connections()
+
+
+_activity_buffer = None
+_activity_buffer_lock = threading.Lock()
+
+
+def get_activity_buffer():
+    """Obtener (y crear si no existe) el buffer write-behind del proceso"""
+    global _activity_buffer
+    
+    with _activity_buffer_lock:
+        if _activity_buffer is None:
+            counters = None
+            if getattr(settings, 'CONNECTION_COUNTERS_ENABLED', False):
+                from .counters import get_connection_counters
+                counters = get_connection_counters()
+            
+            _activity_buffer = ActivityBuffer(
+                interval=getattr(settings, 'CONNECTION_WRITE_BEHIND_INTERVAL', 1.0),
+                batch_size=getattr(settings, 'CONNECTION_WRITE_BEHIND_BATCH_SIZE', 500),
+                max_size=getattr(settings, 'CONNECTION_WRITE_BEHIND_MAX_SIZE', 10000),
+                counters=counters,
+                retry_backoff=getattr(settings, 'CONNECTION_WRITE_BEHIND_RETRY_BACKOFF', 5.0)
+            )
+        return _activity_buffer
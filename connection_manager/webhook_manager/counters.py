@@ -0,0 +1,166 @@
+"""
+Contadores incrementales de conexiones activas, webhook e inactivas.
+
+Con CONNECTION_COUNTERS_ENABLED, el backend ORM deja de recontar
+ActiveConnection en cada lectura: cada alta, actividad y cierre se traduce en
+deltas sobre buckets de ConnectionCountBucket indexados por el segundo de
+last_activity. Las conexiones inactivas son la suma de los buckets anteriores
+a `ahora - CONNECTION_TIMEOUT`, así que leer cuesta O(buckets) en lugar de
+O(filas), con resolución de un segundo.
+
+Los deltas se acumulan en memoria y un hilo los vuelca periódicamente; las
+lecturas del proceso suman lo pendiente. Las escrituras que no pasan por el
+backend (admin, bulk_create, carreras entre procesos) se corrigen con
+`manage.py reconcile_connection_counters`.
+"""
+
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections
+from .models import ActiveConnection, ConnectionCountBucket
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger('webhook_manager')
+
+
+def bucket_second(moment):
+    """Segundo epoch del bucket al que pertenece un last_activity"""
+    return int(moment.timestamp())
+
+
+class ConnectionCounters:
+    """Deltas pendientes sobre los buckets de conteo y su volcado periódico"""
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or getattr(settings, 'CONNECTION_COUNTERS_FLUSH_INTERVAL', 1.0)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Arrancar el volcado periódico; la primera vez se siembran los buckets"""
+        if self._thread is not None:
+            return
+
+        if not ConnectionCountBucket.objects.exists():
+            self.reconcile()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='connection-counters-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+        logger.info(f"Contadores incrementales de conexiones iniciados (volcado cada {self.flush_interval}s)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def activity(self, last_activity, is_webhook, previous=None):
+        """Conexión nueva (previous=None) o actividad que mueve una conexión de bucket"""
+        with self._lock:
+            if previous is not None:
+                self._pending[(bucket_second(previous), is_webhook)] -= 1
+            self._pending[(bucket_second(last_activity), is_webhook)] += 1
+
+    def closed(self, rows):
+        """Descontar conexiones cerradas dadas como (last_activity, is_webhook)"""
+        with self._lock:
+            for last_activity, is_webhook in rows:
+                self._pending[(bucket_second(last_activity), is_webhook)] -= 1
+
+    def flush(self):
+        """Aplicar en la base de datos los deltas acumulados"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+
+            if not pending:
+                return 0
+
+            try:
+                ConnectionCountBucket.objects.apply_deltas(pending)
+            except Exception as e:
+                # Devolver los deltas para el siguiente volcado
+                with self._lock:
+                    self._pending.update(pending)
+                logger.error(f"Error volcando contadores de conexiones ({len(pending)} buckets): {e}")
+                return 0
+
+            return len(pending)
+
+    def snapshot(self, timeout):
+        """Conteos total, inactivo y webhook a partir de los buckets y lo pendiente"""
+        cutoff_second = int(time.time() - timeout)
+        counts = ConnectionCountBucket.objects.totals(cutoff_second)
+
+        with self._lock:
+            pending = list(self._pending.items())
+        for (second, is_webhook), delta in pending:
+            counts['total'] += delta
+            if second < cutoff_second:
+                counts['inactive'] += delta
+            if is_webhook:
+                counts['webhook'] += delta
+        return counts
+
+    def reconcile(self, dry_run=False):
+        """
+        Comparar los buckets con ActiveConnection y corregir la deriva.
+
+        Devuelve {(segundo, is_webhook): diferencia} de los buckets que no
+        coincidían. La corrección se aplica como deltas, así que no pisa los
+        volcados concurrentes de otros procesos.
+        """
+        self.flush()
+
+        actual = Counter(
+            (bucket_second(last_activity), is_webhook)
+            for last_activity, is_webhook in ActiveConnection.objects.filter(status='ACTIVE')
+            .order_by().values_list('last_activity', 'is_webhook').iterator(chunk_size=2000)
+        )
+        stored = Counter({
+            (second, is_webhook): count
+            for second, is_webhook, count in ConnectionCountBucket.objects.values_list('second', 'is_webhook', 'count')
+        })
+
+        drift = {
+            key: actual[key] - stored[key]
+            for key in set(actual) | set(stored)
+            if actual[key] != stored[key]
+        }
+
+        if drift and not dry_run:
+            ConnectionCountBucket.objects.apply_deltas(drift)
+            logger.warning(f"Contadores de conexiones reconciliados: {len(drift)} buckets corregidos")
+
+        return drift
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            close_old_connections()
+            self.flush()
+        close_old_connections()
+
+
+_connection_counters = None
+_connection_counters_lock = threading.Lock()
+
+
+def get_connection_counters():
+    """Obtener (y crear si no existe) los contadores incrementales del proceso"""
+    global _connection_counters
+
+    with _connection_counters_lock:
+        if _connection_counters is None:
+            _connection_counters = ConnectionCounters()
+        return _connection_counters
@@ -0,0 +1,22 @@
+"""
+Ajustes aplicados a cada conexión de base de datos al crearse.
+
+Con DATABASE_PROFILE=sqlite-wal, settings.SQLITE_PRAGMAS activa WAL,
+synchronous=NORMAL, busy_timeout y mmap en cada conexión SQLite nueva.
+"""
+
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Receptor de connection_created: ejecutar los PRAGMA configurados"""
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    if not pragmas:
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,26 @@
+"""
+Normalización de direcciones IP compartida por el middleware, la lista de
+bloqueo y el formato binario de las limpiezas.
+
+No importa modelos: packing.py lo usa y models.py importa packing.py.
+"""
+
+import ipaddress
+
+
+def parse_ip(ip_address):
+    """ipaddress de una IP en texto (IPv4 mapeada en IPv6 como IPv4), o None si no es válida"""
+    try:
+        address = ipaddress.ip_address(ip_address.strip())
+    except (AttributeError, ValueError):
+        return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+def pack_ip(address):
+    """16 bytes de una IP ya parseada, las IPv4 como ::ffff:a.b.c.d"""
+    if address.version == 4:
+        address = ipaddress.IPv6Address(f'::ffff:{address}')
+    return address.packed
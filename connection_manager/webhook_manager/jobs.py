@@ -0,0 +1,280 @@
+"""
+Cola de trabajos de webhooks respaldada por la tabla WebhookJob.
+
+Con WEBHOOK_QUEUE_ENABLED, webhook_endpoint valida y guarda el payload,
+responde 202 con el job_id y un pool acotado de hilos lo procesa. No requiere
+broker externo: los workers reclaman trabajos con un UPDATE condicional, así
+que varios procesos pueden compartir la misma cola.
+
+Cada reclamo escribe un token nuevo en lease_owner y suma el intento en la
+misma sentencia; el resultado solo se guarda si el token sigue siendo el del
+worker: si el lease venció y otro worker reclamó el trabajo, la escritura del
+primero se descarta. Un trabajo cuyo worker murió en el último intento se marca
+FAILED en lugar de reclamarse otra vez.
+
+El tope WEBHOOK_QUEUE_MAX_SIZE se aplica con WebhookQueueCounter: encolar
+ocupa un hueco con un UPDATE condicional y terminar un trabajo lo libera, sin
+contar la tabla en cada encolado.
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import WebhookJob, WebhookQueueCounter
+import atexit
+import logging
+import random
+import threading
+import time
+import uuid
+
+logger = logging.getLogger('webhook_manager')
+
+# Fila de WebhookQueueCounter de la cola
+QUEUE_NAME = 'webhooks'
+IN_QUEUE = ('PENDING', 'RUNNING')
+
+
+class QueueFull(Exception):
+    """La cola alcanzó WEBHOOK_QUEUE_MAX_SIZE trabajos pendientes"""
+
+
+def process_webhook_payload(payload):
+    """Procesamiento simulado de un webhook (handler por defecto)"""
+    time.sleep(settings.WEBHOOK_PROCESSING_SECONDS)
+    return {
+        'message': 'Webhook procesado correctamente',
+        'data_received': payload
+    }
+
+
+def enqueue_webhook(payload, client_ip=None, connection_id=None, endpoint=''):
+    """Guardar un webhook como trabajo pendiente; lanza QueueFull si no hay capacidad"""
+    max_size = getattr(settings, 'WEBHOOK_QUEUE_MAX_SIZE', 1000)
+
+    with transaction.atomic():
+        # Backpressure: el hueco y el trabajo se confirman (o se deshacen) juntos
+        if not reserve_slot(max_size):
+            raise QueueFull(f"Cola de webhooks llena ({max_size} trabajos)")
+
+        job = WebhookJob.objects.create(
+            client_ip=client_ip,
+            connection_id=connection_id,
+            endpoint=endpoint,
+            payload=payload,
+            max_attempts=getattr(settings, 'WEBHOOK_QUEUE_MAX_ATTEMPTS', 5)
+        )
+    get_worker_pool().notify()
+
+    logger.info(f"Webhook encolado: job {job.job_id} desde {client_ip}")
+    return job
+
+
+def reserve_slot(max_size):
+    """Ocupar un hueco de la cola con un UPDATE condicional; False si está llena"""
+    counter = WebhookQueueCounter.objects.filter(name=QUEUE_NAME)
+    if counter.filter(pending__lt=max_size).update(pending=F('pending') + 1):
+        return True
+
+    # Llena o sin fila: recontar una vez. Corrige la deriva si se borraron
+    # trabajos a mano; el compare-and-set evita pisar encolados concurrentes.
+    observed = counter.values_list('pending', flat=True).first()
+    actual = WebhookJob.objects.filter(status__in=IN_QUEUE).count()
+    if observed is None:
+        try:
+            with transaction.atomic():
+                WebhookQueueCounter.objects.create(name=QUEUE_NAME, pending=actual)
+        except IntegrityError:
+            pass
+    elif actual < observed:
+        counter.filter(pending=observed).update(pending=actual)
+    else:
+        return False
+    return bool(counter.filter(pending__lt=max_size).update(pending=F('pending') + 1))
+
+
+def release_slot(count=1):
+    """Liberar los huecos de trabajos que terminaron (DONE o FAILED)"""
+    WebhookQueueCounter.objects.filter(name=QUEUE_NAME, pending__gte=count).update(pending=F('pending') - count)
+
+
+def retry_delay(attempts):
+    """Backoff exponencial con jitter para el intento número `attempts`"""
+    base = getattr(settings, 'WEBHOOK_QUEUE_RETRY_BACKOFF', 2.0)
+    delay = base * (2 ** (attempts - 1))
+    return delay + random.uniform(0, delay / 2)
+
+
+class WebhookWorkerPool:
+    """Pool acotado de hilos que procesa los trabajos de WebhookJob"""
+
+    def __init__(self, workers=None, poll_interval=None, lease_seconds=None, handler=None):
+        self.workers = workers or getattr(settings, 'WEBHOOK_QUEUE_WORKERS', 4)
+        self.poll_interval = poll_interval or getattr(settings, 'WEBHOOK_QUEUE_POLL_INTERVAL', 0.5)
+        self.lease_seconds = lease_seconds or getattr(settings, 'WEBHOOK_QUEUE_LEASE_SECONDS', 60)
+        self.handler = handler or import_string(
+            getattr(settings, 'WEBHOOK_JOB_HANDLER', 'webhook_manager.jobs.process_webhook_payload')
+        )
+
+        self._wakeup = threading.Condition()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+
+        self._stopped.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'webhook-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        atexit.register(self.stop)
+
+        logger.info(f"Pool de workers de webhooks iniciado ({self.workers} hilos)")
+
+    def stop(self):
+        self._stopped.set()
+        self.notify(all_workers=True)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self, all_workers=False):
+        """Despertar workers cuando se encola un trabajo en este proceso"""
+        with self._wakeup:
+            if all_workers:
+                self._wakeup.notify_all()
+            else:
+                self._wakeup.notify()
+
+    def claim_next(self):
+        """Reclamar el siguiente trabajo listo (o con lease vencido) y devolverlo"""
+        now = timezone.now()
+        self.fail_exhausted(now)
+        candidates = (
+            WebhookJob.objects.filter(status='PENDING', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:self.workers]
+        )
+        stale = (
+            WebhookJob.objects.filter(status='RUNNING', locked_until__lt=now, attempts__lt=F('max_attempts'))
+            .values_list('id', flat=True)[:self.workers]
+        )
+
+        for job_pk in list(candidates) + list(stale):
+            # UPDATE condicional: solo un worker gana cada trabajo
+            claimed = WebhookJob.objects.filter(pk=job_pk).filter(
+                Q(status='PENDING') | Q(status='RUNNING', locked_until__lt=now, attempts__lt=F('max_attempts'))
+            ).update(
+                status='RUNNING',
+                attempts=F('attempts') + 1,
+                locked_until=now + timedelta(seconds=self.lease_seconds),
+                lease_owner=uuid.uuid4().hex,
+                updated_at=now
+            )
+            if claimed:
+                return WebhookJob.objects.get(pk=job_pk)
+        return None
+
+    def fail_exhausted(self, now=None):
+        """Marcar FAILED los trabajos con lease vencido que ya agotaron sus intentos"""
+        now = now or timezone.now()
+        with transaction.atomic():
+            failed = WebhookJob.objects.filter(
+                status='RUNNING', locked_until__lt=now, attempts__gte=F('max_attempts')
+            ).update(
+                status='FAILED', last_error='Lease vencido en el último intento',
+                locked_until=None, lease_owner='', updated_at=now
+            )
+            if failed:
+                release_slot(failed)
+        if failed:
+            logger.error(f"{failed} webhook jobs fallidos: el worker no terminó su último intento")
+        return failed
+
+    def run_job(self, job):
+        """Ejecutar un trabajo reclamado (claim_next ya sumó el intento) y registrar el resultado o el reintento"""
+        try:
+            result = self.handler(job.payload)
+        except Exception as e:
+            now = timezone.now()
+            fields = {'last_error': str(e), 'locked_until': None, 'updated_at': now}
+            if job.attempts >= job.max_attempts:
+                fields['status'] = 'FAILED'
+            else:
+                fields['status'] = 'PENDING'
+                fields['next_attempt_at'] = now + timedelta(seconds=retry_delay(job.attempts))
+            if not self._finish(job, fields):
+                return False
+
+            if job.status == 'FAILED':
+                logger.error(f"Webhook job {job.job_id} fallido tras {job.attempts} intentos: {e}")
+            else:
+                logger.warning(f"Webhook job {job.job_id} reintento {job.attempts}/{job.max_attempts}: {e}")
+            return False
+
+        return self._finish(job, {
+            'status': 'DONE', 'result': result,
+            'locked_until': None, 'updated_at': timezone.now()
+        })
+
+    def _finish(self, job, fields):
+        """Guardar el resultado solo si el lease sigue siendo de este worker"""
+        with transaction.atomic():
+            updated = WebhookJob.objects.filter(pk=job.pk, status='RUNNING', lease_owner=job.lease_owner).update(
+                lease_owner='', **fields
+            )
+            if updated and fields['status'] in ('DONE', 'FAILED'):
+                release_slot()
+        if not updated:
+            logger.warning(f"Webhook job {job.job_id}: lease perdido, otro worker lo reclamó; resultado descartado")
+            return False
+
+        for name, value in fields.items():
+            setattr(job, name, value)
+        job.lease_owner = ''
+        return True
+
+    def run_pending(self):
+        """Procesar en el hilo actual todos los trabajos listos (útil en pruebas y comandos)"""
+        processed = 0
+        while True:
+            job = self.claim_next()
+            if job is None:
+                return processed
+            self.run_job(job)
+            processed += 1
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                job = self.claim_next()
+                if job is not None:
+                    self.run_job(job)
+                    continue
+            except Exception as e:
+                logger.error(f"Error en worker de webhooks: {e}")
+            finally:
+                close_old_connections()
+
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+        connection.close()
+
+
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_worker_pool():
+    """Obtener (y crear si no existe) el pool de workers del proceso"""
+    global _worker_pool
+
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = WebhookWorkerPool()
+        return _worker_pool
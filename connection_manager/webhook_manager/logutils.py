@@ -0,0 +1,207 @@
+"""
+Logging no bloqueante para webhook_manager.
+
+BoundedQueueHandler encola los registros en una cola acotada y un
+QueueListener los escribe en los handlers reales (archivo rotativo y consola)
+desde su propio hilo, así la request no espera la E/S. Si la cola se llena el
+registro se descarta y se cuenta. SamplingFilter limita las líneas por request
+("Actividad registrada", payloads) a unas pocas por segundo y a una muestra del
+resto. Todo se configura en settings.LOGGING, aplicado por configure_logging
+(settings.LOGGING_CONFIG): tras dictConfig resuelve por nombre los handlers de
+destino de cada BoundedQueueHandler.
+
+Este módulo se importa al configurar el logging, antes de cargar las apps: no
+debe importar modelos.
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import copy
+import logging
+import logging.config
+import os
+import queue
+import threading
+import time
+import weakref
+
+# BoundedQueueHandler vivos, para dropped_records() y el reinicio tras fork
+_queue_handlers = weakref.WeakSet()
+_queue_handlers_lock = threading.Lock()
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler con cola acotada y contador de descartes.
+
+    `handlers` son nombres de handlers definidos en el mismo LOGGING;
+    configure_logging los resuelve al terminar dictConfig y se guardan
+    referencias fuertes (los handlers que ningún logger usa directamente solo
+    quedarían en el registro débil de logging). Hasta entonces los registros
+    esperan en la cola. Configurar con la clave '()' para que dictConfig no
+    aplique su tratamiento especial de QueueHandler (Python 3.12+).
+    """
+
+    def __init__(self, handlers=(), maxsize=10000, respect_handler_level=True):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.target_names = tuple(handlers)
+        self.targets = None
+        self.respect_handler_level = respect_handler_level
+        self.listener = None
+        self.dropped = 0
+        self._unreported = 0
+        self._count_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        with _queue_handlers_lock:
+            _queue_handlers.add(self)
+
+    def set_targets(self, targets):
+        """Handlers reales a los que el listener entrega los registros"""
+        with self._start_lock:
+            self.targets = list(targets)
+            if self.listener is not None:
+                self.listener.handlers = tuple(self.targets)
+
+    def start(self):
+        with self._start_lock:
+            if self.listener is not None or self.targets is None:
+                return
+            self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=self.respect_handler_level)
+            self.listener.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Vaciar la cola en los handlers y detener el hilo del listener"""
+        with self._start_lock:
+            if self.listener is not None:
+                self.listener.stop()
+                self.listener = None
+
+    def prepare(self, record):
+        # Sin formatear aquí: los handlers de destino aplican su propio formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._count_lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+
+        if self._unreported:
+            # Avisar de los descartes en cuanto vuelve a haber sitio
+            with self._count_lock:
+                unreported, self._unreported = self._unreported, 0
+                dropped = self.dropped
+            if not unreported:
+                return
+            notice = logging.LogRecord(
+                record.name, logging.WARNING, __file__, 0,
+                f"Cola de logging llena: {unreported} mensajes descartados ({dropped} en total)",
+                None, None
+            )
+            try:
+                self.queue.put_nowait(notice)
+            except queue.Full:
+                with self._count_lock:
+                    self._unreported += unreported
+
+    def emit(self, record):
+        if self.listener is None:
+            self.start()
+        super().emit(record)
+
+    def _reset_after_fork(self):
+        # El hilo del listener no sobrevive al fork (gunicorn --preload): el
+        # proceso hijo arranca el suyo con la primera línea que escriba
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self.listener = None
+        self._count_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Limita los mensajes que empiezan por alguno de `prefixes`.
+
+    Por cada prefijo deja pasar hasta `max_per_second` mensajes por segundo y,
+    superado ese ritmo, uno de cada `sample_every`. El resto de mensajes pasa
+    siempre, igual que cualquier WARNING o superior.
+    """
+
+    def __init__(self, prefixes=(), max_per_second=10, sample_every=100):
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+        self.max_per_second = max_per_second
+        self.sample_every = max(1, sample_every)
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not isinstance(record.msg, str):
+            return True
+
+        prefix = next((prefix for prefix in self.prefixes if record.msg.startswith(prefix)), None)
+        if prefix is None:
+            return True
+
+        second = int(time.monotonic())
+        with self._lock:
+            window_second, count = self._windows.get(prefix, (second, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            count += 1
+            self._windows[prefix] = (window_second, count)
+
+            over_limit = count - self.max_per_second
+            if over_limit <= 0 or over_limit % self.sample_every == 0:
+                return True
+            self.suppressed += 1
+            return False
+
+
+class QueueAwareDictConfigurator(logging.config.DictConfigurator):
+    """DictConfigurator que, al terminar, da a cada BoundedQueueHandler sus handlers de destino"""
+
+    def configure(self):
+        super().configure()
+        handlers = self.config.get('handlers', {})
+        for handler in list(handlers.values()):
+            if not isinstance(handler, BoundedQueueHandler):
+                continue
+            try:
+                handler.set_targets([handlers[name] for name in handler.target_names])
+            except KeyError as exc:
+                raise ValueError(f"Handler de destino desconocido para la cola de logging: {exc}") from None
+
+
+def configure_logging(config):
+    """Función para settings.LOGGING_CONFIG: dictConfig más la resolución de destinos de las colas"""
+    QueueAwareDictConfigurator(config).configure()
+
+
+def dropped_records():
+    """Registros descartados por colas llenas en todos los BoundedQueueHandler"""
+    with _queue_handlers_lock:
+        handlers = list(_queue_handlers)
+    return sum(handler.dropped for handler in handlers)
+
+
+def _reset_after_fork():
+    global _queue_handlers_lock
+
+    _queue_handlers_lock = threading.Lock()
+    for handler in list(_queue_handlers):
+        handler._reset_after_fork()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
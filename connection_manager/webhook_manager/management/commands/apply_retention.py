@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from webhook_manager.retention import RetentionService
+
+
+class Command(BaseCommand):
+    help = (
+        'Mueve al archivo por lotes las conexiones CLOSED y los logs de limpieza vencidos, '
+        'y borra los trabajos de webhooks terminados'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Filas por transacción (RETENTION_BATCH_SIZE)')
+        parser.add_argument('--max-batches', type=int, help='Máximo de lotes por tabla en esta ejecución')
+        parser.add_argument(
+            '--closed-age', type=int,
+            help='Antigüedad mínima en segundos de las conexiones CLOSED (RETENTION_CLOSED_CONNECTIONS_SECONDS)'
+        )
+        parser.add_argument(
+            '--log-age', type=int,
+            help='Antigüedad mínima en segundos de los logs de limpieza (RETENTION_CLEANUP_LOG_SECONDS)'
+        )
+        parser.add_argument(
+            '--job-age', type=int,
+            help='Antigüedad mínima en segundos de los trabajos DONE/FAILED (RETENTION_WEBHOOK_JOBS_SECONDS)'
+        )
+        parser.add_argument('--pause', type=float, help='Segundos de pausa entre lotes (RETENTION_BATCH_PAUSE)')
+        parser.add_argument('--delete-only', action='store_true', help='Borrar sin copiar a las tablas de archivo')
+        parser.add_argument('--dry-run', action='store_true', help='Solo contar las filas vencidas')
+
+    def handle(self, *args, **options):
+        service = RetentionService(
+            batch_size=options['batch_size'],
+            archive=False if options['delete_only'] else None,
+            closed_connection_age=options['closed_age'],
+            cleanup_log_age=options['log_age'],
+            batch_pause=options['pause'],
+            webhook_job_age=options['job_age']
+        )
+
+        report = service.run(max_batches=options['max_batches'], dry_run=options['dry_run'])
+
+        for name, result in report.items():
+            if options['dry_run']:
+                self.stdout.write(f"{name}: {result['pendientes']} filas vencidas")
+                continue
+            action = 'archivadas' if result['archivadas'] else 'borradas'
+            self.stdout.write(
+                f"{name}: {result['filas']} filas {action} en {result['lotes']} lotes, "
+                f"{result['segundos']}s ({result['filas_por_segundo']} filas/s)"
+            )
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Retención aplicada'))
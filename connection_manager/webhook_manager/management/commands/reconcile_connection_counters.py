@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from webhook_manager.counters import get_connection_counters
+from webhook_manager.models import ConnectionCountBucket
+
+
+class Command(BaseCommand):
+    help = 'Compara los contadores incrementales con ActiveConnection y corrige la deriva'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo informar la deriva, sin corregir los buckets'
+        )
+
+    def handle(self, *args, **options):
+        counters = get_connection_counters()
+        timeout = getattr(settings, 'CONNECTION_TIMEOUT', 30)
+
+        before = counters.snapshot(timeout)
+        drift = counters.reconcile(dry_run=options['dry_run'])
+
+        self.stdout.write(
+            f"Contadores: {before['total']} activas, {before['inactive']} inactivas, "
+            f"{before['webhook']} webhook ({ConnectionCountBucket.objects.count()} buckets)"
+        )
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Sin deriva: los contadores coinciden con ActiveConnection'))
+            return
+
+        self.stdout.write(
+            f"Deriva en {len(drift)} buckets (diferencia total {sum(drift.values()):+d})"
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Modo --dry-run: no se corrigió nada'))
+            return
+
+        after = counters.snapshot(timeout)
+        self.stdout.write(self.style.SUCCESS(
+            f"Corregido: {after['total']} activas, {after['inactive']} inactivas, {after['webhook']} webhook"
+        ))
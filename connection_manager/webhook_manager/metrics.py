@@ -0,0 +1,292 @@
+"""
+Métricas del camino de las requests en formato de texto de Prometheus.
+
+Cada métrica agrega por hilo: las observaciones escriben en un diccionario
+local del hilo sin locks, y solo la exposición en /api/metrics/ suma las
+particiones de todos los hilos. Las particiones de hilos terminados se pliegan
+en una partición común para que los servidores que crean un hilo por conexión
+no acumulen memoria.
+
+Las consultas a la base de datos se atribuyen a la request en curso con un
+execute_wrapper instalado en cada conexión y una ContextVar, que asgiref
+propaga a los hilos de sync_to_async.
+"""
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from django.conf import settings
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+ROWS_BUCKETS = (0, 10, 100, 1000, 10000, 100000)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labelnames, labels, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base con particiones por hilo"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+        self._retired = {}
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _merge(self, target, source):
+        raise NotImplementedError
+
+    def snapshot(self):
+        """Suma de todas las particiones: {labels: valor}"""
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # El hilo ya no escribe: plegar su partición de forma definitiva
+                    self._merge(self._retired, shard)
+            self._shards = alive
+
+            total = {}
+            self._merge(total, self._retired)
+            for _, shard in alive:
+                self._merge(total, dict(shard))
+        return total
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in sorted(self.snapshot().items()):
+            lines.append(f'{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, target, source):
+        for labels, value in source.items():
+            target[labels] = target.get(labels, 0) + value
+
+
+class Gauge(Counter):
+    """Gauge de incrementos y decrementos (se suman entre hilos igual que un contador)"""
+    kind = 'gauge'
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def _merge(self, target, source):
+        for labels, (counts, total) in source.items():
+            merged = target.get(labels)
+            if merged is None:
+                merged = target[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            for i, count in enumerate(list(counts)):
+                merged[0][i] += count
+            merged[1] += total
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, (counts, total) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = f'le="{format_value(float(bound))}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class GaugeFunction(Metric):
+    """Gauge calculado al exponer las métricas"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def snapshot(self):
+        return {(): self.function()}
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+LATENCY_BUCKETS = tuple(getattr(settings, 'METRICS_LATENCY_BUCKETS', DEFAULT_LATENCY_BUCKETS))
+
+request_duration = REGISTRY.register(Histogram(
+    'webhook_manager_request_duration_seconds',
+    'Duración de las requests por endpoint, método y status',
+    ('endpoint', 'method', 'status'),
+    LATENCY_BUCKETS
+))
+request_db_queries = REGISTRY.register(Histogram(
+    'webhook_manager_request_db_queries',
+    'Consultas a la base de datos por request',
+    ('endpoint',),
+    QUERY_COUNT_BUCKETS
+))
+request_db_duration = REGISTRY.register(Histogram(
+    'webhook_manager_request_db_duration_seconds',
+    'Tiempo en la base de datos por request',
+    ('endpoint',),
+    LATENCY_BUCKETS
+))
+tracking_duration = REGISTRY.register(Histogram(
+    'webhook_manager_tracking_duration_seconds',
+    'Tiempo del registro de actividad en ConnectionTrackingMiddleware',
+    (),
+    LATENCY_BUCKETS
+))
+write_behind_dropped = REGISTRY.register(Counter(
+    'webhook_manager_write_behind_dropped_total',
+    'Eventos de actividad descartados por el buffer write-behind lleno',
+))
+webhooks_in_flight = REGISTRY.register(Gauge(
+    'webhook_manager_webhooks_in_flight',
+    'Requests webhook en curso',
+))
+blocked_requests = REGISTRY.register(Counter(
+    'webhook_manager_blocked_requests_total',
+    'Requests rechazadas con 403 por IP o rango bloqueado',
+    ('reason',)
+))
+rate_limited_requests = REGISTRY.register(Counter(
+    'webhook_manager_rate_limited_requests_total',
+    'Requests rechazadas con 429 por el límite de tasa, por endpoint',
+    ('endpoint',)
+))
+admission_shed = REGISTRY.register(Counter(
+    'webhook_manager_admission_shed_total',
+    'Requests rechazadas con 503 por el control de admisión, por clase y motivo',
+    ('class', 'reason')
+))
+admission_wait = REGISTRY.register(Histogram(
+    'webhook_manager_admission_wait_seconds',
+    'Espera en la cola del control de admisión',
+    ('class',),
+    LATENCY_BUCKETS
+))
+autoblocks = REGISTRY.register(Counter(
+    'webhook_manager_autoblocks_total',
+    'IPs bloqueadas por la política de ventana deslizante',
+))
+cleanup_duration = REGISTRY.register(Histogram(
+    'webhook_manager_cleanup_duration_seconds',
+    'Duración de las limpiezas de conexiones ejecutadas',
+    (),
+    LATENCY_BUCKETS
+))
+cleanup_rows_closed = REGISTRY.register(Histogram(
+    'webhook_manager_cleanup_rows_closed',
+    'Conexiones cerradas por limpieza',
+    (),
+    ROWS_BUCKETS
+))
+cleanups = REGISTRY.register(Counter(
+    'webhook_manager_cleanups_total',
+    'Limpiezas evaluadas, por si se ejecutaron',
+    ('executed',)
+))
+
+
+def _dropped_log_records():
+    from .logutils import dropped_records
+    return dropped_records()
+
+
+REGISTRY.register(GaugeFunction(
+    'webhook_manager_log_records_dropped',
+    'Registros de log descartados por la cola de logging llena',
+    _dropped_log_records
+))
+
+
+# Acumulador [consultas, segundos] de la request en curso
+current_request_queries = ContextVar('current_request_queries', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper: atribuir cada consulta a la request en curso"""
+    totals = current_request_queries.get()
+    if totals is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        totals[0] += 1
+        totals[1] += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """Receptor de connection_created"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
@@ -1,17 +1,65 @@
 # webhook_manager/middleware.py - VERSIÓN CORREGIDA
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
 from django.utils.deprecation import MiddlewareMixin
-from django.utils import timezone
-from .models import ActiveConnection, SuspiciousIP
+from . import metrics
+from .admission import AdmissionRejected, get_admission_controller
+from .backends import get_tracking_backend
+from .blocking import get_ip_blocklist
+from .iputils import parse_ip
+from .ratelimit import get_rate_limiter
+from .scheduler import ensure_background_tasks
+import ipaddress
 import logging
-import threading
-import uuid
+import math
+import time
 
 logger = logging.getLogger('webhook_manager')
 
 class ConnectionTrackingMiddleware(MiddlewareMixin):
     """Middleware para rastrear conexiones activas - VERSIÓN CORREGIDA"""
     
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        
+        # El registro de conexiones se delega al backend configurado
+        self.tracking_backend = get_tracking_backend()
+        self.tracking_backend.start()
+        self.metrics_enabled = getattr(settings, 'METRICS_ENABLED', True)
+        
+        # Solo se lee X-Forwarded-For cuando la conexión viene de uno de estos proxies
+        self.trusted_proxies = [
+            ipaddress.ip_network(cidr, strict=False) for cidr in getattr(settings, 'TRUSTED_PROXIES', [])
+        ]
+        
+        # IPs y rangos bloqueados en memoria: se rechazan antes de escribir nada
+        self.blocklist = get_ip_blocklist() if getattr(settings, 'IP_BLOCKING_ENABLED', True) else None
+        
+        # Token buckets por IP y endpoint: 429 antes de registrar la conexión
+        self.rate_limiter = get_rate_limiter() if getattr(settings, 'RATE_LIMIT_ENABLED', False) else None
+        
+        # Tope de webhooks en curso por clase de endpoint: cola acotada y 503
+        self.admission = get_admission_controller() if getattr(settings, 'ADMISSION_CONTROL_ENABLED', False) else None
+    
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        
+        ensure_background_tasks()
+        started, token = self.begin_metrics(request)
+        response = None
+        try:
+            response = self.reject_blocked(request) or self.reject_rate_limited(request) or self.admit(request)
+            if response is None:
+                self.process_request(request)
+                response = self.get_response(request)
+        finally:
+            self.release_admission(request)
+            self.end_metrics(request, response, started, token)
+        return response
+    
     def process_request(self, request):
         # Obtener información del cliente
         client_ip = self.get_client_ip(request)
@@ -21,74 +69,199 @@ class ConnectionTrackingMiddleware(MiddlewareMixin):
         is_webhook = '/webhook/' in request.path or 'webhook' in request.path.lower()
         webhook_endpoint = request.path if is_webhook else ''
         
-        # CAMBIO CLAVE: Crear SIEMPRE una nueva conexión para webhooks
-        # Esto simula múltiples clientes/sesiones diferentes
-        if is_webhook:
-            # Para webhooks, crear siempre una nueva conexión única
-            connection = ActiveConnection.objects.create(
-                client_ip=client_ip,
-                user_agent=user_agent,
-                webhook_endpoint=webhook_endpoint,
-                is_webhook=True,
-                status='ACTIVE',
-                last_activity=timezone.now()
-            )
-            created = True
-            logger.info(f"Nueva conexión webhook creada: {connection.connection_id} desde {client_ip}")
-        else:
-            # Para requests normales, usar la lógica original
-            connection, created = ActiveConnection.objects.get_or_create(
-                client_ip=client_ip,
-                is_webhook=False,
-                status='ACTIVE',
-                defaults={
-                    'user_agent': user_agent,
-                    'webhook_endpoint': webhook_endpoint,
-                    'last_activity': timezone.now()
-                }
-            )
-            
-            if not created:
-                # Actualizar actividad de conexión existente
-                connection.last_activity = timezone.now()
-                connection.save()
+        if self.metrics_enabled and is_webhook:
+            metrics.webhooks_in_flight.inc()
+            request.counted_in_flight = True
+        
+        tracking_started = time.perf_counter()
+        connection_id = self.tracking_backend.record_request(
+            client_ip, user_agent, is_webhook, webhook_endpoint
+        )
+        if self.metrics_enabled:
+            metrics.tracking_duration.observe(time.perf_counter() - tracking_started)
         
-        # Registrar en IP sospechosas si es necesario
-        if is_webhook:
-            self.track_suspicious_ip(client_ip)
+        if is_webhook and self.blocklist is not None:
+            # Política de bloqueo automático por ventana deslizante
+            self.blocklist.observe(client_ip)
         
         # Agregar información a la request
-        request.connection_id = connection.connection_id
+        request.connection_id = connection_id
         request.is_webhook = is_webhook
         
-        logger.info(f"Actividad registrada: {client_ip} - Webhook: {is_webhook} - Conexión: {connection.connection_id}")
+        logger.info(f"Actividad registrada: {client_ip} - Webhook: {is_webhook} - Conexión: {connection_id}")
         
         return None
     
-    def get_client_ip(self, request):
-        """Obtener la IP real del cliente"""
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-        return ip
-    
-    def track_suspicious_ip(self, ip_address):
-        """Rastrear IPs que usan webhooks frecuentemente"""
+    async def __acall__(self, request):
+        """Ruta ASGI: solo se sale del event loop si el backend escribe en la base de datos"""
+        ensure_background_tasks()
+        started, token = self.begin_metrics(request)
+        response = None
         try:
-            suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-                ip_address=ip_address,
-                defaults={'connection_count': 1}
-            )
+            if self.blocklist is not None and not self.blocklist.ready:
+                # Primera carga de la lista de bloqueo fuera del event loop
+                await sync_to_async(self.blocklist.rebuild, thread_sensitive=True)()
             
-            if not created:
-                suspicious_ip.connection_count += 1
-                suspicious_ip.last_seen = timezone.now()
-                suspicious_ip.save()
-                
-                # RAID 1 simulado - backup automático
-                logger.info(f"RAID 1 Backup: IP {ip_address} actualizada en ambas bases de datos")
-                
-        except Exception as e:
-            logger.error(f"Error tracking suspicious IP {ip_address}: {e}")
\ No newline at end of file
+            response = self.reject_blocked(request)
+            if response is None and self.rate_limiter is not None and self.rate_limiter.rule_for(request.path):
+                if self.rate_limiter.requires_io:
+                    # Buckets en una caché externa: no bloquear el event loop
+                    response = await sync_to_async(self.reject_rate_limited, thread_sensitive=False)(request)
+                else:
+                    response = self.reject_rate_limited(request)
+            if response is None:
+                response = await self.aadmit(request)
+            if response is None:
+                if self.tracking_backend.requires_db:
+                    await sync_to_async(self.process_request, thread_sensitive=True)(request)
+                else:
+                    self.process_request(request)
+                response = await self.get_response(request)
+        finally:
+            self.release_admission(request)
+            self.end_metrics(request, response, started, token)
+        return response
+    
+    def reject_blocked(self, request):
+        """403 sin tocar la base de datos si la IP o su rango están bloqueados"""
+        if self.blocklist is None:
+            return None
+        
+        client_ip = self.get_client_ip(request)
+        reason = self.blocklist.match(client_ip)
+        if reason is None:
+            return None
+        
+        if self.metrics_enabled:
+            metrics.blocked_requests.inc(labels=(reason,))
+        logger.info(f"Petición bloqueada: {client_ip} ({reason})")
+        return JsonResponse({'status': 'blocked', 'message': 'IP bloqueada'}, status=403)
+    
+    def reject_rate_limited(self, request):
+        """429 con Retry-After si la IP agotó su bucket en este endpoint"""
+        if self.rate_limiter is None or self.rate_limiter.rule_for(request.path) is None:
+            return None
+        
+        client_ip = self.get_client_ip(request)
+        wait = self.rate_limiter.check(request.path, client_ip)
+        if not wait:
+            return None
+        
+        if self.metrics_enabled:
+            metrics.rate_limited_requests.inc(labels=(request.path,))
+        logger.info(f"Petición limitada: {client_ip} en {request.path} ({wait:.2f}s)")
+        
+        retry_after = max(1, math.ceil(wait))
+        response = JsonResponse(
+            {'status': 'rate_limited', 'message': 'Demasiadas solicitudes', 'retry_after': retry_after},
+            status=429
+        )
+        response['Retry-After'] = str(retry_after)
+        return response
+    
+    def admit(self, request):
+        """Reservar hueco en la clase de admisión del endpoint, esperando en la cola si hace falta"""
+        admission_class = self.admission.class_for(request.path) if self.admission is not None else None
+        if admission_class is None:
+            return None
+        
+        client_ip = self.get_client_ip(request)
+        try:
+            admission_class.acquire(client_ip, self.admission.queue_timeout)
+        except AdmissionRejected as e:
+            return self.shed(request, client_ip, e)
+        request.admission = (admission_class, client_ip)
+        return None
+    
+    async def aadmit(self, request):
+        """admit() para ASGI: la espera en cola no ocupa hilos"""
+        admission_class = self.admission.class_for(request.path) if self.admission is not None else None
+        if admission_class is None:
+            return None
+        
+        client_ip = self.get_client_ip(request)
+        try:
+            await admission_class.aacquire(client_ip, self.admission.queue_timeout)
+        except AdmissionRejected as e:
+            return self.shed(request, client_ip, e)
+        request.admission = (admission_class, client_ip)
+        return None
+    
+    def release_admission(self, request):
+        admission = getattr(request, 'admission', None)
+        if admission is not None:
+            admission[0].release(admission[1])
+            request.admission = None
+    
+    def shed(self, request, client_ip, rejection):
+        """503 con Retry-After para la request descartada por el control de admisión"""
+        logger.info(f"Petición descartada: {client_ip} en {request.path} ({rejection.reason})")
+        
+        response = JsonResponse({
+            'status': 'overloaded',
+            'message': 'Servidor saturado, reintente más tarde',
+            'reason': rejection.reason
+        }, status=503)
+        response['Retry-After'] = str(getattr(settings, 'ADMISSION_RETRY_AFTER', 5))
+        return response
+    
+    def begin_metrics(self, request):
+        """Abrir el acumulador de consultas de la request (en el contexto que verán las vistas)"""
+        if not self.metrics_enabled:
+            return None, None
+        return time.perf_counter(), metrics.current_request_queries.set([0, 0.0])
+    
+    def end_metrics(self, request, response, started, token):
+        """Latencia por endpoint, consultas a la base de datos y gauge de webhooks en curso"""
+        if started is None:
+            return
+        
+        elapsed = time.perf_counter() - started
+        queries, db_seconds = metrics.current_request_queries.get()
+        metrics.current_request_queries.reset(token)
+        
+        match = request.resolver_match
+        endpoint = (match.url_name or match.route) if match else 'unmatched'
+        status = str(response.status_code) if response is not None else '500'
+        
+        metrics.request_duration.observe(elapsed, (endpoint, request.method, status))
+        metrics.request_db_queries.observe(queries, (endpoint,))
+        metrics.request_db_duration.observe(db_seconds, (endpoint,))
+        
+        if getattr(request, 'counted_in_flight', False):
+            metrics.webhooks_in_flight.dec()
+    
+    def get_client_ip(self, request):
+        """
+        Obtener la IP real del cliente.
+        
+        X-Forwarded-For solo cuenta si REMOTE_ADDR es un proxy de
+        TRUSTED_PROXIES; entonces se recorre de derecha a izquierda y el
+        cliente es el primer salto que no es de confianza. Lo que hay a su
+        izquierda lo pone el propio cliente y se ignora. Un salto que no es una
+        IP corta el recorrido.
+        """
+        client_ip = getattr(request, 'client_ip', None)
+        if client_ip is None:
+            client_ip = request.client_ip = self.resolve_client_ip(request.META)
+        return client_ip
+    
+    def resolve_client_ip(self, meta):
+        remote_addr = meta.get('REMOTE_ADDR')
+        address = parse_ip(remote_addr)
+        if address is None:
+            return remote_addr
+        
+        x_forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+        if x_forwarded_for and self.is_trusted_proxy(address):
+            for hop in reversed(x_forwarded_for.split(',')):
+                hop_address = parse_ip(hop)
+                if hop_address is None:
+                    break
+                address = hop_address
+                if not self.is_trusted_proxy(address):
+                    break
+        return str(address)
+    
+    def is_trusted_proxy(self, address):
+        return any(address in network for network in self.trusted_proxies)
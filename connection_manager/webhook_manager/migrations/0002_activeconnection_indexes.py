@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activeconnection',
+            index=models.Index(fields=['status', 'last_activity'], name='ac_status_activity_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activeconnection',
+            index=models.Index(fields=['status', 'is_webhook'], name='ac_status_webhook_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activeconnection',
+            index=models.Index(fields=['status', 'client_ip', 'is_webhook'], name='ac_status_ip_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activeconnection',
+            index=models.Index(condition=models.Q(('status', 'ACTIVE')), fields=['last_activity'], name='ac_active_activity_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:07
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0002_activeconnection_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CleanupLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('owner', models.CharField(blank=True, max_length=100)),
+                ('expires_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Lease de Limpieza',
+                'verbose_name_plural': 'Leases de Limpieza',
+            },
+        ),
+    ]
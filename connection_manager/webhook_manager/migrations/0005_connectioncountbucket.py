@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0004_webhookjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectionCountBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('second', models.BigIntegerField()),
+                ('is_webhook', models.BooleanField(default=False)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Bucket de Conteo',
+                'verbose_name_plural': 'Buckets de Conteo',
+                'ordering': ['second'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='connectioncountbucket',
+            constraint=models.UniqueConstraint(fields=('second', 'is_webhook'), name='ccb_second_webhook_uniq'),
+        ),
+    ]
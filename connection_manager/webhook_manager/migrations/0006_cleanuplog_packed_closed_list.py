@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from webhook_manager.packing import pack_closed_connections, unpack_closed_connections
+
+
+def pack_existing_lists(apps, schema_editor):
+    ConnectionCleanupLog = apps.get_model('webhook_manager', 'ConnectionCleanupLog')
+    for log in ConnectionCleanupLog.objects.only('id', 'connections_closed_list').iterator(chunk_size=100):
+        ConnectionCleanupLog.objects.filter(pk=log.pk).update(
+            closed_connections_data=pack_closed_connections(log.connections_closed_list or [])
+        )
+
+
+def unpack_existing_lists(apps, schema_editor):
+    ConnectionCleanupLog = apps.get_model('webhook_manager', 'ConnectionCleanupLog')
+    for log in ConnectionCleanupLog.objects.only('id', 'closed_connections_data').iterator(chunk_size=100):
+        ConnectionCleanupLog.objects.filter(pk=log.pk).update(
+            connections_closed_list=unpack_closed_connections(log.closed_connections_data)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0005_connectioncountbucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='connectioncleanuplog',
+            name='closed_connections_data',
+            field=models.BinaryField(default=b'', editable=False),
+        ),
+        migrations.RunPython(pack_existing_lists, unpack_existing_lists),
+        migrations.RemoveField(
+            model_name='connectioncleanuplog',
+            name='connections_closed_list',
+        ),
+    ]
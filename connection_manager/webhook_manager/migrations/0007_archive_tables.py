@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-17 21:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0006_cleanuplog_packed_closed_list'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedCleanupLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('timestamp', models.DateTimeField()),
+                ('total_connections_before', models.IntegerField()),
+                ('inactive_connections_found', models.IntegerField()),
+                ('connections_closed', models.IntegerField()),
+                ('cleanup_reason', models.TextField()),
+                ('closed_connections_data', models.BinaryField(default=b'')),
+                ('archive_day', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Log de Limpieza Archivado',
+                'verbose_name_plural': 'Logs de Limpieza Archivados',
+                'ordering': ['-timestamp'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedConnection',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('connection_id', models.UUIDField(unique=True)),
+                ('client_ip', models.GenericIPAddressField()),
+                ('user_agent', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('last_activity', models.DateTimeField()),
+                ('is_webhook', models.BooleanField(default=False)),
+                ('webhook_endpoint', models.CharField(blank=True, max_length=200)),
+                ('status', models.CharField(default='CLOSED', max_length=20)),
+                ('archive_day', models.DateField(db_index=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Conexión Archivada',
+                'verbose_name_plural': 'Conexiones Archivadas',
+                'ordering': ['-last_activity'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0007_archive_tables'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookjob',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def close_duplicate_normal_connections(apps, schema_editor):
+    """Cerrar las conexiones normales ACTIVE duplicadas por IP salvo la más reciente"""
+    ActiveConnection = apps.get_model('webhook_manager', 'ActiveConnection')
+    duplicated = (
+        ActiveConnection.objects.filter(status='ACTIVE', is_webhook=False)
+        .values('client_ip').annotate(rows=Count('id')).filter(rows__gt=1)
+    )
+    for row in duplicated.iterator():
+        keep = (
+            ActiveConnection.objects.filter(client_ip=row['client_ip'], status='ACTIVE', is_webhook=False)
+            .order_by('-last_activity', '-id').values_list('id', flat=True).first()
+        )
+        ActiveConnection.objects.filter(
+            client_ip=row['client_ip'], status='ACTIVE', is_webhook=False
+        ).exclude(pk=keep).update(status='CLOSED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0008_webhookjob_lease_owner'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_normal_connections, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='activeconnection',
+            constraint=models.UniqueConstraint(
+                condition=models.Q(('is_webhook', False), ('status', 'ACTIVE')),
+                fields=('client_ip',),
+                name='ac_one_active_normal_per_ip'
+            ),
+        ),
+    ]
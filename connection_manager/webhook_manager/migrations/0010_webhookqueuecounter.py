@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-17 22:22
+
+from django.db import migrations, models
+
+
+def seed_queue_counter(apps, schema_editor):
+    """Contar los trabajos en curso y retirar la fila de CleanupLease usada antes como bloqueo"""
+    WebhookJob = apps.get_model('webhook_manager', 'WebhookJob')
+    WebhookQueueCounter = apps.get_model('webhook_manager', 'WebhookQueueCounter')
+    CleanupLease = apps.get_model('webhook_manager', 'CleanupLease')
+    WebhookQueueCounter.objects.create(
+        name='webhooks',
+        pending=WebhookJob.objects.filter(status__in=['PENDING', 'RUNNING']).count()
+    )
+    CleanupLease.objects.filter(name='webhook_queue').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webhook_manager', '0009_activeconnection_one_active_normal_per_ip'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookQueueCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('pending', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de la Cola de Webhooks',
+                'verbose_name_plural': 'Contadores de la Cola de Webhooks',
+            },
+        ),
+        migrations.RunPython(seed_queue_counter, migrations.RunPython.noop),
+    ]
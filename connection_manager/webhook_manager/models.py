@@ -1,5 +1,8 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, connections, models, transaction
 from django.utils import timezone
+from datetime import timedelta
+from .packing import pack_closed_connections, unpack_closed_connections
 import uuid
 
 class ActiveConnection(models.Model):
@@ -16,6 +19,28 @@ class ActiveConnection(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Conexión Activa'
         verbose_name_plural = 'Conexiones Activas'
+        indexes = [
+            # Conteo de activas, conteo de inactivas y selección de la limpieza
+            models.Index(fields=['status', 'last_activity'], name='ac_status_activity_idx'),
+            # Conteo de conexiones webhook activas
+            models.Index(fields=['status', 'is_webhook'], name='ac_status_webhook_idx'),
+            # get_or_create del middleware para requests normales
+            models.Index(fields=['status', 'client_ip', 'is_webhook'], name='ac_status_ip_idx'),
+            # Índice parcial solo con filas ACTIVE (PostgreSQL/SQLite)
+            models.Index(
+                fields=['last_activity'],
+                condition=models.Q(status='ACTIVE'),
+                name='ac_active_activity_idx'
+            ),
+        ]
+        constraints = [
+            # Una sola conexión normal ACTIVE por IP: get_or_create concurrentes no la duplican
+            models.UniqueConstraint(
+                fields=['client_ip'],
+                condition=models.Q(status='ACTIVE', is_webhook=False),
+                name='ac_one_active_normal_per_ip'
+            ),
+        ]
         
     def __str__(self):
         return f"Connection {self.connection_id} from {self.client_ip}"
@@ -36,7 +61,8 @@ class ConnectionCleanupLog(models.Model):
     inactive_connections_found = models.IntegerField()
     connections_closed = models.IntegerField()
     cleanup_reason = models.TextField()
-    connections_closed_list = models.JSONField(default=list)
+    # Lista de conexiones cerradas en formato empaquetado (ver packing.py)
+    closed_connections_data = models.BinaryField(default=b'', editable=False)
     
     class Meta:
         ordering = ['-timestamp']
@@ -45,6 +71,98 @@ class ConnectionCleanupLog(models.Model):
         
     def __str__(self):
         return f"Cleanup {self.timestamp}: {self.connections_closed} connections closed"
+    
+    @property
+    def connections_closed_list(self):
+        """Conexiones cerradas, desempaquetadas solo al pedirlas"""
+        if not hasattr(self, '_connections_closed_list'):
+            self._connections_closed_list = unpack_closed_connections(self.closed_connections_data)
+        return self._connections_closed_list
+    
+    @connections_closed_list.setter
+    def connections_closed_list(self, closed_connections):
+        self.closed_connections_data = pack_closed_connections(
+            closed_connections,
+            compress=getattr(settings, 'CLEANUP_LOG_COMPRESS', True)
+        )
+        self._connections_closed_list = list(closed_connections)
+
+class SuspiciousIPManager(models.Manager):
+    """Incrementos atómicos de contadores manteniendo sincronizado el backup RAID 1"""
+    
+    # Filas por sentencia INSERT (8 parámetros por fila, límite de 999 en SQLite)
+    UPSERT_BATCH_SIZE = 100
+    
+    def increment(self, ip_address, count=1, seen_at=None):
+        """Sumar `count` conexiones a una IP, creándola si no existe"""
+        self.increment_many({ip_address: count}, seen_at=seen_at)
+    
+    def increment_many(self, counts, seen_at=None):
+        """Sumar conexiones a varias IPs ({ip: cantidad}) en una sola sentencia por lote"""
+        counts = {ip: count for ip, count in counts.items() if count}
+        if not counts:
+            return
+        
+        seen_at = seen_at or timezone.now()
+        db_connection = connections[self.db]
+        
+        if db_connection.vendor in ('sqlite', 'postgresql'):
+            self._upsert_increment(db_connection, counts, seen_at)
+        else:
+            for ip_address, count in counts.items():
+                self._update_or_create_increment(ip_address, count, seen_at)
+    
+    def _upsert_increment(self, db_connection, counts, seen_at):
+        """INSERT ... ON CONFLICT DO UPDATE: primario y backup en la misma sentencia"""
+        meta = self.model._meta
+        table = db_connection.ops.quote_name(meta.db_table)
+        columns = [
+            'ip_address', 'connection_count', 'first_seen', 'last_seen',
+            'is_blocked', 'notes', 'backup_connection_count', 'backup_last_seen'
+        ]
+        ip_field = meta.get_field('ip_address')
+        seen_value = meta.get_field('last_seen').get_db_prep_save(seen_at, db_connection)
+        
+        items = list(counts.items())
+        with db_connection.cursor() as cursor:
+            for start in range(0, len(items), self.UPSERT_BATCH_SIZE):
+                batch = items[start:start + self.UPSERT_BATCH_SIZE]
+                params = []
+                for ip_address, count in batch:
+                    params.extend([
+                        ip_field.get_db_prep_save(ip_address, db_connection),
+                        count, seen_value, seen_value, False, '', count, seen_value
+                    ])
+                
+                placeholders = ', '.join(['(%s)' % ', '.join(['%s'] * len(columns))] * len(batch))
+                cursor.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES {placeholders} "
+                    f"ON CONFLICT (ip_address) DO UPDATE SET "
+                    f"connection_count = {table}.connection_count + excluded.connection_count, "
+                    f"backup_connection_count = {table}.connection_count + excluded.connection_count, "
+                    f"last_seen = excluded.last_seen, "
+                    f"backup_last_seen = excluded.last_seen",
+                    params
+                )
+    
+    def _update_or_create_increment(self, ip_address, count, seen_at):
+        """Alternativa portable con expresiones F() para otros motores"""
+        updated = self.filter(ip_address=ip_address).update(
+            connection_count=models.F('connection_count') + count,
+            backup_connection_count=models.F('backup_connection_count') + count,
+            last_seen=seen_at,
+            backup_last_seen=seen_at
+        )
+        if updated:
+            return
+        
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(ip_address=ip_address, connection_count=count, last_seen=seen_at)
+        except IntegrityError:
+            # Otro proceso creó la fila entre el UPDATE y el INSERT
+            self._update_or_create_increment(ip_address, count, seen_at)
+
 
 class SuspiciousIP(models.Model):
     """Base de datos RAID 1 simulada para IPs que dejan conexiones abiertas"""
@@ -59,6 +177,8 @@ class SuspiciousIP(models.Model):
     backup_connection_count = models.IntegerField(default=1)
     backup_last_seen = models.DateTimeField(default=timezone.now)
     
+    objects = SuspiciousIPManager()
+    
     def save(self, *args, **kwargs):
         # Simular RAID 1 - sincronizar datos principales con backup
         self.backup_connection_count = self.connection_count
@@ -71,4 +191,228 @@ class SuspiciousIP(models.Model):
         verbose_name_plural = 'IPs Sospechosas'
         
     def __str__(self):
-        return f"IP {self.ip_address} ({self.connection_count} connections)"
\ No newline at end of file
+        return f"IP {self.ip_address} ({self.connection_count} connections)"
+
+class CleanupLeaseManager(models.Manager):
+    """Lease en base de datos para coordinar limpiezas entre procesos"""
+    
+    def acquire(self, name, owner, ttl):
+        """Tomar el lease si está libre o vencido; devuelve True si se obtuvo"""
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=ttl)
+        
+        # UPDATE condicional: solo un proceso puede ganar el lease vencido
+        taken = self.filter(name=name).filter(
+            models.Q(expires_at__lt=now) | models.Q(owner=owner)
+        ).update(owner=owner, expires_at=expires_at)
+        if taken:
+            return True
+        
+        if self.filter(name=name).exists():
+            return False
+        
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(name=name, owner=owner, expires_at=expires_at)
+            return True
+        except IntegrityError:
+            # Otro proceso creó el lease primero
+            return False
+    
+    def release(self, name, owner):
+        """Liberar el lease si todavía pertenece a `owner`"""
+        self.filter(name=name, owner=owner).update(owner='', expires_at=timezone.now())
+
+
+class CleanupLease(models.Model):
+    """Lease de ejecución exclusiva de la limpieza (válido con varios workers)"""
+    name = models.CharField(max_length=50, unique=True)
+    owner = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField(default=timezone.now)
+    
+    objects = CleanupLeaseManager()
+    
+    class Meta:
+        verbose_name = 'Lease de Limpieza'
+        verbose_name_plural = 'Leases de Limpieza'
+        
+    def __str__(self):
+        return f"Lease {self.name} ({self.owner or 'libre'} hasta {self.expires_at})"
+
+
+class WebhookJob(models.Model):
+    """Webhook aceptado con 202 y pendiente de procesar por el pool de workers"""
+    STATUS_CHOICES = [
+        ('PENDING', 'Pendiente'),
+        ('RUNNING', 'En proceso'),
+        ('DONE', 'Completado'),
+        ('FAILED', 'Fallido'),
+    ]
+    
+    job_id = models.UUIDField(default=uuid.uuid4, unique=True)
+    client_ip = models.GenericIPAddressField(null=True, blank=True)
+    connection_id = models.UUIDField(null=True, blank=True)
+    endpoint = models.CharField(max_length=200, blank=True)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=5)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    lease_owner = models.CharField(max_length=64, blank=True)  # token del worker que tiene el lease
+    last_error = models.TextField(blank=True)
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Trabajo de Webhook'
+        verbose_name_plural = 'Trabajos de Webhook'
+        indexes = [
+            # Selección del siguiente trabajo listo para ejecutar
+            models.Index(fields=['status', 'next_attempt_at'], name='job_status_next_idx'),
+        ]
+        
+    def __str__(self):
+        return f"Job {self.job_id} ({self.status}, intento {self.attempts})"
+
+
+class WebhookQueueCounter(models.Model):
+    """Trabajos PENDING o RUNNING de la cola, mantenido al encolar y al terminar cada trabajo"""
+    name = models.CharField(max_length=50, unique=True)
+    pending = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Contador de la Cola de Webhooks'
+        verbose_name_plural = 'Contadores de la Cola de Webhooks'
+
+    def __str__(self):
+        return f"Cola {self.name}: {self.pending} trabajos pendientes"
+
+
+class ConnectionCountBucketManager(models.Manager):
+    """Contadores de conexiones activas agrupados por segundo de last_activity"""
+    
+    # Filas por sentencia INSERT (3 parámetros por fila, límite de 999 en SQLite)
+    UPSERT_BATCH_SIZE = 300
+    
+    def apply_deltas(self, deltas):
+        """Sumar deltas {(segundo, is_webhook): cantidad} y descartar buckets vacíos"""
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        
+        db_connection = connections[self.db]
+        with transaction.atomic(using=self.db):
+            if db_connection.vendor in ('sqlite', 'postgresql'):
+                self._upsert_deltas(db_connection, deltas)
+            else:
+                for (second, is_webhook), delta in deltas.items():
+                    self._update_or_create_delta(second, is_webhook, delta)
+            self.filter(count=0).delete()
+    
+    def _upsert_deltas(self, db_connection, deltas):
+        """INSERT ... ON CONFLICT DO UPDATE con el delta de cada bucket"""
+        table = db_connection.ops.quote_name(self.model._meta.db_table)
+        items = list(deltas.items())
+        with db_connection.cursor() as cursor:
+            for start in range(0, len(items), self.UPSERT_BATCH_SIZE):
+                batch = items[start:start + self.UPSERT_BATCH_SIZE]
+                params = []
+                for (second, is_webhook), delta in batch:
+                    params.extend([second, is_webhook, delta])
+                
+                placeholders = ', '.join(['(%s, %s, %s)'] * len(batch))
+                cursor.execute(
+                    f"INSERT INTO {table} (second, is_webhook, count) VALUES {placeholders} "
+                    f"ON CONFLICT (second, is_webhook) DO UPDATE SET "
+                    f"count = {table}.count + excluded.count",
+                    params
+                )
+    
+    def _update_or_create_delta(self, second, is_webhook, delta):
+        """Alternativa portable con expresiones F() para otros motores"""
+        updated = self.filter(second=second, is_webhook=is_webhook).update(count=models.F('count') + delta)
+        if updated:
+            return
+        
+        try:
+            with transaction.atomic(using=self.db):
+                self.create(second=second, is_webhook=is_webhook, count=delta)
+        except IntegrityError:
+            # Otro proceso creó el bucket entre el UPDATE y el INSERT
+            self._update_or_create_delta(second, is_webhook, delta)
+    
+    def totals(self, cutoff_second):
+        """Conteos total, inactivo (buckets anteriores a `cutoff_second`) y webhook"""
+        counts = self.aggregate(
+            total=models.Sum('count'),
+            inactive=models.Sum('count', filter=models.Q(second__lt=cutoff_second)),
+            webhook=models.Sum('count', filter=models.Q(is_webhook=True))
+        )
+        return {key: value or 0 for key, value in counts.items()}
+
+
+class ConnectionCountBucket(models.Model):
+    """Conexiones ACTIVE con last_activity dentro de un mismo segundo (epoch)"""
+    second = models.BigIntegerField()
+    is_webhook = models.BooleanField(default=False)
+    count = models.IntegerField(default=0)
+    
+    objects = ConnectionCountBucketManager()
+    
+    class Meta:
+        ordering = ['second']
+        verbose_name = 'Bucket de Conteo'
+        verbose_name_plural = 'Buckets de Conteo'
+        constraints = [
+            models.UniqueConstraint(fields=['second', 'is_webhook'], name='ccb_second_webhook_uniq'),
+        ]
+        
+    def __str__(self):
+        return f"Bucket {self.second} ({'webhook' if self.is_webhook else 'normal'}): {self.count}"
+
+
+class ArchivedConnection(models.Model):
+    """Conexión CLOSED movida fuera de ActiveConnection por la retención"""
+    connection_id = models.UUIDField(unique=True)
+    client_ip = models.GenericIPAddressField()
+    user_agent = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    last_activity = models.DateTimeField()
+    is_webhook = models.BooleanField(default=False)
+    webhook_endpoint = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=20, default='CLOSED')
+    # Día de last_activity: clave de partición para consultas y purgas por fecha
+    archive_day = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-last_activity']
+        verbose_name = 'Conexión Archivada'
+        verbose_name_plural = 'Conexiones Archivadas'
+        
+    def __str__(self):
+        return f"Archived connection {self.connection_id} from {self.client_ip}"
+
+
+class ArchivedCleanupLog(models.Model):
+    """Log de limpieza movido fuera de ConnectionCleanupLog por la retención"""
+    original_id = models.BigIntegerField(unique=True)
+    timestamp = models.DateTimeField()
+    total_connections_before = models.IntegerField()
+    inactive_connections_found = models.IntegerField()
+    connections_closed = models.IntegerField()
+    cleanup_reason = models.TextField()
+    closed_connections_data = models.BinaryField(default=b'', editable=False)
+    archive_day = models.DateField(db_index=True)
+    archived_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-timestamp']
+        verbose_name = 'Log de Limpieza Archivado'
+        verbose_name_plural = 'Logs de Limpieza Archivados'
+        
+    def __str__(self):
+        return f"Archived cleanup {self.timestamp}: {self.connections_closed} connections closed"
@@ -0,0 +1,103 @@
+"""
+Formato binario compacto para la lista de conexiones cerradas de una limpieza.
+
+Cada conexión ocupa un registro fijo de 41 bytes: UUID (16 bytes), IP
+empaquetada como IPv6 (16 bytes, las IPv4 como ::ffff:a.b.c.d), tiempo de
+inactividad (float64) y un byte de flags. La cabecera indica versión y si el
+contenido está comprimido con zlib.
+
+Un client_ip que no es una IP válida se guarda con FLAG_RAW_IP: el campo de
+IP queda a cero y tras el registro va el texto original (longitud uint16 y
+UTF-8), así que un valor inesperado nunca impide guardar la limpieza.
+"""
+
+from .iputils import pack_ip, parse_ip
+import ipaddress
+import struct
+import uuid
+import zlib
+
+FORMAT_VERSION = 2
+SUPPORTED_VERSIONS = (1, 2)  # la versión 1 no admite FLAG_RAW_IP
+FLAG_COMPRESSED = 0x01
+FLAG_WEBHOOK = 0x01
+FLAG_RAW_IP = 0x02
+
+HEADER = struct.Struct('!BB')
+RECORD = struct.Struct('!16s16sdB')
+RAW_LENGTH = struct.Struct('!H')
+
+# IP desconocida (no debería darse: las conexiones siempre tienen client_ip)
+EMPTY_IP = bytes(16)
+
+
+def pack_record(connection):
+    flags = FLAG_WEBHOOK if connection['is_webhook'] else 0
+    client_ip = connection['client_ip']
+    if not client_ip:
+        packed_ip = EMPTY_IP
+    else:
+        address = parse_ip(client_ip)
+        packed_ip = pack_ip(address) if address is not None else None
+    if packed_ip is not None:
+        return RECORD.pack(
+            uuid.UUID(str(connection['connection_id'])).bytes, packed_ip, connection['inactive_time'], flags
+        )
+
+    raw = str(client_ip).encode('utf-8')[:0xFFFF]
+    return RECORD.pack(
+        uuid.UUID(str(connection['connection_id'])).bytes, EMPTY_IP, connection['inactive_time'], flags | FLAG_RAW_IP
+    ) + RAW_LENGTH.pack(len(raw)) + raw
+
+
+def unpack_ip(packed):
+    if packed == EMPTY_IP:
+        return None
+    address = ipaddress.IPv6Address(packed)
+    return str(address.ipv4_mapped or address)
+
+
+def pack_closed_connections(closed_connections, compress=True):
+    """Empaquetar [{'connection_id', 'client_ip', 'inactive_time', 'is_webhook'}]"""
+    body = b''.join(pack_record(connection) for connection in closed_connections)
+
+    flags = 0
+    if compress and body:
+        body = zlib.compress(body)
+        flags |= FLAG_COMPRESSED
+    return HEADER.pack(FORMAT_VERSION, flags) + body
+
+
+def unpack_closed_connections(data):
+    """Reconstruir la lista de diccionarios a partir del formato empaquetado"""
+    if not data:
+        return []
+
+    data = bytes(data)
+    version, flags = HEADER.unpack_from(data)
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Versión de formato desconocida: {version}")
+
+    body = data[HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        body = zlib.decompress(body)
+
+    connections = []
+    offset = 0
+    while offset < len(body):
+        connection_id, packed_ip, inactive_time, record_flags = RECORD.unpack_from(body, offset)
+        offset += RECORD.size
+        if record_flags & FLAG_RAW_IP:
+            (length,) = RAW_LENGTH.unpack_from(body, offset)
+            offset += RAW_LENGTH.size
+            client_ip = body[offset:offset + length].decode('utf-8', errors='replace')
+            offset += length
+        else:
+            client_ip = unpack_ip(packed_ip)
+        connections.append({
+            'connection_id': str(uuid.UUID(bytes=connection_id)),
+            'client_ip': client_ip,
+            'inactive_time': inactive_time,
+            'is_webhook': bool(record_flags & FLAG_WEBHOOK)
+        })
+    return connections
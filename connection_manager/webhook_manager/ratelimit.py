@@ -0,0 +1,178 @@
+"""
+Limitación de tasa por IP para los endpoints de webhooks.
+
+Cada ruta de RATE_LIMITS tiene su propio token bucket por IP: `rate` tokens
+por segundo y capacidad `burst`. El bucket se guarda en la forma GCRA, como
+el instante teórico de llegada (TAT) de la siguiente request: un único float
+por IP en lugar de (tokens, timestamp). Un bucket con TAT en el pasado está
+lleno y equivale a no tener entrada.
+
+El almacenamiento local es una tabla particionada con un lock por partición,
+acotada a RATE_LIMIT_MAX_ENTRIES buckets: cada inserción descarta los buckets
+llenos menos usados y, si aún no cabe, el menos usado. Con
+RATE_LIMIT_BACKEND = 'django' los buckets viven en la caché de Django y se
+comparten entre workers; sin compare-and-set, dos procesos que actualizan la
+misma IP a la vez pueden admitir alguna request de más.
+"""
+
+from collections import OrderedDict, namedtuple
+from django.conf import settings
+from django.core.cache import caches
+import math
+import threading
+import time
+
+RateLimitRule = namedtuple('RateLimitRule', ['path', 'rate', 'burst'])
+
+
+def take_token(tat, now, rule):
+    """
+    Consumir un token de un bucket con TAT `tat` (None si no existe).
+
+    Devuelve (TAT nuevo, segundos de espera): si la espera es 0 la request se
+    admite y hay que guardar el TAT nuevo; si no, el bucket no cambia.
+    """
+    interval = 1.0 / rule.rate
+    new_tat = max(tat if tat is not None else now, now) + interval
+    # Con el bucket lleno, TAT - now vale como mucho burst * interval
+    excess = new_tat - now - rule.burst * interval
+    if excess > 0:
+        return tat, excess
+    return new_tat, 0.0
+
+
+class _BucketShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # clave -> TAT, en orden de último uso
+        self.buckets = OrderedDict()
+
+
+class TokenBucketTable:
+    """Buckets en memoria del proceso, particionados por clave"""
+
+    requires_io = False
+    name = 'local'
+
+    def __init__(self, shards=None, max_entries=None):
+        shards = shards or getattr(settings, 'RATE_LIMIT_SHARDS', 16)
+        max_entries = max_entries or getattr(settings, 'RATE_LIMIT_MAX_ENTRIES', 100000)
+        self.shards = [_BucketShard() for _ in range(shards)]
+        self.max_per_shard = max(1, max_entries // shards)
+        self.evictions = 0
+
+    def take(self, key, rule, now=None):
+        now = time.monotonic() if now is None else now
+        shard = self.shards[hash(key) % len(self.shards)]
+
+        with shard.lock:
+            buckets = shard.buckets
+            tat = buckets.get(key)
+            new_tat, wait = take_token(tat, now, rule)
+            if wait:
+                return wait
+
+            buckets[key] = new_tat
+            if tat is None:
+                self._evict(shard, now)
+            else:
+                buckets.move_to_end(key)
+            return 0.0
+
+    def _evict(self, shard, now):
+        buckets = shard.buckets
+        # Los buckets menos usados que ya se rellenaron no aportan nada
+        while buckets:
+            key, tat = next(iter(buckets.items()))
+            if tat > now:
+                break
+            del buckets[key]
+        # Tabla llena: olvidar el menos usado (vuelve con el bucket lleno)
+        while len(buckets) > self.max_per_shard:
+            buckets.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        return sum(len(shard.buckets) for shard in self.shards)
+
+    def stats(self):
+        return {'tracked_buckets': len(self), 'evictions': self.evictions}
+
+
+class DjangoCacheTokenBuckets:
+    """Buckets en una caché de Django (compartidos entre procesos)"""
+
+    requires_io = True
+    name = 'django'
+
+    def __init__(self, alias='default', prefix='webhook_manager:ratelimit:'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def take(self, key, rule, now=None):
+        # Reloj de pared: los procesos no comparten time.monotonic()
+        now = time.time() if now is None else now
+        cache_key = f'{self.prefix}{key[0]}:{key[1]}'
+
+        new_tat, wait = take_token(self.cache.get(cache_key), now, rule)
+        if wait:
+            return wait
+
+        # La entrada caduca cuando el bucket vuelve a estar lleno
+        self.cache.set(cache_key, new_tat, timeout=max(1, math.ceil(new_tat - now)))
+        return 0.0
+
+    def stats(self):
+        return {'tracked_buckets': None, 'evictions': None}
+
+
+class RateLimiter:
+    """Reglas de RATE_LIMITS por ruta exacta sobre el almacenamiento configurado"""
+
+    def __init__(self, limits=None, store=None):
+        limits = limits if limits is not None else getattr(settings, 'RATE_LIMITS', {})
+        self.rules = {
+            path: RateLimitRule(path, float(limit['rate']), max(1, int(limit['burst'])))
+            for path, limit in limits.items()
+        }
+        self.store = store or TokenBucketTable()
+
+    @property
+    def requires_io(self):
+        return self.store.requires_io
+
+    def rule_for(self, path):
+        return self.rules.get(path)
+
+    def check(self, path, client_ip, now=None):
+        """Segundos a esperar si la IP superó el límite de la ruta, 0 si se admite"""
+        rule = self.rules.get(path)
+        if rule is None:
+            return 0.0
+        return self.store.take((path, client_ip), rule, now)
+
+    def stats(self):
+        return {
+            'enabled': True,
+            'backend': self.store.name,
+            'rules': {path: {'rate': rule.rate, 'burst': rule.burst} for path, rule in self.rules.items()},
+            **self.store.stats(),
+        }
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Obtener (y crear si no existe) el limitador de tasa configurado"""
+    global _rate_limiter
+
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            if getattr(settings, 'RATE_LIMIT_BACKEND', 'local') == 'django':
+                store = DjangoCacheTokenBuckets(getattr(settings, 'RATE_LIMIT_CACHE_ALIAS', 'default'))
+            else:
+                store = TokenBucketTable()
+            _rate_limiter = RateLimiter(store=store)
+        return _rate_limiter
@@ -0,0 +1,117 @@
+"""
+Incrementos write-behind de SuspiciousIP.
+
+Con IP_REPUTATION_CACHE_ENABLED, el backend ORM deja de ejecutar un upsert
+sobre SuspiciousIP en cada webhook: los incrementos se acumulan por IP en
+memoria y un hilo los vuelca cada IP_REPUTATION_CACHE_FLUSH_INTERVAL segundos
+con SuspiciousIP.objects.increment_many, una sentencia por lote.
+
+Aquí no se leen conteos ni is_blocked: las decisiones de bloqueo son de
+IPBlocklist (blocking.py), así que registrar un webhook nunca consulta la
+base de datos.
+"""
+
+from collections import Counter
+from django.conf import settings
+from django.db import close_old_connections
+from .models import SuspiciousIP
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger('webhook_manager')
+
+
+class IPReputationCache:
+    """Incrementos de conexiones por IP acumulados en memoria y volcados en lote"""
+
+    def __init__(self, flush_interval=None):
+        self.flush_interval = flush_interval or getattr(settings, 'IP_REPUTATION_CACHE_FLUSH_INTERVAL', 1.0)
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # IP en texto -> incremento aún no volcado
+        self._pending = Counter()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.increments = 0
+        self.flushes = 0
+        self.flush_errors = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='ip-reputation-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+        logger.info(f"Caché de reputación de IPs iniciada (volcado cada {self.flush_interval}s)")
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def increment(self, ip_address, count=1):
+        """Sumar conexiones a la IP sin tocar la base de datos"""
+        with self._lock:
+            self._pending[ip_address] += count
+            self.increments += count
+
+    def flush(self):
+        """Volcar los incrementos acumulados en SuspiciousIP"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, Counter()
+
+            if not pending:
+                return 0
+
+            try:
+                SuspiciousIP.objects.increment_many(pending)
+            except Exception as e:
+                # Devolver los incrementos para el siguiente volcado
+                with self._lock:
+                    self._pending.update(pending)
+                    self.flush_errors += 1
+                logger.error(f"Error volcando la caché de reputación de IPs ({len(pending)} IPs): {e}")
+                return 0
+
+            with self._lock:
+                self.flushes += 1
+            return len(pending)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': True,
+                'increments': self.increments,
+                'pending_ips': len(self._pending),
+                'flushes': self.flushes,
+                'flush_errors': self.flush_errors,
+            }
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            close_old_connections()
+            self.flush()
+        close_old_connections()
+
+
+_ip_reputation_cache = None
+_ip_reputation_cache_lock = threading.Lock()
+
+
+def get_ip_reputation_cache():
+    """Obtener (y crear si no existe) la caché de reputación del proceso"""
+    global _ip_reputation_cache
+
+    with _ip_reputation_cache_lock:
+        if _ip_reputation_cache is None:
+            _ip_reputation_cache = IPReputationCache()
+        return _ip_reputation_cache
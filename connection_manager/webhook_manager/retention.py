@@ -0,0 +1,166 @@
+"""
+Retención de conexiones cerradas, logs de limpieza y trabajos de webhooks.
+
+Las filas CLOSED de ActiveConnection con last_activity anterior a
+RETENTION_CLOSED_CONNECTIONS_SECONDS, y los ConnectionCleanupLog anteriores a
+RETENTION_CLEANUP_LOG_SECONDS, se mueven a ArchivedConnection /
+ArchivedCleanupLog (o se borran sin más con RETENTION_ARCHIVE = False). Los
+WebhookJob DONE o FAILED sin cambios desde hace RETENTION_WEBHOOK_JOBS_SECONDS
+se borran siempre: no tienen tabla de archivo.
+
+Cada lote de RETENTION_BATCH_SIZE filas se copia y se borra en su propia
+transacción corta, así la tabla caliente nunca queda bloqueada durante toda la
+purga. Lo ejecutan el comando `manage.py apply_retention` y, cada
+RETENTION_INTERVAL segundos, el planificador de expiración.
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import ActiveConnection, ArchivedCleanupLog, ArchivedConnection, ConnectionCleanupLog, WebhookJob
+import logging
+import time
+
+logger = logging.getLogger('webhook_manager')
+
+CONNECTION_FIELDS = (
+    'connection_id', 'client_ip', 'user_agent', 'created_at', 'last_activity',
+    'is_webhook', 'webhook_endpoint', 'status'
+)
+CLEANUP_LOG_FIELDS = (
+    'id', 'timestamp', 'total_connections_before', 'inactive_connections_found',
+    'connections_closed', 'cleanup_reason', 'closed_connections_data'
+)
+
+
+def archive_connection(row, archived_at):
+    return ArchivedConnection(
+        archive_day=row['last_activity'].date(),
+        archived_at=archived_at,
+        **{field: row[field] for field in CONNECTION_FIELDS}
+    )
+
+
+def archive_cleanup_log(row, archived_at):
+    fields = {field: row[field] for field in CLEANUP_LOG_FIELDS if field != 'id'}
+    return ArchivedCleanupLog(
+        original_id=row['id'],
+        archive_day=row['timestamp'].date(),
+        archived_at=archived_at,
+        **fields
+    )
+
+
+class RetentionService:
+    """Mueve al archivo (o borra) por lotes acotados las filas vencidas"""
+
+    def __init__(self, batch_size=None, archive=None, closed_connection_age=None,
+                 cleanup_log_age=None, batch_pause=None, webhook_job_age=None):
+        self.batch_size = batch_size or getattr(settings, 'RETENTION_BATCH_SIZE', 500)
+        self.archive = archive if archive is not None else getattr(settings, 'RETENTION_ARCHIVE', True)
+        self.closed_connection_age = (
+            closed_connection_age if closed_connection_age is not None
+            else getattr(settings, 'RETENTION_CLOSED_CONNECTIONS_SECONDS', 24 * 3600)
+        )
+        self.cleanup_log_age = (
+            cleanup_log_age if cleanup_log_age is not None
+            else getattr(settings, 'RETENTION_CLEANUP_LOG_SECONDS', 30 * 24 * 3600)
+        )
+        self.webhook_job_age = (
+            webhook_job_age if webhook_job_age is not None
+            else getattr(settings, 'RETENTION_WEBHOOK_JOBS_SECONDS', 7 * 24 * 3600)
+        )
+        self.batch_pause = batch_pause if batch_pause is not None else getattr(settings, 'RETENTION_BATCH_PAUSE', 0.0)
+
+    def expired_querysets(self, now=None):
+        """(nombre, queryset de filas vencidas, campos, constructor del archivo o None si solo se borran)"""
+        now = now or timezone.now()
+        return [
+            (
+                'conexiones_cerradas',
+                ActiveConnection.objects.filter(
+                    status='CLOSED',
+                    last_activity__lt=now - timedelta(seconds=self.closed_connection_age)
+                ),
+                ('id',) + CONNECTION_FIELDS,
+                archive_connection
+            ),
+            (
+                'logs_de_limpieza',
+                ConnectionCleanupLog.objects.filter(
+                    timestamp__lt=now - timedelta(seconds=self.cleanup_log_age)
+                ),
+                CLEANUP_LOG_FIELDS,
+                archive_cleanup_log
+            ),
+            (
+                'trabajos_webhook',
+                WebhookJob.objects.filter(
+                    status__in=['DONE', 'FAILED'],
+                    updated_at__lt=now - timedelta(seconds=self.webhook_job_age)
+                ),
+                ('id',),
+                None
+            ),
+        ]
+
+    def run(self, max_batches=None, dry_run=False):
+        """
+        Aplicar la retención y devolver un informe por tabla con filas movidas,
+        lotes, segundos y filas por segundo. `max_batches` acota los lotes por
+        tabla en esta ejecución.
+        """
+        report = {}
+        for name, queryset, fields, build_archive in self.expired_querysets():
+            if dry_run:
+                report[name] = {'pendientes': queryset.count()}
+                continue
+            report[name] = self._drain(queryset, fields, build_archive, max_batches)
+            report[name]['archivadas'] = self.archive and build_archive is not None
+
+            if report[name]['filas']:
+                logger.info(
+                    f"Retención {name}: {report[name]['filas']} filas en {report[name]['lotes']} lotes "
+                    f"({report[name]['filas_por_segundo']} filas/s)"
+                )
+        return report
+
+    def _drain(self, queryset, fields, build_archive, max_batches):
+        rows = 0
+        batches = 0
+        started = time.perf_counter()
+
+        while max_batches is None or batches < max_batches:
+            moved = self._move_batch(queryset, fields, build_archive)
+            if not moved:
+                break
+            rows += moved
+            batches += 1
+            if self.batch_pause:
+                # Ceder la base de datos a las escrituras de las requests
+                time.sleep(self.batch_pause)
+
+        elapsed = time.perf_counter() - started
+        return {
+            'filas': rows,
+            'lotes': batches,
+            'segundos': round(elapsed, 3),
+            'filas_por_segundo': round(rows / elapsed) if elapsed and rows else 0,
+        }
+
+    def _move_batch(self, queryset, fields, build_archive):
+        """Copiar al archivo y borrar un lote en una transacción corta"""
+        with transaction.atomic():
+            batch = list(queryset.order_by('pk').values(*fields)[:self.batch_size])
+            if not batch:
+                return 0
+
+            if self.archive and build_archive is not None:
+                archived_at = timezone.now()
+                archive = [build_archive(row, archived_at) for row in batch]
+                type(archive[0]).objects.bulk_create(archive, ignore_conflicts=True)
+
+            # DELETE por clave primaria: el lote no depende de filas nuevas
+            queryset.model.objects.filter(pk__in=[row['id'] for row in batch]).delete()
+            return len(batch)
@@ -0,0 +1,397 @@
+"""
+Planificador de expiración de conexiones basado en una rueda de tiempo jerárquica.
+
+Cada actividad registrada por el backend de rastreo programa la expiración de
+la conexión en `last_activity + CONNECTION_TIMEOUT`. Un único worker avanza la
+rueda, lleva la cuenta de conexiones inactivas sin recorrer la tabla y dispara
+la limpieza cuando se supera MAX_CONNECTIONS; ConnectionCleanupService garantiza
+que solo corra una limpieza a la vez. Cada RETENTION_INTERVAL segundos aplica
+además la retención de conexiones cerradas y logs de limpieza.
+
+El worker arranca con la primera request que atiende cada proceso (no en
+AppConfig.ready): un maestro de gunicorn --preload no se queda con un hilo que
+sus workers no heredan. Al arrancar programa las conexiones activas del
+backend; después, cada EXPIRY_SCHEDULER_RECONCILE_INTERVAL segundos y tras cada
+limpieza, consulta solo las conexiones que da por inactivas para olvidar las
+cerradas por otros procesos o por la retención.
+"""
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from .backends import get_tracking_backend
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger('webhook_manager')
+
+
+class HierarchicalTimingWheel:
+    """
+    Rueda de tiempo jerárquica con `levels` niveles de `slots` ranuras.
+
+    La ranura del nivel k cubre slots**k ticks; al completar una vuelta del
+    nivel inferior, la ranura correspondiente del nivel superior se redistribuye
+    hacia abajo. Programar y expirar cuestan O(1) amortizado por entrada.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=4, start=None):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int((time.time() if start is None else start) // tick)
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.overdue = []
+        self.size = 0
+
+    def schedule(self, key, deadline):
+        """Programar `key` para expirar en `deadline` (segundos epoch)"""
+        self._insert((int(deadline // self.tick), key))
+        self.size += 1
+
+    def _insert(self, entry):
+        target = entry[0]
+        delta = target - self.current
+        if delta <= 0:
+            self.overdue.append(entry)
+            return
+
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.slots or level == self.levels - 1:
+                # Más allá del horizonte se guarda en el último nivel y se
+                # reprograma cuando su ranura expira antes de tiempo
+                self.wheels[level][(target // span) % self.slots].append(entry)
+                return
+            span *= self.slots
+
+    def advance(self, now):
+        """Avanzar la rueda hasta `now` y devolver las claves expiradas"""
+        expired = [key for _, key in self.overdue]
+        self.overdue = []
+
+        target = int(now // self.tick)
+        while self.current < target:
+            self.current += 1
+
+            # Redistribuir desde el nivel más alto cuyo ciclo se completa
+            span = self.slots ** (self.levels - 1)
+            for level in range(self.levels - 1, 0, -1):
+                if self.current % span == 0:
+                    slot = self.wheels[level][(self.current // span) % self.slots]
+                    entries = slot[:]
+                    slot.clear()
+                    for entry in entries:
+                        self._insert(entry)
+                span //= self.slots
+
+            slot = self.wheels[0][self.current % self.slots]
+            entries = slot[:]
+            slot.clear()
+            for entry in entries:
+                if entry[0] > self.current:
+                    self._insert(entry)
+                else:
+                    expired.append(entry[1])
+
+            expired.extend(key for _, key in self.overdue)
+            self.overdue = []
+
+        self.size -= len(expired)
+        return expired
+
+
+class ExpiryScheduler:
+    """Worker único que expira conexiones y coordina las limpiezas automáticas"""
+
+    def __init__(self, backend=None, tick=None, cleanup_interval=None):
+        self.backend = backend or get_tracking_backend()
+        self.timeout = getattr(settings, 'CONNECTION_TIMEOUT', 30)
+        self.max_connections = getattr(settings, 'MAX_CONNECTIONS', 200)
+        self.tick = tick or getattr(settings, 'EXPIRY_SCHEDULER_TICK', 1.0)
+        self.cleanup_interval = (
+            cleanup_interval if cleanup_interval is not None
+            else getattr(settings, 'EXPIRY_SCHEDULER_CLEANUP_INTERVAL', 5.0)
+        )
+
+        self.reconcile_interval = getattr(settings, 'EXPIRY_SCHEDULER_RECONCILE_INTERVAL', 60.0)
+        self.retention_interval = getattr(settings, 'RETENTION_INTERVAL', 3600)
+        self.retention_max_batches = getattr(settings, 'RETENTION_MAX_BATCHES', 100)
+
+        self.wheel = HierarchicalTimingWheel(tick=self.tick)
+        self._lock = threading.Lock()
+        self._deadlines = {}
+        self._inactive = set()
+        self._cleanup_requested = False
+        self._last_cleanup = 0.0
+        self._last_retention = 0.0
+        self._last_reconcile = 0.0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def running(self):
+        # Tras un fork el hilo del proceso padre no existe en el hijo
+        return self._thread is not None and self._pid == os.getpid()
+
+    @property
+    def inactive_count(self):
+        return len(self._inactive)
+
+    def start(self):
+        """Registrar el planificador en el backend y arrancar el worker"""
+        if self.running:
+            return
+        if self._pid is not None:
+            self._reset_after_fork()
+
+        self._pid = os.getpid()
+        self.backend.add_listener(self)
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='connection-expiry-scheduler',
+            daemon=True
+        )
+        self._thread.start()
+
+        logger.info(f"Planificador de expiración iniciado (tick {self.tick}s, timeout {self.timeout}s)")
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self.running:
+            self._thread.join()
+        self._thread = None
+        self.backend.remove_listener(self)
+
+    def _reset_after_fork(self):
+        """Descartar el estado heredado del proceso padre (locks incluidos)"""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.wheel = HierarchicalTimingWheel(tick=self.tick)
+        self._deadlines = {}
+        self._inactive = set()
+        self._cleanup_requested = False
+
+    def on_activity(self, connection_id, last_activity):
+        """Programar (o reprogramar) la expiración de una conexión"""
+        deadline = last_activity.timestamp() + self.timeout
+        with self._lock:
+            self._deadlines[connection_id] = deadline
+            self._inactive.discard(connection_id)
+            self.wheel.schedule((connection_id, deadline), deadline)
+
+    def on_close(self, connection_ids):
+        """Olvidar conexiones cerradas"""
+        with self._lock:
+            for connection_id in connection_ids:
+                self._deadlines.pop(connection_id, None)
+                self._inactive.discard(connection_id)
+
+    def advance(self, now=None):
+        """Avanzar la rueda y devolver el número de conexiones inactivas"""
+        with self._lock:
+            for connection_id, deadline in self.wheel.advance(time.time() if now is None else now):
+                # Entradas de actividades anteriores a la última se ignoran
+                if self._deadlines.get(connection_id) == deadline:
+                    self._inactive.add(connection_id)
+            return len(self._inactive)
+
+    def request_cleanup(self):
+        """Pedir una limpieza; las peticiones concurrentes se agrupan en una sola"""
+        from .services import cleanup_flight
+
+        if self.running:
+            self._cleanup_requested = True
+            self._wakeup.set()
+        elif not cleanup_flight.in_flight('cleanup'):
+            threading.Thread(target=self._cleanup_in_thread, daemon=True).start()
+
+    def run_cleanup(self):
+        """Ejecutar la limpieza o unirse a la que ya está en curso (single-flight)"""
+        from .services import ConnectionCleanupService
+
+        try:
+            self._last_cleanup = time.monotonic()
+            return ConnectionCleanupService(backend=self.backend).cleanup_connections()
+        except Exception as e:
+            logger.error(f"Error en limpieza programada: {e}")
+            return None
+
+    def run_retention(self):
+        """Aplicar la retención por lotes acotados; un solo proceso a la vez (lease)"""
+        from .models import CleanupLease
+        from .retention import RetentionService
+        from .services import LEASE_OWNER
+
+        self._last_retention = time.monotonic()
+        lease_ttl = getattr(settings, 'CLEANUP_LEASE_TTL', 300)
+        try:
+            if not CleanupLease.objects.acquire('retention', LEASE_OWNER, lease_ttl):
+                return None
+            try:
+                return RetentionService().run(max_batches=self.retention_max_batches)
+            finally:
+                CleanupLease.objects.release('retention', LEASE_OWNER)
+        except Exception as e:
+            logger.error(f"Error aplicando retención: {e}")
+            return None
+
+    def seed(self):
+        """Programar las conexiones activas del backend al arrancar el worker"""
+        seeded = 0
+        for connection_id, last_activity in self.backend.iter_activity():
+            deadline = last_activity.timestamp() + self.timeout
+            with self._lock:
+                # La actividad más reciente prevalece (la de este proceso puede no estar escrita)
+                if self._deadlines.get(connection_id, 0) < deadline:
+                    self._deadlines[connection_id] = deadline
+                    self.wheel.schedule((connection_id, deadline), deadline)
+            seeded += 1
+        return seeded
+
+    def reconcile(self):
+        """
+        Consultar en el backend solo las conexiones que este proceso da por
+        inactivas: olvidar las que ya no están activas (cerradas por otro
+        proceso o por la retención) y reprogramar las que otro proceso refrescó.
+        Devuelve cuántas se olvidaron.
+        """
+        self._last_reconcile = time.monotonic()
+        with self._lock:
+            candidates = list(self._inactive)
+        if not candidates:
+            return 0
+
+        activity = self.backend.activity_of(candidates)
+
+        forgotten = 0
+        with self._lock:
+            for connection_id in candidates:
+                # Entretanto pudo refrescarse o cerrarse en este proceso
+                if connection_id not in self._inactive:
+                    continue
+                last_activity = activity.get(connection_id)
+                if last_activity is None:
+                    self._deadlines.pop(connection_id, None)
+                    self._inactive.discard(connection_id)
+                    forgotten += 1
+                    continue
+                deadline = last_activity.timestamp() + self.timeout
+                if deadline > self._deadlines.get(connection_id, 0):
+                    self._deadlines[connection_id] = deadline
+                    self._inactive.discard(connection_id)
+                    self.wheel.schedule((connection_id, deadline), deadline)
+        return forgotten
+
+    def _reconcile(self):
+        try:
+            self.reconcile()
+        except Exception as e:
+            logger.error(f"Error reconciliando el planificador de expiración: {e}")
+        finally:
+            close_old_connections()
+
+    def _cleanup_in_thread(self):
+        try:
+            self.run_cleanup()
+        finally:
+            connection.close()
+
+    def _run(self):
+        try:
+            seeded = self.seed()
+            logger.info(f"Planificador de expiración: {seeded} conexiones activas programadas")
+        except Exception as e:
+            logger.error(f"Error cargando conexiones activas en el planificador: {e}")
+        finally:
+            close_old_connections()
+
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.tick)
+            self._wakeup.clear()
+
+            inactive = self.advance()
+            requested, self._cleanup_requested = self._cleanup_requested, False
+            due = time.monotonic() - self._last_cleanup >= self.cleanup_interval
+
+            if requested or (inactive > self.max_connections and due):
+                logger.warning(f"Planificador: {inactive} conexiones inactivas, ejecutando limpieza")
+                self.run_cleanup()
+                self._reconcile()
+
+            if self.reconcile_interval and time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+                self._reconcile()
+
+            if self.retention_interval and time.monotonic() - self._last_retention >= self.retention_interval:
+                self.run_retention()
+                close_old_connections()
+
+
+_expiry_scheduler = None
+_expiry_scheduler_lock = threading.Lock()
+
+
+def get_expiry_scheduler():
+    """Obtener (y crear si no existe) el planificador de expiración del proceso"""
+    global _expiry_scheduler
+
+    with _expiry_scheduler_lock:
+        if _expiry_scheduler is None:
+            _expiry_scheduler = ExpiryScheduler()
+        return _expiry_scheduler
+
+
+def _reset_after_fork():
+    global _expiry_scheduler_lock, _autostart_lock
+    _expiry_scheduler_lock = threading.Lock()
+    _autostart_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+_autostart_pid = None
+_autostart_lock = threading.Lock()
+
+
+def ensure_background_tasks():
+    """Arrancar las tareas en segundo plano la primera vez que este proceso atiende una request"""
+    global _autostart_pid
+
+    pid = os.getpid()
+    if _autostart_pid == pid:
+        return
+
+    with _autostart_lock:
+        if _autostart_pid == pid:
+            return
+        if should_autostart():
+            # Planificador de expiración: un único worker por proceso servidor
+            get_expiry_scheduler().start()
+
+            # Pool de workers de la cola de webhooks (modo 202 opcional)
+            if getattr(settings, 'WEBHOOK_QUEUE_ENABLED', False):
+                from .jobs import get_worker_pool
+                get_worker_pool().start()
+        _autostart_pid = pid
+
+
+def should_autostart():
+    """Las tareas en segundo plano solo arrancan en procesos que sirven requests"""
+    if not getattr(settings, 'EXPIRY_SCHEDULER_ENABLED', True):
+        return False
+
+    if os.path.basename(sys.argv[0]) == 'manage.py' and len(sys.argv) > 1:
+        if sys.argv[1] != 'runserver':
+            return False
+        # Con autoreload solo en el proceso hijo que atiende requests
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+    return True
@@ -1,41 +1,155 @@
 from django.utils import timezone
 from django.conf import settings
-from .models import ActiveConnection, ConnectionCleanupLog, SuspiciousIP
+from django.db import transaction
+from collections import Counter
+from . import metrics
+from .admission import get_admission_controller
+from .backends import get_tracking_backend
+from .blocking import get_ip_blocklist
+from .models import CleanupLease, ConnectionCleanupLog, SuspiciousIP
+from .ratelimit import get_rate_limiter
+from .reputation import get_ip_reputation_cache
+from .singleflight import SingleFlight
+from .stats_cache import get_stats_cache
 import logging
+import os
 import random
+import socket
+import time
+import uuid
 
 logger = logging.getLogger('webhook_manager')
 
+# Ejecuciones de limpieza en curso dentro del proceso
+cleanup_flight = SingleFlight()
+
+# Identificador del proceso como dueño del lease de limpieza
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def get_connection_stats(backend=None):
+    """Estadísticas de conexiones compartidas por connection_status y system_stats"""
+    counts = (backend or get_tracking_backend()).stats()
+    max_connections = getattr(settings, 'MAX_CONNECTIONS', 200)
+    
+    return {
+        'total': counts['total'],
+        'inactive': counts['inactive'],
+        'webhook': counts['webhook'],
+        'max_allowed': max_connections,
+        'threshold_reached': counts['inactive'] > max_connections
+    }
+
+def get_system_stats(backend=None):
+    """Estadísticas completas del sistema para system_stats"""
+    connection_stats = get_connection_stats(backend)
+
+    # Solo las columnas del resumen: la lista empaquetada no se lee
+    recent_cleanups = ConnectionCleanupLog.objects.only('timestamp', 'connections_closed', 'cleanup_reason')[:5]
+    suspicious_ips = SuspiciousIP.objects.filter(connection_count__gte=5)
+
+    stats = {
+        'connections': {
+            'total_active': connection_stats['total'],
+            'inactive_count': connection_stats['inactive'],
+            'webhook_connections': connection_stats['webhook'],
+            'max_allowed': connection_stats['max_allowed'],
+            'cleanup_threshold_reached': connection_stats['threshold_reached']
+        },
+        'cleanup_history': [
+            {
+                'timestamp': cleanup.timestamp.isoformat(),
+                'connections_closed': cleanup.connections_closed,
+                'reason': cleanup.cleanup_reason
+            } for cleanup in recent_cleanups
+        ],
+        'suspicious_ips': [
+            {
+                'ip': ip.ip_address,
+                'connection_count': ip.connection_count,
+                'backup_count': ip.backup_connection_count,  # RAID 1 backup
+                'is_blocked': ip.is_blocked
+            } for ip in suspicious_ips
+        ],
+        'raid1_status': {
+            'enabled': True,
+            'backup_synchronized': all(
+                ip.connection_count == ip.backup_connection_count 
+                for ip in suspicious_ips
+            )
+        },
+        'ip_blocklist': (
+            get_ip_blocklist().stats() if getattr(settings, 'IP_BLOCKING_ENABLED', True)
+            else {'enabled': False}
+        ),
+        'admission': (
+            get_admission_controller().stats() if getattr(settings, 'ADMISSION_CONTROL_ENABLED', False)
+            else {'enabled': False}
+        ),
+        'rate_limit': (
+            get_rate_limiter().stats() if getattr(settings, 'RATE_LIMIT_ENABLED', False)
+            else {'enabled': False}
+        ),
+        'ip_reputation_cache': (
+            get_ip_reputation_cache().stats() if getattr(settings, 'IP_REPUTATION_CACHE_ENABLED', False)
+            else {'enabled': False}
+        )
+    }
+
+    return stats
+
 class ConnectionCleanupService:
     """Servicio para limpiar conexiones inactivas"""
     
-    def __init__(self):
+    def __init__(self, backend=None):
+        self.backend = backend or get_tracking_backend()
         self.timeout = getattr(settings, 'CONNECTION_TIMEOUT', 30)
         self.max_connections = getattr(settings, 'MAX_CONNECTIONS', 200)
         self.cleanup_percentage = getattr(settings, 'CLEANUP_PERCENTAGE', 0.5)
+        self.batch_size = getattr(settings, 'CLEANUP_BATCH_SIZE', 500)
     
     def cleanup_connections(self):
-        """Ejecutar limpieza de conexiones inactivas"""
+        """
+        Ejecutar limpieza de conexiones inactivas.
         
-        logger.info("Iniciando limpieza de conexiones inactivas...")
+        Los llamadores concurrentes del mismo proceso se unen a la ejecución en
+        curso y reciben su resultado; entre procesos, el lease en base de datos
+        garantiza que solo uno limpie a la vez.
+        """
+        return cleanup_flight.do('cleanup', self._cleanup_with_lease)
+    
+    def _cleanup_with_lease(self):
+        lease_ttl = getattr(settings, 'CLEANUP_LEASE_TTL', 300)
         
-        # Obtener todas las conexiones activas
-        active_connections = list(ActiveConnection.objects.filter(status='ACTIVE'))
-        total_before = len(active_connections)
+        if not CleanupLease.objects.acquire('cleanup', LEASE_OWNER, lease_ttl):
+            logger.info("Limpieza en curso en otro proceso, se omite esta ejecución")
+            return {
+                'executed': False,
+                'reason': 'Limpieza en curso en otro proceso'
+            }
         
-        # Filtrar conexiones inactivas
-        inactive_connections = [
-            conn for conn in active_connections 
-            if conn.is_inactive
-        ]
+        try:
+            return self.run_cleanup()
+        finally:
+            CleanupLease.objects.release('cleanup', LEASE_OWNER)
+    
+    def run_cleanup(self):
+        """Cuerpo de la limpieza, sin coordinación entre llamadores"""
         
-        inactive_count = len(inactive_connections)
+        logger.info("Iniciando limpieza de conexiones inactivas...")
+        started = time.perf_counter()
+        
+        # Consultar el backend de rastreo en lugar de cargar todas las conexiones
+        now = timezone.now()
+        counts = self.backend.stats()
+        total_before = counts['total']
+        inactive_count = counts['inactive']
         
         logger.info(f"Encontradas {inactive_count} conexiones inactivas de {total_before} totales")
         
         # Verificar si se debe ejecutar limpieza
         if inactive_count <= self.max_connections:
             logger.info(f"No se requiere limpieza: {inactive_count} <= {self.max_connections}")
+            metrics.cleanups.inc(labels=('false',))
             return {
                 'executed': False,
                 'reason': 'Umbral no alcanzado',
@@ -49,43 +163,43 @@ class ConnectionCleanupService:
         logger.warning(f"LIMPIEZA ACTIVADA: Cerrando {connections_to_close} de {inactive_count} conexiones inactivas")
         
         # Seleccionar conexiones a cerrar (las más antiguas)
-        connections_to_close_list = sorted(
-            inactive_connections, 
-            key=lambda x: x.last_activity
-        )[:connections_to_close]
+        selected = self.backend.oldest_inactive(connections_to_close)
         
-        # Cerrar conexiones seleccionadas
         closed_connections = []
-        for connection in connections_to_close_list:
-            try:
-                # Registrar IP sospechosa si es webhook
-                if connection.is_webhook:
-                    self.register_suspicious_ip(connection.client_ip)
-                
-                # Marcar conexión como cerrada
-                connection.status = 'CLOSED'
-                connection.save()
-                
-                closed_connections.append({
-                    'connection_id': str(connection.connection_id),
-                    'client_ip': connection.client_ip,
-                    'inactive_time': connection.inactive_time,
-                    'is_webhook': connection.is_webhook
-                })
-                
-                logger.info(f"Conexión cerrada: {connection.connection_id} de {connection.client_ip}")
+        suspicious_counts = Counter()
+        
+        # Toda la limpieza en una transacción: cierres por lotes, IPs y registro
+        with transaction.atomic():
+            for start in range(0, len(selected), self.batch_size):
+                batch = selected[start:start + self.batch_size]
+                closed_ids = self.backend.close([row[0] for row in batch])
                 
-            except Exception as e:
-                logger.error(f"Error cerrando conexión {connection.connection_id}: {e}")
-        
-        # Registrar en log de limpieza
-        cleanup_log = ConnectionCleanupLog.objects.create(
-            total_connections_before=total_before,
-            inactive_connections_found=inactive_count,
-            connections_closed=len(closed_connections),
-            cleanup_reason=f"Umbral de {self.max_connections} conexiones inactivas excedido",
-            connections_closed_list=closed_connections
-        )
+                for connection_id, client_ip, last_activity, is_webhook in batch:
+                    if connection_id not in closed_ids:
+                        continue
+                    
+                    # Acumular IP sospechosa si es webhook
+                    if is_webhook:
+                        suspicious_counts[client_ip] += 1
+                    
+                    closed_connections.append({
+                        'connection_id': str(connection_id),
+                        'client_ip': client_ip,
+                        'inactive_time': (now - last_activity).total_seconds(),
+                        'is_webhook': is_webhook
+                    })
+            
+            # Registrar todas las IPs sospechosas en una sola operación
+            self.register_suspicious_ips(suspicious_counts)
+            
+            # Registro resumen de la limpieza en lugar de una línea por conexión
+            cleanup_log = ConnectionCleanupLog.objects.create(
+                total_connections_before=total_before,
+                inactive_connections_found=inactive_count,
+                connections_closed=len(closed_connections),
+                cleanup_reason=f"Umbral de {self.max_connections} conexiones inactivas excedido",
+                connections_closed_list=closed_connections
+            )
         
         # Generar alerta de seguridad
         self.generate_security_alert(cleanup_log, closed_connections)
@@ -100,27 +214,48 @@ class ConnectionCleanupService:
             'cleanup_log_id': cleanup_log.id
         }
         
-        logger.info(f"Limpieza completada: {len(closed_connections)} conexiones cerradas")
+        logger.info(
+            f"Limpieza completada: {len(closed_connections)} conexiones cerradas "
+            f"({sum(suspicious_counts.values())} webhook de {len(suspicious_counts)} IPs, "
+            f"log de limpieza {cleanup_log.id})"
+        )
+        
+        # Las estadísticas cacheadas ya no reflejan el estado
+        get_stats_cache().invalidate()
+        
+        metrics.cleanups.inc(labels=('true',))
+        metrics.cleanup_duration.observe(time.perf_counter() - started)
+        metrics.cleanup_rows_closed.observe(len(closed_connections))
         
         return result
     
     def register_suspicious_ip(self, ip_address):
         """Registrar IP que deja conexiones webhook abiertas"""
         
+        self.register_suspicious_ips({ip_address: 1})
+    
+    def register_suspicious_ips(self, counts):
+        """Registrar en lote IPs que dejan conexiones webhook abiertas ({ip: cantidad})"""
+        
+        if not counts:
+            return
+        
         try:
-            suspicious_ip, created = SuspiciousIP.objects.get_or_create(
-                ip_address=ip_address
-            )
+            # Savepoint: un fallo aquí no invalida la transacción de la limpieza
+            with transaction.atomic():
+                SuspiciousIP.objects.increment_many(counts)
             
-            if not created:
-                suspicious_ip.connection_count += 1
-                suspicious_ip.last_seen = timezone.now()
-                suspicious_ip.save()
+            if getattr(settings, 'IP_BLOCKING_ENABLED', True):
+                # Las conexiones cerradas cuentan para el bloqueo automático
+                get_ip_blocklist().observe_many(counts)
             
-            logger.info(f"IP sospechosa registrada en RAID 1: {ip_address} ({suspicious_ip.connection_count} conexiones)")
+            logger.info(
+                f"IPs sospechosas registradas en RAID 1: {len(counts)} IPs "
+                f"(+{sum(counts.values())} conexiones)"
+            )
             
         except Exception as e:
-            logger.error(f"Error registrando IP sospechosa {ip_address}: {e}")
+            logger.error(f"Error registrando IPs sospechosas {list(counts)}: {e}")
     
     def generate_security_alert(self, cleanup_log, closed_connections):
         """Generar alerta de seguridad cuando se ejecuta limpieza"""
@@ -0,0 +1,56 @@
+"""
+Single-flight: llamadas concurrentes con la misma clave comparten una sola ejecución.
+
+El primer llamador ejecuta la función; los que llegan mientras está en curso
+esperan y reciben el mismo resultado (o la misma excepción).
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.joined = 0
+
+
+class SingleFlight:
+    """Agrupa ejecuciones concurrentes por clave dentro del proceso"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+    
+    def do(self, key, fn, *args, **kwargs):
+        """Ejecutar `fn` o unirse a la ejecución en curso para `key`"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.joined += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        
+        try:
+            call.result = fn(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        
+        return call.result
+    
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
@@ -0,0 +1,148 @@
+"""
+Caché de snapshots de estadísticas para los endpoints de monitoreo.
+
+Cada snapshot se sirve fresco durante STATS_CACHE_TTL segundos. Después, y
+hasta STATS_CACHE_STALE_TTL segundos más, se sirve el snapshot viejo mientras
+un único refresco lo recalcula en segundo plano (stale-while-revalidate).
+El almacenamiento puede ser local al proceso o la caché de Django, compartida
+entre workers.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from .singleflight import SingleFlight
+import logging
+import threading
+import time
+
+logger = logging.getLogger('webhook_manager')
+
+
+class LocalSnapshotStore:
+    """Snapshots en memoria del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshots = {}
+        self._refreshing = set()
+
+    def get(self, key):
+        return self._snapshots.get(key)
+
+    def set(self, key, snapshot):
+        self._snapshots[key] = snapshot
+
+    def delete(self, key):
+        self._snapshots.pop(key, None)
+
+    def acquire_refresh(self, key, timeout):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def release_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+
+class DjangoCacheSnapshotStore:
+    """Snapshots en una caché de Django (compartidos entre procesos)"""
+
+    def __init__(self, alias='default', prefix='webhook_manager:stats:'):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, snapshot):
+        self.cache.set(self.prefix + key, snapshot, timeout=None)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+    def acquire_refresh(self, key, timeout):
+        # cache.add solo escribe si la clave no existe: un refresco a la vez
+        return self.cache.add(f'{self.prefix}{key}:refresh', 1, timeout=max(1, int(timeout)))
+
+    def release_refresh(self, key):
+        self.cache.delete(f'{self.prefix}{key}:refresh')
+
+
+class StatsSnapshotCache:
+    """Caché con TTL y stale-while-revalidate para funciones de estadísticas"""
+
+    def __init__(self, store=None, ttl=None, stale_ttl=None):
+        self.store = store or LocalSnapshotStore()
+        self.ttl = ttl if ttl is not None else getattr(settings, 'STATS_CACHE_TTL', 2.0)
+        self.stale_ttl = stale_ttl if stale_ttl is not None else getattr(settings, 'STATS_CACHE_STALE_TTL', 10.0)
+        self._flight = SingleFlight()
+
+    def get(self, key, compute):
+        """
+        Devolver (datos, edad en segundos) del snapshot de `key`, calculándolo
+        con `compute` cuando no existe o es demasiado viejo
+        """
+        snapshot = self.store.get(key)
+        now = time.time()
+
+        if snapshot is not None:
+            age = now - snapshot['computed_at']
+            if age < self.ttl:
+                return snapshot['data'], age
+            if age < self.ttl + self.stale_ttl:
+                self._refresh_in_background(key, compute)
+                return snapshot['data'], age
+
+        # Sin snapshot utilizable: calcular una sola vez para todos los llamadores
+        snapshot = self._flight.do(key, self._refresh, key, compute)
+        return snapshot['data'], time.time() - snapshot['computed_at']
+
+    def invalidate(self, key=None):
+        """Descartar un snapshot (o todos los conocidos)"""
+        for snapshot_key in ([key] if key else SNAPSHOT_KEYS):
+            self.store.delete(snapshot_key)
+
+    def _refresh(self, key, compute):
+        snapshot = {'data': compute(), 'computed_at': time.time()}
+        self.store.set(key, snapshot)
+        return snapshot
+
+    def _refresh_in_background(self, key, compute):
+        if not self.store.acquire_refresh(key, timeout=self.ttl + self.stale_ttl):
+            return
+
+        def run():
+            try:
+                self._refresh(key, compute)
+            except Exception as e:
+                logger.error(f"Error refrescando snapshot de estadísticas {key}: {e}")
+            finally:
+                self.store.release_refresh(key)
+                connection.close()
+
+        threading.Thread(target=run, name=f'stats-refresh-{key}', daemon=True).start()
+
+
+# Claves de los snapshots servidos por las vistas
+SNAPSHOT_KEYS = ('connection_stats', 'system_stats')
+
+_stats_cache = None
+_stats_cache_lock = threading.Lock()
+
+
+def get_stats_cache():
+    """Obtener (y crear si no existe) la caché de estadísticas configurada"""
+    global _stats_cache
+
+    with _stats_cache_lock:
+        if _stats_cache is None:
+            if getattr(settings, 'STATS_CACHE_BACKEND', 'local') == 'django':
+                store = DjangoCacheSnapshotStore(getattr(settings, 'STATS_CACHE_ALIAS', 'default'))
+            else:
+                store = LocalSnapshotStore()
+            _stats_cache = StatsSnapshotCache(store=store)
+        return _stats_cache
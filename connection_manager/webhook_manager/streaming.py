@@ -0,0 +1,179 @@
+"""
+Stream de estadísticas en vivo con server-sent events (SSE).
+
+Un único StatsBroadcaster por event loop calcula el estado de las conexiones
+cada STATS_STREAM_INTERVAL segundos y reparte a todos los suscriptores solo
+lo que cambió (conteos, estado del umbral y limpiezas nuevas de
+ConnectionCleanupLog). Cada suscriptor tiene una cola acotada: si no consume
+a tiempo se descartan sus eventos más viejos en lugar de frenar al resto.
+"""
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .models import ConnectionCleanupLog
+from .services import get_connection_stats
+from .stats_cache import get_stats_cache
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger('webhook_manager')
+
+# Campos del estado que se comparan entre cálculos
+STATE_FIELDS = ('total', 'inactive', 'webhook', 'max_allowed', 'threshold_reached')
+
+# Limpiezas nuevas como máximo por evento
+CLEANUPS_PER_EVENT = 20
+
+
+def format_event(event, data, event_id=None, retry=None):
+    """Serializar un evento en formato text/event-stream"""
+    lines = []
+    if retry is not None:
+        lines.append(f'retry: {int(retry)}')
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def read_stream_state(last_cleanup_id=None):
+    """
+    Estado actual y limpiezas posteriores a `last_cleanup_id`.
+
+    Con last_cleanup_id=None solo se toma el id de la última limpieza, sin
+    reenviar el historial.
+    """
+    stats, _ = get_stats_cache().get('connection_stats', get_connection_stats)
+    state = {field: stats[field] for field in STATE_FIELDS}
+
+    logs = ConnectionCleanupLog.objects.order_by('-id')
+    if last_cleanup_id is None:
+        return state, [], logs.values_list('id', flat=True).first() or 0
+
+    cleanups = [
+        {
+            'id': cleanup['id'],
+            'timestamp': cleanup['timestamp'].isoformat(),
+            'connections_closed': cleanup['connections_closed'],
+            'inactive_connections_found': cleanup['inactive_connections_found'],
+            'reason': cleanup['cleanup_reason']
+        }
+        for cleanup in reversed(
+            logs.filter(id__gt=last_cleanup_id).values(
+                'id', 'timestamp', 'connections_closed', 'inactive_connections_found', 'cleanup_reason'
+            )[:CLEANUPS_PER_EVENT]
+        )
+    ]
+    return state, cleanups, cleanups[-1]['id'] if cleanups else last_cleanup_id
+
+
+class StatsBroadcaster:
+    """Calcula el estado una vez por intervalo y lo reparte a los suscriptores"""
+
+    def __init__(self, interval=None, queue_size=None):
+        self.interval = interval or getattr(settings, 'STATS_STREAM_INTERVAL', 1.0)
+        self.queue_size = queue_size or getattr(settings, 'STATS_STREAM_QUEUE_SIZE', 100)
+        self.subscribers = set()
+        self.state = None
+        self.sequence = 0
+        self.last_cleanup_id = None
+        self._task = None
+
+    async def subscribe(self):
+        """Registrar un suscriptor y devolver su cola con el snapshot inicial"""
+        if self.state is None:
+            await self.refresh()
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.put_nowait((self.sequence, 'snapshot', dict(self.state, cleanups=[])))
+        self.subscribers.add(queue)
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    async def refresh(self):
+        """Calcular el estado y devolver el delta respecto al anterior (o None)"""
+        state, cleanups, self.last_cleanup_id = await sync_to_async(read_stream_state)(self.last_cleanup_id)
+
+        previous, self.state = self.state, state
+        if previous is None:
+            return None
+
+        delta = {field: value for field, value in state.items() if previous.get(field) != value}
+        if cleanups:
+            delta['cleanups'] = cleanups
+        return delta or None
+
+    def publish(self, event, data):
+        self.sequence += 1
+        message = (self.sequence, event, data)
+        for queue in list(self.subscribers):
+            if queue.full():
+                # Suscriptor lento: descartar su evento más viejo
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    async def _run(self):
+        while self.subscribers:
+            await asyncio.sleep(self.interval)
+            try:
+                delta = await self.refresh()
+            except Exception as e:
+                logger.error(f"Error calculando estado para el stream de estadísticas: {e}")
+                continue
+            if delta:
+                delta['timestamp'] = timezone.now().isoformat()
+                self.publish('delta', delta)
+
+        # Sin suscriptores: el siguiente arranca con un estado recién calculado
+        self.state = None
+        self.last_cleanup_id = None
+
+
+async def stream_events(broadcaster, heartbeat=None, max_duration=None):
+    """Generador SSE de un suscriptor: snapshot, deltas y heartbeats"""
+    heartbeat = heartbeat or getattr(settings, 'STATS_STREAM_HEARTBEAT', 15.0)
+    max_duration = max_duration or getattr(settings, 'STATS_STREAM_MAX_SECONDS', 300.0)
+    retry_ms = broadcaster.interval * 1000
+
+    queue = await broadcaster.subscribe()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_duration
+    first = True
+    try:
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # El cliente EventSource se reconecta solo tras `retry`
+                return
+            try:
+                event_id, event, data = await asyncio.wait_for(queue.get(), timeout=min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': heartbeat\n\n'
+                continue
+            yield format_event(event, data, event_id=event_id, retry=retry_ms if first else None)
+            first = False
+    finally:
+        broadcaster.unsubscribe(queue)
+
+
+_broadcasters = {}
+
+
+def get_stats_broadcaster():
+    """Broadcaster del event loop actual (las colas asyncio no se comparten entre loops)"""
+    loop = asyncio.get_running_loop()
+    broadcaster = _broadcasters.get(loop)
+    if broadcaster is None:
+        # Descartar broadcasters de loops ya cerrados
+        for old_loop in [old for old in _broadcasters if old.is_closed()]:
+            del _broadcasters[old_loop]
+        broadcaster = _broadcasters[loop] = StatsBroadcaster()
+    return broadcaster
@@ -1,7 +1,48 @@
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
-from .models import ActiveConnection, SuspiciousIP
+from django.utils import timezone
+from datetime import timedelta
+from unittest import mock
+from .jobs import WebhookWorkerPool
+from .middleware import ConnectionTrackingMiddleware
+from .models import (
+    ActiveConnection, ArchivedCleanupLog, ArchivedConnection, CleanupLease, ConnectionCleanupLog,
+    ConnectionCountBucket, SuspiciousIP, WebhookJob, WebhookQueueCounter
+)
+from .admission import AdmissionClass, AdmissionRejected
+from .backends import InMemoryTrackingBackend, ORMTrackingBackend
+from .blocking import IPBlocklist, SlidingWindowCounter, get_ip_blocklist
+from .buffer import ActivityBuffer
+from .counters import ConnectionCounters
+from .db import apply_sqlite_pragmas
+from .logutils import BoundedQueueHandler, SamplingFilter, dropped_records
+from .ratelimit import DjangoCacheTokenBuckets, RateLimitRule, TokenBucketTable
+from .metrics import Histogram
+from .scheduler import ExpiryScheduler, HierarchicalTimingWheel, ensure_background_tasks
+from .services import LEASE_OWNER, ConnectionCleanupService, get_connection_stats, get_system_stats
+from .singleflight import SingleFlight
+from .stats_cache import DjangoCacheSnapshotStore, StatsSnapshotCache, get_stats_cache
+from .streaming import StatsBroadcaster
+from .packing import pack_closed_connections, unpack_closed_connections
+from .reputation import IPReputationCache, get_ip_reputation_cache
+from .retention import RetentionService
+import asyncio
+import io
 import json
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
 
 class WebhookManagerTests(TestCase):
     
@@ -22,4 +63,1572 @@ class WebhookManagerTests(TestCase):
     def test_health_check(self):
         """Probar health check"""
         response = self.client.get(reverse('health_check'))
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+class ConnectionCleanupServiceTests(TestCase):
+    
+    def create_connections(self, count, seconds_ago, ip='10.0.0.1', is_webhook=True):
+        now = timezone.now()
+        ActiveConnection.objects.bulk_create([
+            ActiveConnection(
+                client_ip=ip,
+                is_webhook=is_webhook,
+                last_activity=now - timedelta(seconds=seconds_ago + i)
+            ) for i in range(count)
+        ])
+    
+    @override_settings(MAX_CONNECTIONS=4)
+    def test_cleanup_closes_oldest_inactive(self):
+        """La limpieza cierra el 50% más antiguo de las conexiones inactivas"""
+        self.create_connections(10, seconds_ago=60)
+        self.create_connections(3, seconds_ago=0, ip='10.0.0.2')
+        oldest = set(
+            ActiveConnection.objects.order_by('last_activity')
+            .values_list('connection_id', flat=True)[:5]
+        )
+        
+        result = ConnectionCleanupService().cleanup_connections()
+        
+        self.assertTrue(result['executed'])
+        self.assertEqual(result['total_connections_before'], 13)
+        self.assertEqual(result['inactive_connections_found'], 10)
+        self.assertEqual(result['connections_closed'], 5)
+        closed = set(
+            ActiveConnection.objects.filter(status='CLOSED')
+            .values_list('connection_id', flat=True)
+        )
+        self.assertEqual(closed, oldest)
+        log = ConnectionCleanupLog.objects.get(id=result['cleanup_log_id'])
+        self.assertEqual(len(log.connections_closed_list), 5)
+    
+    @override_settings(MAX_CONNECTIONS=4, CLEANUP_BATCH_SIZE=10)
+    def test_cleanup_batches_queries_and_logging(self):
+        """Cerrar muchas conexiones usa un número acotado de consultas y de líneas de log"""
+        for i in range(3):
+            self.create_connections(40, seconds_ago=60, ip=f'10.0.0.{i + 1}')
+        
+        with CaptureQueriesContext(connection) as queries, self.assertLogs('webhook_manager', 'INFO') as logs:
+            result = ConnectionCleanupService().cleanup_connections()
+        
+        self.assertEqual(result['connections_closed'], 60)
+        # 6 lotes de 10 cierres: una consulta por lote, no por conexión
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "webhook_manager_activeconnection"')]
+        self.assertEqual(len(updates), 6)
+        self.assertLess(len(queries.captured_queries), 40)
+        self.assertFalse([line for line in logs.output if 'Conexión cerrada' in line])
+        self.assertEqual(SuspiciousIP.objects.aggregate(total=Sum('connection_count'))['total'], 60)
+        
+        log = ConnectionCleanupLog.objects.get(id=result['cleanup_log_id'])
+        self.assertEqual(
+            set(log.connections_closed_list[0]),
+            {'connection_id', 'client_ip', 'inactive_time', 'is_webhook'}
+        )
+    
+    @override_settings(MAX_CONNECTIONS=4)
+    def test_cleanup_rolls_back_as_a_whole(self):
+        """Si falla el registro de la limpieza no queda ninguna conexión cerrada"""
+        self.create_connections(10, seconds_ago=60)
+        
+        with mock.patch.object(ConnectionCleanupLog.objects, 'create', side_effect=RuntimeError('fallo')):
+            with self.assertRaises(RuntimeError):
+                ConnectionCleanupService().run_cleanup()
+        
+        self.assertFalse(ActiveConnection.objects.filter(status='CLOSED').exists())
+        self.assertFalse(SuspiciousIP.objects.exists())
+    
+    @override_settings(MAX_CONNECTIONS=4)
+    def test_cleanup_below_threshold(self):
+        """No se ejecuta limpieza si no se supera el umbral"""
+        self.create_connections(4, seconds_ago=60)
+        self.create_connections(10, seconds_ago=0)
+        
+        result = ConnectionCleanupService().cleanup_connections()
+        
+        self.assertFalse(result['executed'])
+        self.assertEqual(result['inactive_connections'], 4)
+        self.assertFalse(ActiveConnection.objects.filter(status='CLOSED').exists())
+
+
+class ActiveConnectionIndexTests(TestCase):
+    """Verifica con EXPLAIN que las consultas calientes usan los índices compuestos"""
+    
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertRegex(plan, r'ac_\w+_idx', plan)
+    
+    def test_hot_queries_use_indexes(self):
+        ActiveConnection.objects.create(client_ip='10.0.0.1', is_webhook=True)
+        now = timezone.now()
+        active = ActiveConnection.objects.filter(status='ACTIVE').order_by()
+        
+        # Conteos de connection_status / system_stats
+        self.assertUsesIndex(active)
+        self.assertUsesIndex(active.filter(is_webhook=True))
+        self.assertUsesIndex(active.filter(last_activity__lt=now))
+        # get_or_create del middleware
+        self.assertUsesIndex(active.filter(client_ip='10.0.0.1', is_webhook=False))
+        # Selección de las conexiones más antiguas en la limpieza
+        self.assertUsesIndex(
+            active.filter(last_activity__lt=now).order_by('last_activity').values_list('id')[:10]
+        )
+
+
+class ActivityBufferTests(TestCase):
+    
+    def test_flush_writes_batched_activity(self):
+        """El buffer escribe conexiones, actividad e IPs sospechosas en lote"""
+        buffer = ActivityBuffer(batch_size=100, max_size=1000)
+        webhook_ids = [
+            buffer.record_request('10.0.0.1', 'sim', True, '/api/webhook/')
+            for _ in range(3)
+        ]
+        first = buffer.record_request('10.0.0.2', 'browser', False, '')
+        second = buffer.record_request('10.0.0.2', 'browser', False, '')
+        
+        self.assertEqual(first, second)
+        self.assertFalse(ActiveConnection.objects.exists())
+        
+        self.assertEqual(buffer.flush(), 5)
+        
+        self.assertEqual(
+            set(ActiveConnection.objects.filter(is_webhook=True).values_list('connection_id', flat=True)),
+            set(webhook_ids)
+        )
+        normal = ActiveConnection.objects.get(is_webhook=False)
+        self.assertEqual(normal.connection_id, first)
+        suspicious_ip = SuspiciousIP.objects.get(ip_address='10.0.0.1')
+        self.assertEqual(suspicious_ip.connection_count, 3)
+        self.assertEqual(suspicious_ip.backup_connection_count, 3)
+        
+        # Una segunda ronda actualiza los registros existentes
+        buffer.record_request('10.0.0.1', 'sim', True, '/api/webhook/')
+        buffer.record_request('10.0.0.2', 'browser', False, '')
+        buffer.flush()
+        
+        self.assertEqual(ActiveConnection.objects.filter(is_webhook=False).count(), 1)
+        suspicious_ip.refresh_from_db()
+        self.assertEqual(suspicious_ip.connection_count, 4)
+        self.assertEqual(suspicious_ip.backup_connection_count, 4)
+    
+    def test_full_buffer_flushes_inline(self):
+        """Al alcanzar el tope el buffer se vacía en la propia request"""
+        buffer = ActivityBuffer(batch_size=2, max_size=3)
+        for _ in range(3):
+            buffer.record_request('10.0.0.3', 'sim', True, '/api/webhook/')
+        
+        self.assertEqual(ActiveConnection.objects.count(), 3)
+    
+    def test_closed_connection_is_recreated_with_new_id(self):
+        """Si la limpieza cerró la conexión normal de la IP, se crea otra en lugar de chocar con la cerrada"""
+        buffer = ActivityBuffer(batch_size=100, max_size=1000)
+        first = buffer.record_request('10.0.0.4', 'browser', False, '')
+        buffer.flush()
+        ActiveConnection.objects.filter(connection_id=first).update(status='CLOSED')
+        
+        buffer.record_request('10.0.0.4', 'browser', False, '')
+        buffer.record_request('10.0.0.5', 'sim', True, '/api/webhook/')
+        self.assertEqual(buffer.flush(), 2)
+        
+        reopened = ActiveConnection.objects.get(client_ip='10.0.0.4', status='ACTIVE')
+        self.assertNotEqual(reopened.connection_id, first)
+        self.assertEqual(buffer.record_request('10.0.0.4', 'browser', False, ''), reopened.connection_id)
+        self.assertTrue(ActiveConnection.objects.filter(client_ip='10.0.0.5').exists())
+    
+    def test_failed_flush_keeps_events(self):
+        """Un vaciado fallido devuelve el lote al buffer para el siguiente intento"""
+        buffer = ActivityBuffer(batch_size=100, max_size=1000)
+        buffer.record_request('10.0.0.6', 'sim', True, '/api/webhook/')
+        buffer.record_request('10.0.0.7', 'browser', False, '')
+        
+        with mock.patch.object(SuspiciousIP.objects, 'increment_many', side_effect=RuntimeError('db caída')):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertFalse(ActiveConnection.objects.exists())
+        
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(ActiveConnection.objects.count(), 2)
+        self.assertEqual(SuspiciousIP.objects.get(ip_address='10.0.0.6').connection_count, 1)
+
+
+    def test_failed_flush_keeps_buffer_bounded_and_backs_off(self):
+        """Con la base de datos caída el buffer no pasa de max_size y las requests no reintentan"""
+        buffer = ActivityBuffer(batch_size=100, max_size=3, retry_backoff=60)
+        with mock.patch.object(SuspiciousIP.objects, 'increment_many', side_effect=RuntimeError('db caída')) as increment:
+            for i in range(6):
+                buffer.record_request(f'10.0.1.{i}', 'sim', True, '/api/webhook/')
+            self.assertEqual(increment.call_count, 1)
+
+        self.assertEqual(buffer.dropped, 3)
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(
+            set(ActiveConnection.objects.values_list('client_ip', flat=True)),
+            {'10.0.1.3', '10.0.1.4', '10.0.1.5'}
+        )
+        self.assertFalse(SuspiciousIP.objects.filter(ip_address='10.0.1.0').exists())
+
+class SuspiciousIPIncrementTests(TransactionTestCase):
+    
+    def test_increment_many_keeps_backup_in_sync(self):
+        """El incremento en lote crea y actualiza IPs sin desincronizar el backup"""
+        SuspiciousIP.objects.increment_many({'10.0.0.1': 2, '10.0.0.2': 1})
+        SuspiciousIP.objects.increment_many({'10.0.0.1': 3, '2001:db8::1': 4})
+        
+        counts = {
+            ip.ip_address: (ip.connection_count, ip.backup_connection_count)
+            for ip in SuspiciousIP.objects.all()
+        }
+        self.assertEqual(counts, {
+            '10.0.0.1': (5, 5),
+            '10.0.0.2': (1, 1),
+            '2001:db8::1': (4, 4),
+        })
+    
+    def test_concurrent_increments_are_not_lost(self):
+        """Muchos hilos incrementando la misma IP no pierden incrementos"""
+        threads_count = 8
+        increments_per_thread = 25
+        errors = []
+        
+        def hammer():
+            try:
+                for _ in range(increments_per_thread):
+                    SuspiciousIP.objects.increment('10.0.0.9')
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=hammer) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(errors, [])
+        suspicious_ip = SuspiciousIP.objects.get(ip_address='10.0.0.9')
+        self.assertEqual(suspicious_ip.connection_count, threads_count * increments_per_thread)
+        self.assertEqual(suspicious_ip.backup_connection_count, threads_count * increments_per_thread)
+
+
+class ConcurrentNormalConnectionTests(TransactionTestCase):
+
+    def test_concurrent_requests_from_one_ip_share_one_connection(self):
+        """Requests normales simultáneas de la misma IP no duplican su conexión ACTIVE"""
+        backend = ORMTrackingBackend(timeout=30)
+        threads_count = 8
+        ips = [f'10.0.1.{i}' for i in range(20)]
+        barrier = threading.Barrier(threads_count)
+        errors = []
+        ids = []
+
+        def register(ip):
+            # La base de datos de tests (SQLite en memoria con caché compartida)
+            # no espera al lock de tabla: reintentar como haría busy_timeout
+            while True:
+                try:
+                    return backend.register_connection(ip, 'browser', False, '')
+                except OperationalError as e:
+                    if 'locked' not in str(e):
+                        raise
+                    time.sleep(0.001)
+
+        def request():
+            try:
+                for ip in ips:
+                    # Todas las requests de cada IP llegan a la vez
+                    barrier.wait()
+                    ids.append((ip, register(ip)))
+            except Exception as e:
+                errors.append(e)
+                barrier.abort()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=request) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        active = dict(
+            ActiveConnection.objects.filter(status='ACTIVE', is_webhook=False).values_list('client_ip', 'connection_id')
+        )
+        self.assertEqual(ActiveConnection.objects.filter(status='ACTIVE', is_webhook=False).count(), len(ips))
+        self.assertEqual(set(ids), set(active.items()))
+
+    def test_in_memory_persist_reuses_row_of_other_process(self):
+        """Otro proceso con registro en memoria adopta la fila ACTIVE de la IP en lugar de duplicarla"""
+        first, second = InMemoryTrackingBackend(timeout=30, shards=2), InMemoryTrackingBackend(timeout=30, shards=2)
+        first.record_request('10.0.0.21', 'browser', False, '')
+        second.record_request('10.0.0.21', 'browser', False, '')
+
+        self.assertEqual(first.persist(), 1)
+        self.assertEqual(second.persist(), 1)
+        self.assertEqual(ActiveConnection.objects.filter(client_ip='10.0.0.21', status='ACTIVE').count(), 1)
+
+
+class InMemoryTrackingBackendTests(TestCase):
+    
+    def setUp(self):
+        self.backend = InMemoryTrackingBackend(timeout=30, shards=4)
+        self.start = timezone.now()
+    
+    def at(self, seconds):
+        return mock.patch(
+            'webhook_manager.backends.timezone.now',
+            return_value=self.start + timedelta(seconds=seconds)
+        )
+    
+    def test_expiry_and_oldest_inactive(self):
+        """Las conexiones expiran en orden de last_activity y se refrescan con actividad"""
+        ids = []
+        for i in range(5):
+            with self.at(i):
+                ids.append(self.backend.record_request(f'10.0.0.{i}', 'sim', True, '/api/webhook/'))
+        with self.at(2.5):
+            browser = self.backend.record_request('10.0.1.1', 'browser', False, '')
+        
+        with self.at(33):
+            self.assertEqual(self.backend.active_count(), 6)
+            self.assertEqual(self.backend.webhook_count(), 5)
+            self.assertEqual(self.backend.inactive_count(), 4)
+            oldest = self.backend.oldest_inactive(4)
+        self.assertEqual([row[0] for row in oldest], ids[:3] + [browser])
+        
+        # La actividad de una conexión normal la saca de las inactivas
+        with self.at(33):
+            self.assertEqual(self.backend.record_request('10.0.1.1', 'browser', False, ''), browser)
+            self.assertEqual(self.backend.inactive_count(), 3)
+            self.assertEqual(
+                [row[0] for row in self.backend.oldest_inactive(10)],
+                ids[:3]
+            )
+    
+    def test_close_and_persist(self):
+        """Cerrar conexiones actualiza los conteos y la persistencia refleja el estado"""
+        with self.at(0):
+            ids = [
+                self.backend.record_request('10.0.0.1', 'sim', True, '/api/webhook/')
+                for _ in range(3)
+            ]
+        self.assertEqual(self.backend.persist(), 3)
+        
+        with self.at(40):
+            closed = self.backend.close(ids[:2] + [ids[0]])
+            self.assertEqual(closed, set(ids[:2]))
+            self.assertEqual(self.backend.inactive_count(), 1)
+            self.assertEqual(self.backend.active_count(), 1)
+        self.backend.persist()
+        
+        self.assertEqual(
+            set(ActiveConnection.objects.filter(status='CLOSED').values_list('connection_id', flat=True)),
+            set(ids[:2])
+        )
+        self.assertEqual(ActiveConnection.objects.filter(status='ACTIVE').count(), 1)
+        self.assertEqual(SuspiciousIP.objects.get(ip_address='10.0.0.1').connection_count, 3)
+    
+    def test_failed_persist_is_retried(self):
+        """Un volcado fallido conserva conexiones, cierres e IPs sospechosas para el siguiente ciclo"""
+        with self.at(0):
+            ids = [self.backend.record_request('10.0.0.1', 'sim', True, '/api/webhook/') for _ in range(2)]
+        self.backend.persist()
+        self.backend.close(ids[:1])
+        self.backend.record_request('10.0.0.2', 'sim', True, '/api/webhook/')
+        
+        with mock.patch.object(SuspiciousIP.objects, 'increment_many', side_effect=RuntimeError('db caída')):
+            self.assertEqual(self.backend.persist(), 0)
+        
+        self.assertEqual(self.backend.persist(), 2)
+        self.assertEqual(ActiveConnection.objects.get(connection_id=ids[0]).status, 'CLOSED')
+        self.assertEqual(ActiveConnection.objects.filter(status='ACTIVE').count(), 2)
+        self.assertEqual(SuspiciousIP.objects.get(ip_address='10.0.0.2').connection_count, 1)
+    
+    def test_orm_close_returns_only_rows_it_closed(self):
+        """El backend ORM no devuelve conexiones que otro proceso ya había cerrado"""
+        backend = ORMTrackingBackend(timeout=30)
+        ids = [backend.record_request(f'10.0.0.{i}', 'sim', True, '/api/webhook/') for i in range(3)]
+        ActiveConnection.objects.filter(connection_id=ids[0]).update(status='CLOSED')
+        
+        self.assertEqual(backend.close(ids + [uuid.uuid4()]), set(ids[1:]))
+    
+    @override_settings(MAX_CONNECTIONS=2)
+    def test_cleanup_service_uses_backend(self):
+        """La limpieza funciona sobre el registro en memoria"""
+        with self.at(0):
+            for i in range(6):
+                self.backend.record_request(f'10.0.0.{i}', 'sim', True, '/api/webhook/')
+        
+        with self.at(40):
+            result = ConnectionCleanupService(backend=self.backend).cleanup_connections()
+            self.assertEqual(self.backend.inactive_count(), 3)
+        
+        self.assertTrue(result['executed'])
+        self.assertEqual(result['connections_closed'], 3)
+
+
+class HierarchicalTimingWheelTests(TestCase):
+    
+    def test_entries_expire_at_their_deadline(self):
+        """Las entradas expiran en su tick exacto en cualquier nivel de la rueda"""
+        wheel = HierarchicalTimingWheel(tick=1.0, slots=8, levels=3, start=1000)
+        deadlines = {f'k{delay}': 1000 + delay for delay in (1, 7, 8, 9, 63, 64, 65, 300, 1000)}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+        wheel.schedule('overdue', 990)
+        
+        fired = {}
+        for now in range(1000, 2001):
+            for key in wheel.advance(now):
+                fired[key] = now
+        
+        self.assertEqual(fired.pop('overdue'), 1000)
+        self.assertEqual(fired, deadlines)
+        self.assertEqual(wheel.size, 0)
+
+
+class ExpirySchedulerTests(TestCase):
+    
+    def setUp(self):
+        self.backend = InMemoryTrackingBackend(timeout=30, shards=2)
+        self.scheduler = ExpiryScheduler(backend=self.backend, tick=1.0)
+        self.backend.add_listener(self.scheduler)
+        self.start = timezone.now()
+    
+    def test_counts_expired_connections_without_scanning(self):
+        """La rueda cuenta inactivas, las refresca con actividad y olvida las cerradas"""
+        with mock.patch('webhook_manager.backends.timezone.now', return_value=self.start):
+            webhook = self.backend.record_request('10.0.0.1', 'sim', True, '/api/webhook/')
+            browser = self.backend.record_request('10.0.0.2', 'browser', False, '')
+        
+        base = self.start.timestamp()
+        self.assertEqual(self.scheduler.advance(base + 29), 0)
+        self.assertEqual(self.scheduler.advance(base + 31), 2)
+        
+        with mock.patch('webhook_manager.backends.timezone.now', return_value=self.start + timedelta(seconds=31)):
+            self.backend.record_request('10.0.0.2', 'browser', False, '')
+        self.assertEqual(self.scheduler.inactive_count, 1)
+        
+        self.backend.close([webhook])
+        self.assertEqual(self.scheduler.inactive_count, 0)
+        self.assertEqual(self.scheduler.advance(base + 62), 1)
+        self.assertEqual(self.scheduler._deadlines.keys(), {browser})
+    
+    def test_cleanup_runs_through_service(self):
+        """El planificador delega la limpieza en ConnectionCleanupService"""
+        result = self.scheduler.run_cleanup()
+        self.assertFalse(result['executed'])
+    
+    def test_reconcile_forgets_connections_closed_elsewhere(self):
+        """La reconciliación consulta solo las inactivas y olvida las que otro proceso cerró"""
+        backend = ORMTrackingBackend(timeout=30)
+        scheduler = ExpiryScheduler(backend=backend, tick=1.0)
+        backend.add_listener(scheduler)
+        ids = [backend.record_request(f'10.0.0.{i}', 'sim', True, '/api/webhook/') for i in range(3)]
+        self.assertEqual(scheduler.advance(time.time() + 31), 3)
+
+        ActiveConnection.objects.filter(connection_id=ids[0]).update(status='CLOSED')
+        # Otro proceso refrescó la segunda
+        ActiveConnection.objects.filter(connection_id=ids[1]).update(last_activity=timezone.now() + timedelta(seconds=20))
+        with self.assertNumQueries(1):
+            self.assertEqual(scheduler.reconcile(), 1)
+        self.assertEqual(scheduler.inactive_count, 1)
+        self.assertEqual(scheduler._deadlines.keys(), set(ids[1:]))
+    
+    def test_starts_once_per_process(self):
+        """Las tareas arrancan con la primera request de cada proceso, también tras un fork"""
+        fake = mock.Mock()
+        with mock.patch('webhook_manager.scheduler.should_autostart', return_value=True), \
+                mock.patch('webhook_manager.scheduler.get_expiry_scheduler', return_value=fake), \
+                mock.patch('webhook_manager.scheduler._autostart_pid', None):
+            for pid in (100, 100, 100, 200, 200):
+                with mock.patch('webhook_manager.scheduler.os.getpid', return_value=pid):
+                    ensure_background_tasks()
+        self.assertEqual(fake.start.call_count, 2)
+        
+        # Un planificador heredado del padre no cuenta como en marcha en el hijo
+        self.scheduler._thread, self.scheduler._pid = mock.Mock(), -1
+        self.assertFalse(self.scheduler.running)
+
+
+class CleanupSingleFlightTests(TestCase):
+    
+    def test_concurrent_callers_share_one_run(self):
+        """Los llamadores concurrentes reciben el resultado de la ejecución en curso"""
+        flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        results = []
+        
+        def slow_cleanup():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'executed': True}
+        
+        leader = threading.Thread(target=lambda: results.append(flight.do('cleanup', slow_cleanup)))
+        leader.start()
+        started.wait(5)
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do('cleanup', slow_cleanup)))
+            for _ in range(5)
+        ]
+        for follower in followers:
+            follower.start()
+        while flight._calls['cleanup'].joined < 5:
+            threading.Event().wait(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 6)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertFalse(flight.in_flight('cleanup'))
+    
+    def test_lease_is_exclusive_until_expired(self):
+        """El lease en base de datos solo lo tiene un proceso a la vez"""
+        self.assertTrue(CleanupLease.objects.acquire('cleanup', 'worker-a', ttl=60))
+        self.assertTrue(CleanupLease.objects.acquire('cleanup', 'worker-a', ttl=60))
+        self.assertFalse(CleanupLease.objects.acquire('cleanup', 'worker-b', ttl=60))
+        
+        CleanupLease.objects.release('cleanup', 'worker-a')
+        self.assertTrue(CleanupLease.objects.acquire('cleanup', 'worker-b', ttl=-1))
+        self.assertTrue(CleanupLease.objects.acquire('cleanup', 'worker-a', ttl=60))
+    
+    @override_settings(MAX_CONNECTIONS=0)
+    def test_cleanup_skipped_when_another_process_holds_lease(self):
+        """Si otro proceso tiene el lease la limpieza no cierra conexiones"""
+        ActiveConnection.objects.create(
+            client_ip='10.0.0.1',
+            last_activity=timezone.now() - timedelta(seconds=60)
+        )
+        CleanupLease.objects.acquire('cleanup', 'otro-worker', ttl=60)
+        
+        result = ConnectionCleanupService().cleanup_connections()
+        
+        self.assertFalse(result['executed'])
+        self.assertFalse(ActiveConnection.objects.filter(status='CLOSED').exists())
+        self.assertFalse(CleanupLease.objects.filter(owner=LEASE_OWNER).exists())
+
+
+class AsyncWebhookTests(TestCase):
+    
+    @override_settings(LONG_WEBHOOK_SECONDS=0.3)
+    async def test_long_webhooks_do_not_block_each_other(self):
+        """Los long webhooks async se atienden en paralelo en el event loop"""
+        client = AsyncClient()
+        started = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post(reverse('long_webhook'), data={}, content_type='application/json')
+            for _ in range(20)
+        ])
+        elapsed = time.perf_counter() - started
+        
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertLess(elapsed, 20 * 0.3 / 2)
+    
+    async def test_webhook_rejects_other_methods(self):
+        """El endpoint async mantiene la restricción de métodos GET/POST"""
+        response = await AsyncClient().put(reverse('webhook_endpoint'))
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(WEBHOOK_QUEUE_ENABLED=True, WEBHOOK_PROCESSING_SECONDS=0)
+class WebhookQueueTests(TestCase):
+    
+    def post_webhook(self, data):
+        return self.client.post(
+            reverse('webhook_endpoint'),
+            data=json.dumps(data),
+            content_type='application/json'
+        )
+    
+    def test_webhook_is_accepted_and_processed(self):
+        """El webhook se acepta con 202 y su estado se consulta por job_id"""
+        response = self.post_webhook({'test': 'data'})
+        
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        status = self.client.get(body['status_url']).json()
+        self.assertEqual(status['status'], 'PENDING')
+        
+        self.assertEqual(WebhookWorkerPool(workers=1).run_pending(), 1)
+        
+        status = self.client.get(body['status_url']).json()
+        self.assertEqual(status['status'], 'DONE')
+        self.assertEqual(status['result']['data_received'], {'test': 'data'})
+    
+    def test_invalid_payload_is_rejected(self):
+        """Un payload que no es JSON no se encola"""
+        response = self.client.post(reverse('webhook_endpoint'), data='{no json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookJob.objects.exists())
+    
+    @override_settings(WEBHOOK_QUEUE_MAX_SIZE=2)
+    def test_full_queue_returns_429(self):
+        """Con la cola llena se responde 429 con Retry-After"""
+        self.post_webhook({'n': 1})
+        self.post_webhook({'n': 2})
+        response = self.post_webhook({'n': 3})
+        
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(WebhookJob.objects.count(), 2)
+    
+    @override_settings(WEBHOOK_QUEUE_MAX_ATTEMPTS=2, WEBHOOK_QUEUE_RETRY_BACKOFF=0)
+    def test_failed_jobs_are_retried_then_marked_failed(self):
+        """Los errores se reintentan con backoff hasta agotar los intentos"""
+        def failing_handler(payload):
+            raise RuntimeError('fallo simulado')
+        
+        job_id = self.post_webhook({'n': 1}).json()['job_id']
+        pool = WebhookWorkerPool(workers=1, handler=failing_handler)
+        
+        self.assertEqual(pool.run_pending(), 2)
+        job = WebhookJob.objects.get(job_id=job_id)
+        self.assertEqual(job.status, 'FAILED')
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.last_error, 'fallo simulado')
+    
+    def test_reclaimed_job_fences_original_worker(self):
+        """Si el lease vence y otro worker reclama el trabajo, el resultado del primero se descarta"""
+        job_id = self.post_webhook({'n': 1}).json()['job_id']
+        slow, fast = WebhookWorkerPool(workers=1), WebhookWorkerPool(workers=1)
+        
+        stale = slow.claim_next()
+        WebhookJob.objects.filter(pk=stale.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        fresh = fast.claim_next()
+        self.assertEqual(fresh.pk, stale.pk)
+        self.assertNotEqual(fresh.lease_owner, stale.lease_owner)
+        
+        self.assertFalse(slow.run_job(stale))
+        self.assertEqual(WebhookJob.objects.get(job_id=job_id).status, 'RUNNING')
+        self.assertTrue(fast.run_job(fresh))
+        self.assertEqual(WebhookJob.objects.get(job_id=job_id).status, 'DONE')
+
+    @override_settings(WEBHOOK_QUEUE_MAX_ATTEMPTS=2)
+    def test_crashed_workers_use_up_attempts(self):
+        """Cada reclamo guarda el intento: un trabajo cuyos workers mueren acaba FAILED"""
+        job_id = self.post_webhook({'n': 1}).json()['job_id']
+        pool = WebhookWorkerPool(workers=1)
+
+        for attempt in (1, 2):
+            job = pool.claim_next()
+            self.assertEqual(WebhookJob.objects.get(job_id=job_id).attempts, attempt)
+            # El worker muere sin terminar: el lease vence
+            WebhookJob.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertIsNone(pool.claim_next())
+        job = WebhookJob.objects.get(job_id=job_id)
+        self.assertEqual((job.status, job.attempts), ('FAILED', 2))
+        self.assertEqual(WebhookQueueCounter.objects.get().pending, 0)
+
+    @override_settings(WEBHOOK_QUEUE_MAX_SIZE=1)
+    def test_finished_jobs_free_their_slot(self):
+        """Terminar un trabajo libera su hueco y borrar uno a mano se corrige al recontar"""
+        self.assertEqual(self.post_webhook({'n': 1}).status_code, 202)
+        self.assertEqual(self.post_webhook({'n': 2}).status_code, 429)
+
+        WebhookWorkerPool(workers=1).run_pending()
+        self.assertEqual(self.post_webhook({'n': 3}).status_code, 202)
+
+        WebhookJob.objects.filter(status='PENDING').delete()
+        self.assertEqual(self.post_webhook({'n': 4}).status_code, 202)
+        self.assertEqual(WebhookQueueCounter.objects.get().pending, 1)
+
+
+class ConnectionStatsTests(TestCase):
+    
+    def setUp(self):
+        now = timezone.now()
+        stale = now - timedelta(seconds=60)
+        rows = [
+            ('10.0.0.1', True, 'ACTIVE', stale, 3),
+            ('10.0.0.2', False, 'ACTIVE', stale, 1),
+            ('10.0.0.5', False, 'ACTIVE', stale, 1),
+            ('10.0.0.3', True, 'ACTIVE', now, 4),
+            ('10.0.0.4', True, 'CLOSED', stale, 1),
+        ]
+        ActiveConnection.objects.bulk_create([
+            ActiveConnection(client_ip=ip, is_webhook=is_webhook, status=status, last_activity=last_activity)
+            for ip, is_webhook, status, last_activity, count in rows
+            for _ in range(count)
+        ])
+        get_stats_cache().invalidate()
+    
+    @override_settings(MAX_CONNECTIONS=4)
+    def test_stats_use_a_single_query(self):
+        """Total, inactivas y webhook salen de una sola consulta agregada"""
+        with self.assertNumQueries(1):
+            stats = get_connection_stats(ORMTrackingBackend())
+        
+        self.assertEqual(stats, {
+            'total': 9,
+            'inactive': 5,
+            'webhook': 7,
+            'max_allowed': 4,
+            'threshold_reached': True
+        })
+    
+    def test_views_keep_response_shape(self):
+        """connection_status y system_stats devuelven los mismos campos"""
+        status = self.client.get(reverse('connection_status')).json()
+        self.assertEqual(set(status), {
+            'total_active_connections', 'inactive_connections', 'webhook_connections',
+            'threshold_reached', 'cleanup_needed', 'snapshot_age', 'timestamp'
+        })
+        self.assertEqual(status['inactive_connections'], 5)
+        
+        stats = self.client.get(reverse('system_stats')).json()
+        self.assertEqual(set(stats['connections']), {
+            'total_active', 'inactive_count', 'webhook_connections',
+            'max_allowed', 'cleanup_threshold_reached'
+        })
+        self.assertEqual(stats['connections']['webhook_connections'], 7)
+
+class StatsSnapshotCacheTests(TestCase):
+    
+    def test_fresh_snapshot_is_reused(self):
+        """Dentro del TTL no se vuelve a calcular"""
+        compute = mock.Mock(return_value={'total': 1})
+        cache = StatsSnapshotCache(ttl=60, stale_ttl=60)
+        
+        self.assertEqual(cache.get('stats', compute)[0], {'total': 1})
+        data, age = cache.get('stats', compute)
+        
+        self.assertEqual(data, {'total': 1})
+        self.assertLess(age, 60)
+        self.assertEqual(compute.call_count, 1)
+    
+    def test_stale_snapshot_is_served_while_refreshing(self):
+        """Pasado el TTL se devuelve el snapshot viejo y un solo hilo lo refresca"""
+        release = threading.Event()
+        values = iter([{'total': 1}, {'total': 2}])
+        
+        def compute():
+            value = next(values)
+            if value['total'] == 2:
+                release.wait(5)
+            return value
+        
+        cache = StatsSnapshotCache(ttl=0.01, stale_ttl=60)
+        cache.get('stats', compute)
+        time.sleep(0.02)
+        
+        # Varias lecturas durante el refresco: todas reciben el snapshot viejo
+        for _ in range(5):
+            data, age = cache.get('stats', compute)
+            self.assertEqual(data, {'total': 1})
+            self.assertGreaterEqual(age, 0.01)
+        
+        release.set()
+        for _ in range(50):
+            if cache.store.get('stats')['data'] == {'total': 2}:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.store.get('stats')['data'], {'total': 2})
+    
+    def test_expired_snapshot_is_recomputed(self):
+        """Más allá de la ventana stale se calcula en la petición"""
+        compute = mock.Mock(side_effect=[{'total': 1}, {'total': 2}])
+        cache = StatsSnapshotCache(store=DjangoCacheSnapshotStore(), ttl=0, stale_ttl=0)
+        
+        cache.get('stats', compute)
+        self.assertEqual(cache.get('stats', compute)[0], {'total': 2})
+        cache.invalidate('stats')
+    
+    @override_settings(MAX_CONNECTIONS=0)
+    def test_cleanup_invalidates_snapshot(self):
+        """Una limpieza descarta los snapshots cacheados"""
+        ActiveConnection.objects.create(
+            client_ip='10.0.0.9',
+            last_activity=timezone.now() - timedelta(seconds=60)
+        )
+        get_stats_cache().invalidate()
+        self.client.get(reverse('connection_status'))
+        self.assertIsNotNone(get_stats_cache().store.get('connection_stats'))
+        
+        with mock.patch('webhook_manager.scheduler.ExpiryScheduler.request_cleanup'):
+            ConnectionCleanupService().run_cleanup()
+        
+        self.assertIsNone(get_stats_cache().store.get('connection_stats'))
+    
+    def test_views_report_snapshot_age(self):
+        """Las respuestas indican la edad del snapshot"""
+        get_stats_cache().invalidate()
+        response = self.client.get(reverse('system_stats'))
+        
+        self.assertIn('snapshot_age', response.json())
+        self.assertEqual(response['Age'], '0')
+
+class ConnectionCountersTests(TestCase):
+    
+    def setUp(self):
+        self.backend = ORMTrackingBackend(timeout=30)
+        self.backend.counters = ConnectionCounters()
+        self.recount = ORMTrackingBackend(timeout=30)
+        self.start = timezone.now() - timedelta(seconds=120)
+    
+    def at(self, seconds):
+        return mock.patch(
+            'webhook_manager.backends.timezone.now',
+            return_value=self.start + timedelta(seconds=seconds)
+        )
+    
+    def test_counters_follow_activity_and_close(self):
+        """Altas, actividad y cierres mantienen los mismos conteos que el recuento"""
+        webhooks = []
+        for i in range(4):
+            with self.at(i):
+                webhooks.append(self.backend.record_request(f'10.0.0.{i}', 'sim', True, '/api/webhook/'))
+        with self.at(5):
+            self.backend.record_request('10.0.1.1', 'browser', False, '')
+        with self.at(110):
+            # La actividad mueve la conexión normal a un bucket reciente
+            self.backend.record_request('10.0.1.1', 'browser', False, '')
+            self.backend.record_request('10.0.0.9', 'sim', True, '/api/webhook/')
+        
+        self.assertEqual(self.backend.stats(), {'total': 6, 'inactive': 4, 'webhook': 5})
+        self.assertEqual(self.backend.stats(), self.recount.stats())
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.backend.close(webhooks[:2])
+        self.backend.counters.flush()
+        self.assertEqual(self.backend.stats(), {'total': 4, 'inactive': 2, 'webhook': 3})
+        self.assertEqual(self.backend.stats(), self.recount.stats())
+    
+    def test_snapshot_reads_buckets_not_rows(self):
+        """La lectura es una sola consulta sobre los buckets"""
+        with self.at(0):
+            for i in range(20):
+                self.backend.record_request(f'10.0.0.{i}', 'sim', True, '/api/webhook/')
+        self.backend.counters.flush()
+        
+        self.assertEqual(ConnectionCountBucket.objects.count(), 1)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.backend.stats()['inactive'], 20)
+    
+    def test_reconcile_repairs_drift(self):
+        """La reconciliación corrige filas escritas sin pasar por el backend"""
+        stale = timezone.now() - timedelta(seconds=60)
+        ActiveConnection.objects.bulk_create([
+            ActiveConnection(client_ip=f'10.0.0.{i}', is_webhook=True, last_activity=stale)
+            for i in range(3)
+        ])
+        self.assertEqual(self.backend.stats()['total'], 0)
+        
+        drift = self.backend.counters.reconcile()
+        
+        self.assertEqual(sum(drift.values()), 3)
+        self.assertEqual(self.backend.stats(), self.recount.stats())
+        self.assertEqual(self.backend.counters.reconcile(), {})
+    
+    def test_reconcile_command(self):
+        """El comando informa la deriva y con --dry-run no la corrige"""
+        ActiveConnection.objects.create(client_ip='10.0.0.1')
+        out = io.StringIO()
+        
+        with mock.patch('webhook_manager.management.commands.reconcile_connection_counters.get_connection_counters',
+                        return_value=self.backend.counters):
+            call_command('reconcile_connection_counters', '--dry-run', stdout=out)
+            self.assertFalse(ConnectionCountBucket.objects.exists())
+            call_command('reconcile_connection_counters', stdout=out)
+        
+        self.assertIn('Deriva en 1 buckets', out.getvalue())
+        self.assertEqual(ConnectionCountBucket.objects.get().count, 1)
+
+class ConnectionStreamTests(TestCase):
+    
+    def setUp(self):
+        get_stats_cache().invalidate()
+    
+    async def read_event(self, stream):
+        chunk = await asyncio.wait_for(stream.__anext__(), timeout=5)
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        fields = dict(line.split(': ', 1) for line in chunk.strip().splitlines() if not line.startswith(':'))
+        return fields.get('event'), json.loads(fields['data']) if 'data' in fields else None
+    
+    @override_settings(STATS_STREAM_INTERVAL=0.05)
+    async def test_stream_sends_snapshot_then_deltas(self):
+        """El stream envía el estado inicial y después solo los cambios"""
+        response = await AsyncClient().get(reverse('connection_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        
+        event, data = await self.read_event(stream)
+        self.assertEqual(event, 'snapshot')
+        # La propia petición del stream cuenta como conexión normal
+        self.assertEqual(data['total'], 1)
+        
+        await ActiveConnection.objects.acreate(client_ip='10.0.0.1', is_webhook=True)
+        await ConnectionCleanupLog.objects.acreate(
+            total_connections_before=2, inactive_connections_found=1,
+            connections_closed=1, cleanup_reason='prueba'
+        )
+        get_stats_cache().invalidate()
+        
+        changes = {}
+        while 'total' not in changes or 'cleanups' not in changes:
+            event, data = await self.read_event(stream)
+            self.assertEqual(event, 'delta')
+            changes.update(data)
+        await stream.aclose()
+        
+        self.assertEqual(changes['total'], 2)
+        self.assertEqual(changes['webhook'], 1)
+        self.assertNotIn('threshold_reached', changes)
+        self.assertEqual([cleanup['reason'] for cleanup in changes['cleanups']], ['prueba'])
+    
+    @override_settings(STATS_STREAM_HEARTBEAT=0.05)
+    async def test_idle_stream_sends_heartbeats(self):
+        """Sin cambios se envían heartbeats como comentarios SSE"""
+        response = await AsyncClient().get(reverse('connection_stream'))
+        stream = aiter(response.streaming_content)
+        
+        await self.read_event(stream)
+        chunk = await asyncio.wait_for(stream.__anext__(), timeout=5)
+        self.assertEqual(chunk, b': heartbeat\n\n')
+        await stream.aclose()
+    
+    async def test_subscribers_share_one_computation(self):
+        """Varios suscriptores reciben el mismo delta de un único cálculo"""
+        states = iter([
+            ({'total': 1, 'threshold_reached': False}, [], 0),
+            ({'total': 5, 'threshold_reached': False}, [], 0),
+        ])
+        broadcaster = StatsBroadcaster(interval=0.01)
+        
+        with mock.patch('webhook_manager.streaming.read_stream_state', side_effect=lambda *args: next(states)) as read:
+            queues = [await broadcaster.subscribe() for _ in range(10)]
+            messages = [[await asyncio.wait_for(queue.get(), 5) for _ in range(2)] for queue in queues]
+            for queue in queues:
+                broadcaster.unsubscribe(queue)
+            self.assertEqual(read.call_count, 2)
+        
+        for snapshot, delta in messages:
+            self.assertEqual(snapshot[1:], ('snapshot', {'total': 1, 'threshold_reached': False, 'cleanups': []}))
+            self.assertEqual(delta[1], 'delta')
+            self.assertEqual(delta[2]['total'], 5)
+    
+    def test_wsgi_request_gets_single_snapshot(self):
+        """Fuera de ASGI se responde un solo snapshot con retry"""
+        response = self.client.get(reverse('connection_stream'))
+        
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = response.content.decode()
+        self.assertIn('retry: ', body)
+        self.assertIn('event: snapshot', body)
+
+class PackedClosedListTests(TestCase):
+    
+    def closed_connections(self, count):
+        return [
+            {
+                'connection_id': str(uuid.uuid4()),
+                'client_ip': f'10.0.{i // 250}.{i % 250}' if i % 2 else f'2001:db8::{i + 1:x}',
+                'inactive_time': 30.0 + i / 7,
+                'is_webhook': i % 3 != 0
+            } for i in range(count)
+        ]
+    
+    def test_round_trip_keeps_payload(self):
+        """El formato empaquetado devuelve exactamente la misma lista"""
+        closed = self.closed_connections(500)
+        
+        for compress in (True, False):
+            self.assertEqual(unpack_closed_connections(pack_closed_connections(closed, compress=compress)), closed)
+        self.assertEqual(unpack_closed_connections(pack_closed_connections([])), [])
+    
+    def test_packed_list_is_smaller_than_json(self):
+        """Cada conexión ocupa menos de la tercera parte que en JSON"""
+        closed = self.closed_connections(1000)
+        
+        packed = pack_closed_connections(closed, compress=False)
+        self.assertLess(len(packed), len(json.dumps(closed)) / 3)
+    
+    def test_list_is_loaded_lazily(self):
+        """La lista se lee de la base de datos solo al pedirla"""
+        closed = self.closed_connections(3)
+        log = ConnectionCleanupLog.objects.create(
+            total_connections_before=3, inactive_connections_found=3,
+            connections_closed=3, cleanup_reason='prueba', connections_closed_list=closed
+        )
+        
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('system_stats'))
+        self.assertFalse([q for q in queries.captured_queries if 'closed_connections_data' in q['sql']])
+        
+        log = ConnectionCleanupLog.objects.defer('closed_connections_data').get(pk=log.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(log.connections_closed_list, closed)
+    
+    @override_settings(MAX_CONNECTIONS=0)
+    def test_cleanup_with_non_ip_client_address(self):
+        """Un client_ip que no es una IP se guarda tal cual y no hace fallar la limpieza"""
+        now = timezone.now()
+        for client_ip, age in (('not-an-ip', 120), ('10.0.0.1', 60)):
+            ActiveConnection.objects.create(
+                client_ip=client_ip, is_webhook=True, status='ACTIVE', last_activity=now - timedelta(seconds=age)
+            )
+        
+        # Se cierra el 50% de las inactivas, las más antiguas primero
+        result = ConnectionCleanupService().cleanup_connections()
+        
+        self.assertEqual(result['connections_closed'], 1)
+        closed = ConnectionCleanupLog.objects.get().connections_closed_list
+        self.assertEqual([connection['client_ip'] for connection in closed], ['not-an-ip'])
+        
+        mixed = self.closed_connections(4)
+        mixed[1]['client_ip'] = 'not-an-ip'
+        self.assertEqual(unpack_closed_connections(pack_closed_connections(mixed)), mixed)
+
+class RetentionTests(TestCase):
+    
+    def setUp(self):
+        now = timezone.now()
+        old = now - timedelta(days=2)
+        ActiveConnection.objects.bulk_create(
+            [ActiveConnection(client_ip='10.0.0.1', status='CLOSED', last_activity=old) for _ in range(7)]
+            + [ActiveConnection(client_ip='10.0.0.2', status='CLOSED', last_activity=now)]
+            + [ActiveConnection(client_ip='10.0.0.3', status='ACTIVE', last_activity=old)]
+        )
+        self.old_log = ConnectionCleanupLog.objects.create(
+            timestamp=now - timedelta(days=40), total_connections_before=1, inactive_connections_found=1,
+            connections_closed=1, cleanup_reason='vieja',
+            connections_closed_list=[{
+                'connection_id': str(uuid.uuid4()), 'client_ip': '10.0.0.1',
+                'inactive_time': 31.0, 'is_webhook': True
+            }]
+        )
+        ConnectionCleanupLog.objects.create(
+            total_connections_before=1, inactive_connections_found=1,
+            connections_closed=0, cleanup_reason='reciente'
+        )
+    
+    def test_archives_expired_rows_in_batches(self):
+        """Solo se mueven las filas CLOSED y los logs vencidos, por lotes"""
+        report = RetentionService(batch_size=3).run()
+        
+        self.assertEqual(report['conexiones_cerradas']['filas'], 7)
+        self.assertEqual(report['conexiones_cerradas']['lotes'], 3)
+        self.assertEqual(report['logs_de_limpieza']['filas'], 1)
+        self.assertEqual(ArchivedConnection.objects.count(), 7)
+        self.assertEqual(
+            set(ActiveConnection.objects.values_list('client_ip', flat=True)),
+            {'10.0.0.2', '10.0.0.3'}
+        )
+        
+        archived_log = ArchivedCleanupLog.objects.get()
+        self.assertEqual(archived_log.original_id, self.old_log.id)
+        self.assertEqual(bytes(archived_log.closed_connections_data), bytes(self.old_log.closed_connections_data))
+        self.assertEqual(list(ConnectionCleanupLog.objects.values_list('cleanup_reason', flat=True)), ['reciente'])
+    
+    def test_finished_webhook_jobs_are_deleted(self):
+        """Los trabajos DONE/FAILED vencidos se borran sin archivar; los pendientes se quedan"""
+        old = timezone.now() - timedelta(days=8)
+        WebhookJob.objects.bulk_create([
+            WebhookJob(status='DONE', payload={'n': 1}, updated_at=old),
+            WebhookJob(status='FAILED', payload={'n': 2}, updated_at=old),
+            WebhookJob(status='DONE', payload={'n': 3}),
+            WebhookJob(status='PENDING', payload={'n': 4}, updated_at=old),
+        ])
+
+        report = RetentionService().run()
+
+        self.assertEqual(report['trabajos_webhook']['filas'], 2)
+        self.assertFalse(report['trabajos_webhook']['archivadas'])
+        self.assertEqual(
+            sorted(WebhookJob.objects.values_list('payload__n', flat=True)), [3, 4]
+        )
+
+    def test_max_batches_bounds_a_run(self):
+        """max_batches limita el trabajo de una ejecución"""
+        report = RetentionService(batch_size=2).run(max_batches=1)
+        
+        self.assertEqual(report['conexiones_cerradas']['filas'], 2)
+        self.assertEqual(ActiveConnection.objects.filter(status='CLOSED').count(), 6)
+    
+    def test_command_delete_only_and_dry_run(self):
+        """El comando informa pendientes y puede borrar sin archivar"""
+        out = io.StringIO()
+        
+        call_command('apply_retention', '--dry-run', stdout=out)
+        self.assertIn('conexiones_cerradas: 7 filas vencidas', out.getvalue())
+        
+        call_command('apply_retention', '--delete-only', '--batch-size', '4', stdout=out)
+        self.assertIn('7 filas borradas en 2 lotes', out.getvalue())
+        self.assertFalse(ArchivedConnection.objects.exists())
+        self.assertEqual(ActiveConnection.objects.count(), 2)
+    
+    def test_scheduler_hook_takes_lease(self):
+        """El planificador aplica la retención solo si obtiene el lease"""
+        scheduler = ExpiryScheduler(backend=InMemoryTrackingBackend())
+        CleanupLease.objects.create(
+            name='retention', owner='otro-proceso',
+            expires_at=timezone.now() + timedelta(minutes=5)
+        )
+        self.assertIsNone(scheduler.run_retention())
+        
+        CleanupLease.objects.filter(name='retention').update(expires_at=timezone.now() - timedelta(seconds=1))
+        report = scheduler.run_retention()
+        self.assertEqual(report['conexiones_cerradas']['filas'], 7)
+
+class DatabaseProfileTests(TestCase):
+    
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -4321, 'busy_timeout': 2500})
+    def test_sqlite_pragmas_applied_on_connection(self):
+        """Los PRAGMA configurados se ejecutan al crear la conexión"""
+        apply_sqlite_pragmas(sender=None, connection=connection)
+        
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -4321)
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 2500)
+
+class LoggingPipelineTests(TestCase):
+    
+    def setUp(self):
+        self.target = logging.handlers.BufferingHandler(capacity=1000)
+        self.target.set_name('test-target')
+        self.addCleanup(self.target.close)
+    
+    def record(self, msg, level=logging.INFO):
+        return logging.LogRecord('webhook_manager', level, __file__, 0, msg, None, None)
+    
+    def test_full_queue_drops_and_reports(self):
+        """Con la cola llena se descartan registros y se avisa al liberar sitio"""
+        handler = BoundedQueueHandler(handlers=['test-target'], maxsize=2)
+        handler.set_targets([self.target])
+        
+        for i in range(5):
+            handler.enqueue(handler.prepare(self.record(f'mensaje {i}')))
+        self.assertEqual(handler.dropped, 3)
+        
+        handler.queue.get_nowait()
+        handler.queue.get_nowait()
+        handler.enqueue(handler.prepare(self.record('mensaje 5')))
+        
+        notice = handler.queue.queue[-1]
+        self.assertEqual(notice.levelno, logging.WARNING)
+        self.assertIn('3 mensajes descartados', notice.getMessage())
+    
+    def test_listener_writes_to_target_handlers(self):
+        """El listener entrega los registros a los handlers reales"""
+        handler = BoundedQueueHandler(handlers=['test-target'])
+        handler.set_targets([self.target])
+        handler.handle(self.record('Conexión %s cerrada' % 'abc'))
+        handler.stop()
+        
+        self.assertEqual([record.getMessage() for record in self.target.buffer], ['Conexión abc cerrada'])
+    
+    def test_settings_queue_resolves_targets_by_name(self):
+        """LOGGING_CONFIG entrega a la cola los handlers 'file' y 'console' de settings"""
+        queue_handler = next(
+            handler for handler in logging.getLogger('webhook_manager').handlers
+            if isinstance(handler, BoundedQueueHandler)
+        )
+        self.assertEqual([target.name for target in queue_handler.targets], ['file', 'console'])
+    
+    def test_concurrent_drops_are_counted(self):
+        """Los descartes de muchos hilos a la vez se cuentan todos"""
+        handler = BoundedQueueHandler(handlers=['test-target'], maxsize=1)
+        handler.enqueue(self.record('ocupa la cola'))
+        before = dropped_records()
+        
+        def drop():
+            for i in range(500):
+                handler.enqueue(self.record(f'mensaje {i}'))
+        
+        threads = [threading.Thread(target=drop) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(handler.dropped, 4000)
+        self.assertEqual(dropped_records() - before, 4000)
+    
+    def test_sampling_filter_limits_per_request_lines(self):
+        """Las líneas por request se limitan por segundo y se muestrea el exceso"""
+        sampler = SamplingFilter(prefixes=['Actividad registrada'], max_per_second=2, sample_every=5)
+        
+        with mock.patch('webhook_manager.logutils.time.monotonic', return_value=100.0):
+            kept = [sampler.filter(self.record(f'Actividad registrada: {i}')) for i in range(12)]
+            self.assertTrue(sampler.filter(self.record('Limpieza completada')))
+            self.assertTrue(sampler.filter(self.record('Actividad registrada: error', logging.WARNING)))
+        
+        self.assertEqual(sum(kept), 4)
+        self.assertEqual(sampler.suppressed, 8)
+        with mock.patch('webhook_manager.logutils.time.monotonic', return_value=101.0):
+            self.assertTrue(sampler.filter(self.record('Actividad registrada: nuevo segundo')))
+
+class MetricsTests(TestCase):
+    
+    def test_histogram_merges_thread_shards(self):
+        """Las observaciones de varios hilos se suman al exponer las métricas"""
+        histogram = Histogram('test_seconds', 'Prueba', ('endpoint',), buckets=(0.1, 1.0))
+        
+        def observe():
+            for _ in range(100):
+                histogram.observe(0.05, ('webhook',))
+            histogram.observe(5.0, ('webhook',))
+        
+        threads = [threading.Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        histogram.observe(0.5, ('webhook',))
+        
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{endpoint="webhook",le="0.1"} 400', lines)
+        self.assertIn('test_seconds_bucket{endpoint="webhook",le="1.0"} 401', lines)
+        self.assertIn('test_seconds_bucket{endpoint="webhook",le="+Inf"} 405', lines)
+        self.assertIn('test_seconds_count{endpoint="webhook"} 405', lines)
+        # Las particiones de los hilos terminados se pliegan y no se pierden
+        self.assertEqual(len(histogram._shards), 1)
+        self.assertIn('test_seconds_count{endpoint="webhook"} 405', histogram.render())
+    
+    def test_metrics_endpoint_exposes_request_metrics(self):
+        """/api/metrics/ expone latencia, consultas por request y webhooks en curso"""
+        self.client.post(reverse('webhook_endpoint'), data=json.dumps({'test': 1}), content_type='application/json')
+        
+        response = self.client.get(reverse('metrics'))
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('webhook_manager_request_duration_seconds_count{endpoint="webhook_endpoint",method="POST",status="200"}', body)
+        self.assertRegex(body, r'webhook_manager_request_db_queries_sum\{endpoint="webhook_endpoint"\} [1-9]')
+        self.assertIn('webhook_manager_webhooks_in_flight 0', body)
+        self.assertIn('# TYPE webhook_manager_cleanup_duration_seconds histogram', body)
+
+class IPReputationCacheTests(TestCase):
+    
+    def test_increments_are_flushed_in_batch_without_reads(self):
+        """Los incrementos no leen ni escriben SuspiciousIP hasta el volcado"""
+        SuspiciousIP.objects.create(ip_address='10.0.0.1', connection_count=5)
+        cache = IPReputationCache()
+
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                cache.increment('10.0.0.1')
+            cache.increment('2001:db8::1', 2)
+        self.assertEqual(SuspiciousIP.objects.get(ip_address='10.0.0.1').connection_count, 5)
+
+        self.assertEqual(cache.flush(), 2)
+        self.assertEqual(SuspiciousIP.objects.get(ip_address='10.0.0.1').connection_count, 8)
+        self.assertEqual(SuspiciousIP.objects.get(ip_address='2001:db8::1').connection_count, 2)
+
+        stats = cache.stats()
+        self.assertEqual((stats['increments'], stats['pending_ips'], stats['flushes']), (5, 0, 1))
+
+    @override_settings(IP_REPUTATION_CACHE_ENABLED=True, IP_BLOCKING_ENABLED=False)
+    def test_webhook_write_path_does_not_read_suspicious_ip(self):
+        """Con la caché, registrar un webhook no consulta SuspiciousIP"""
+        with mock.patch('webhook_manager.reputation._ip_reputation_cache', None):
+            backend = ORMTrackingBackend()
+            with CaptureQueriesContext(connection) as queries:
+                backend.register_connection('10.0.0.9', 'agent', True, '/api/webhook/')
+
+            self.assertFalse([query for query in queries if 'suspicious' in query['sql'].lower()])
+            self.assertEqual(backend.reputation.stats()['pending_ips'], 1)
+
+    @override_settings(IP_REPUTATION_CACHE_ENABLED=True)
+    def test_system_stats_reports_reputation_cache(self):
+        """system_stats expone el estado de la caché de reputación"""
+        get_stats_cache().invalidate()
+        self.addCleanup(get_stats_cache().invalidate)
+        response = self.client.get(reverse('system_stats'))
+        
+        self.assertTrue(response.json()['ip_reputation_cache']['enabled'])
+        self.assertIn('pending_ips', response.json()['ip_reputation_cache'])
+
+class IPBlockingTests(TestCase):
+    
+    def test_ranges_match_ipv4_and_ipv6(self):
+        """Los rangos CIDR se resuelven con el trie de prefijos en ambas familias"""
+        blocklist = IPBlocklist(ranges=['10.1.0.0/16', '2001:db8::/32'])
+        blocklist.rebuild()
+        
+        self.assertEqual(blocklist.match('10.1.200.3'), 'range')
+        self.assertEqual(blocklist.match('::ffff:10.1.0.9'), 'range')
+        self.assertEqual(blocklist.match('2001:db8:5::1'), 'range')
+        self.assertIsNone(blocklist.match('10.2.0.1'))
+        self.assertIsNone(blocklist.match('2001:db9::1'))
+        self.assertIsNone(blocklist.match('no-es-una-ip'))
+    
+    def test_blocked_ip_rejected_before_any_db_write(self):
+        """Una IP marcada en SuspiciousIP recibe 403 sin consultas ni ActiveConnection"""
+        blocklist = get_ip_blocklist()
+        blocklist.rebuild()
+        SuspiciousIP.objects.create(ip_address='10.9.9.9', is_blocked=True)
+        self.addCleanup(blocklist.set_blocked, '10.9.9.9', False)
+        
+        with self.assertNumQueries(0):
+            response = self.client.post(
+                reverse('webhook_endpoint'), data=json.dumps({'test': 1}),
+                content_type='application/json', REMOTE_ADDR='10.9.9.9'
+            )
+        
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ActiveConnection.objects.exists())
+    
+    def test_forwarded_for_ignored_from_untrusted_peer(self):
+        """Sin proxy de confianza, un X-Forwarded-For inventado no salta el bloqueo"""
+        blocklist = get_ip_blocklist()
+        blocklist.rebuild()
+        blocklist.set_blocked('10.9.9.8', True)
+        self.addCleanup(blocklist.set_blocked, '10.9.9.8', False)
+        
+        response = self.client.post(
+            reverse('webhook_endpoint'), data=json.dumps({'test': 1}), content_type='application/json',
+            REMOTE_ADDR='10.9.9.8', HTTP_X_FORWARDED_FOR='198.51.100.7'
+        )
+        
+        self.assertEqual(response.status_code, 403)
+    
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_client_ip_is_rightmost_untrusted_hop(self):
+        """Tras proxies de confianza se toma el salto más a la derecha que no es de confianza"""
+        middleware = ConnectionTrackingMiddleware(lambda request: None)
+        resolve = middleware.resolve_client_ip
+        
+        # El cliente antepone la IP de otro: el proxy añade la real a la derecha
+        self.assertEqual(resolve({'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '10.9.9.9, 203.0.113.5'}), '203.0.113.5')
+        self.assertEqual(resolve({'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': ' 203.0.113.5 , 10.0.0.2 '}), '203.0.113.5')
+        # Un salto que no es una IP corta el recorrido en el último proxy válido
+        self.assertEqual(resolve({'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '203.0.113.5, basura'}), '10.0.0.1')
+        # Desde fuera de TRUSTED_PROXIES la cabecera no cuenta
+        self.assertEqual(resolve({'REMOTE_ADDR': '198.51.100.7', 'HTTP_X_FORWARDED_FOR': '10.9.9.9'}), '198.51.100.7')
+    
+    def test_sliding_window_autoblock(self):
+        """Superar el umbral en la ventana bloquea la IP y la marca en SuspiciousIP"""
+        blocklist = IPBlocklist(autoblock=True, threshold=3, window=60, persist_in_background=False)
+        blocklist.rebuild()
+        
+        self.assertEqual([blocklist.observe('10.0.0.5') for _ in range(3)], [False, False, True])
+        self.assertEqual(blocklist.match('10.0.0.5'), 'ip')
+        self.assertTrue(SuspiciousIP.objects.get(ip_address='10.0.0.5').is_blocked)
+    
+    def test_sliding_window_weights_previous_window(self):
+        """La ventana anterior cuenta en proporción a lo que aún solapa"""
+        counter = SlidingWindowCounter(window=10)
+        
+        self.assertEqual(counter.add('ip', 4, now=5), 4)
+        self.assertEqual(counter.add('ip', 1, now=15), 3)
+        self.assertEqual(counter.add('ip', 1, now=40), 1)
+
+
+class RateLimitTests(TestCase):
+    
+    def test_bucket_allows_burst_then_refills(self):
+        """El bucket admite la ráfaga, pide esperar y se rellena a `rate` tokens por segundo"""
+        table = TokenBucketTable(shards=4, max_entries=100)
+        rule = RateLimitRule('/api/webhook/', rate=2.0, burst=3)
+        key = (rule.path, '10.0.0.1')
+        
+        self.assertEqual([table.take(key, rule, now=100.0) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(table.take(key, rule, now=100.0), 0.5)
+        self.assertEqual(table.take(key, rule, now=100.5), 0.0)
+        self.assertGreater(table.take(key, rule, now=100.5), 0)
+    
+    def test_table_is_bounded_and_drops_idle_buckets(self):
+        """Los buckets llenos se descartan al insertar y la tabla no pasa del máximo"""
+        table = TokenBucketTable(shards=1, max_entries=2)
+        rule = RateLimitRule('/api/webhook/', rate=1.0, burst=5)
+        
+        for i in range(3):
+            table.take((rule.path, f'10.0.0.{i}'), rule, now=0.0)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.evictions, 1)
+        
+        # A los 10s los buckets anteriores ya están llenos: salen sin contar como desalojo
+        table.take((rule.path, '10.0.1.1'), rule, now=10.0)
+        self.assertEqual(len(table), 1)
+        self.assertEqual(table.evictions, 1)
+    
+    def test_django_cache_buckets_are_shared(self):
+        """Dos almacenes sobre la misma caché comparten el bucket de la IP"""
+        rule = RateLimitRule('/api/webhook/', rate=0.01, burst=2)
+        key = (rule.path, '10.5.5.5')
+        first, second = DjangoCacheTokenBuckets(), DjangoCacheTokenBuckets()
+        self.addCleanup(first.cache.clear)
+        
+        self.assertEqual(first.take(key, rule), 0.0)
+        self.assertEqual(second.take(key, rule), 0.0)
+        self.assertGreater(first.take(key, rule), 0)
+    
+    @override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS={'/api/webhook/': {'rate': 0.01, 'burst': 2}})
+    def test_middleware_returns_429_with_retry_after(self):
+        """Al agotar el bucket, el webhook recibe 429 con Retry-After y no se registra"""
+        with mock.patch('webhook_manager.ratelimit._rate_limiter', None):
+            self.client = self.client_class()
+            post = lambda ip: self.client.post(
+                reverse('webhook_endpoint'), data=json.dumps({'test': 1}),
+                content_type='application/json', REMOTE_ADDR=ip
+            )
+            
+            self.assertEqual([post('10.7.7.7').status_code for _ in range(2)], [200, 200])
+            with self.assertNumQueries(0):
+                response = post('10.7.7.7')
+            
+            self.assertEqual(response.status_code, 429)
+            self.assertGreaterEqual(int(response['Retry-After']), 1)
+            self.assertEqual(ActiveConnection.objects.filter(client_ip='10.7.7.7').count(), 2)
+            self.assertEqual(post('10.7.7.8').status_code, 200)
+            
+            self.assertTrue(get_system_stats()['rate_limit']['enabled'])
+
+
+    @override_settings(
+        RATE_LIMIT_ENABLED=True, RATE_LIMITS={'/api/webhook/': {'rate': 0.01, 'burst': 2}}, WEBHOOK_PROCESSING_SECONDS=0
+    )
+    def test_rotating_forwarded_for_shares_one_bucket(self):
+        """Cambiar X-Forwarded-For sin pasar por un proxy de confianza no da buckets nuevos"""
+        with mock.patch('webhook_manager.ratelimit._rate_limiter', None):
+            self.client = self.client_class()
+            statuses = [
+                self.client.post(
+                    reverse('webhook_endpoint'), data=json.dumps({'test': 1}), content_type='application/json',
+                    REMOTE_ADDR='10.7.7.9', HTTP_X_FORWARDED_FOR=f'198.51.100.{i}'
+                ).status_code
+                for i in range(4)
+            ]
+
+            self.assertEqual(statuses, [200, 200, 429, 429])
+            self.assertEqual(get_system_stats()['rate_limit']['tracked_buckets'], 1)
+
+
+class AdmissionControlTests(TestCase):
+    
+    def test_freed_slot_goes_to_ip_with_fewest_in_flight(self):
+        """El hueco liberado pasa a la IP en cola con menos requests admitidas, no a la primera"""
+        admission = AdmissionClass('long_webhook', max_in_flight=2, max_per_ip=3, max_queue=5)
+        self.assertIs(admission.try_acquire('10.0.0.1'), True)
+        self.assertIs(admission.try_acquire('10.0.0.1'), True)
+        hog = admission.try_acquire('10.0.0.1')
+        other = admission.try_acquire('10.0.0.2')
+        
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admission.try_acquire('10.0.0.1')
+        self.assertEqual(rejected.exception.reason, 'ip_share')
+        
+        admission.release('10.0.0.1')
+        self.assertTrue(other.granted)
+        self.assertFalse(hog.granted)
+        self.assertEqual(admission.stats()['in_flight'], 2)
+        self.assertEqual(admission.stats()['queued'], 1)
+    
+    def test_full_queue_and_timeout_shed(self):
+        """Con la cola llena se descarta al momento; en cola, al vencer la espera"""
+        admission = AdmissionClass('webhook', max_in_flight=1, max_queue=1)
+        admission.acquire('10.0.0.1', timeout=1)
+        
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admission.acquire('10.0.0.2', timeout=0.05)
+        self.assertEqual(rejected.exception.reason, 'timeout')
+        self.assertEqual(admission.stats()['queued'], 0)
+        
+        admission.try_acquire('10.0.0.3')
+        with self.assertRaises(AdmissionRejected) as rejected:
+            admission.try_acquire('10.0.0.4')
+        self.assertEqual(rejected.exception.reason, 'queue_full')
+    
+    def test_cancelled_waiter_leaves_queue(self):
+        """Una request async cancelada en cola (cliente desconectado) no conserva hueco"""
+        admission = AdmissionClass('long_webhook', max_in_flight=1, max_queue=5)
+        
+        async def scenario():
+            await admission.aacquire('10.0.0.1', timeout=1)
+            waiting = asyncio.ensure_future(admission.aacquire('10.0.0.2', timeout=5))
+            await asyncio.sleep(0.01)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            admission.release('10.0.0.1')
+        
+        asyncio.run(scenario())
+        self.assertEqual(admission.stats()['in_flight'], 0)
+        self.assertEqual(admission.stats()['queued'], 0)
+    
+    @override_settings(
+        ADMISSION_CONTROL_ENABLED=True, LONG_WEBHOOK_SECONDS=0.2, ADMISSION_QUEUE_TIMEOUT=0.05, TRUSTED_PROXIES=['127.0.0.1'],
+        ADMISSION_CLASSES={'long_webhook': {'paths': ['/api/webhook/long/'], 'max_in_flight': 2, 'max_queue': 1}}
+    )
+    async def test_middleware_sheds_with_503(self):
+        """Por encima del tope y de la cola, el middleware responde 503 con Retry-After"""
+        with mock.patch('webhook_manager.admission._admission_controller', None):
+            client = AsyncClient()
+            responses = await asyncio.gather(*[
+                client.post(reverse('long_webhook'), data={}, content_type='application/json',
+                            headers={'X-Forwarded-For': f'10.3.0.{i}'})
+                for i in range(5)
+            ])
+            
+            statuses = sorted(response.status_code for response in responses)
+            self.assertEqual(statuses, [200, 200, 503, 503, 503])
+            shed = next(response for response in responses if response.status_code == 503)
+            self.assertEqual(shed['Retry-After'], '5')
+            
+            stats = (await sync_to_async(get_system_stats)())['admission']['classes']['long_webhook']
+            self.assertEqual(stats['in_flight'], 0)
+            self.assertEqual(stats['shed_total'], {'queue_full': 2, 'timeout': 1})
+
+    @override_settings(
+        ADMISSION_CONTROL_ENABLED=True, LONG_WEBHOOK_SECONDS=0.2, ADMISSION_QUEUE_TIMEOUT=0.05,
+        ADMISSION_CLASSES={'long_webhook': {'paths': ['/api/webhook/long/'], 'max_in_flight': 3, 'max_per_ip': 1}}
+    )
+    async def test_spoofed_forwarded_for_shares_one_ip_quota(self):
+        """Sin proxy de confianza, variar X-Forwarded-For no multiplica la cuota por IP"""
+        with mock.patch('webhook_manager.admission._admission_controller', None):
+            client = AsyncClient()
+            responses = await asyncio.gather(*[
+                client.post(reverse('long_webhook'), data={}, content_type='application/json',
+                            headers={'X-Forwarded-For': f'198.51.100.{i}'})
+                for i in range(3)
+            ])
+
+            statuses = sorted(response.status_code for response in responses)
+            self.assertEqual(statuses, [200, 503, 503])
+            stats = (await sync_to_async(get_system_stats)())['admission']['classes']['long_webhook']
+            self.assertEqual(stats['shed_total'], {'ip_share': 2})
+
+class LoadGeneratorTests(SimpleTestCase):
+
+    # En un proceso aparte: start_local_server configura Django y su propia base temporal
+    SCRIPT = """
+import asyncio, json, sys
+sys.path.insert(0, 'scripts')
+from django.conf import settings
+import simulate_webhooks
+settings.WEBHOOK_PROCESSING_SECONDS = 0
+server, url = simulate_webhooks.start_local_server(long_seconds=0.1)
+simulator = simulate_webhooks.WebhookSimulator(url, max_connections=4, timeout=30, long_timeout=30, client_ips=3)
+summary = asyncio.run(simulator.run_load(8, rate=100, long_ratio=0.25, seed=1)).summary()
+from webhook_manager.models import ActiveConnection
+summary['ips'] = sorted(set(ActiveConnection.objects.values_list('client_ip', flat=True)))
+server.shutdown()
+print(json.dumps(summary))
+"""
+
+    def test_run_load_against_local_server(self):
+        """run_load completa una carga corta contra start_local_server y resume los resultados"""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='connection_manager.test_settings')
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT], cwd=settings.BASE_DIR, env=env,
+            capture_output=True, text=True, timeout=120
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        summary = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertEqual(summary['total']['peticiones'], 8)
+        # La semilla fija la mezcla: 7 webhooks normales y 1 long webhook
+        self.assertEqual((summary['normal']['peticiones'], summary['long']['peticiones']), (7, 1))
+        for kind in ('normal', 'long'):
+            self.assertEqual(set(summary[kind]['por_status']), {'200'})
+            self.assertLessEqual(summary[kind]['latencia_p50_ms'], summary[kind]['latencia_p99_ms'])
+        # --client-ips reparte la carga: el servidor local confía en el X-Forwarded-For del generador
+        self.assertEqual(summary['ips'], ['10.0.0.0', '10.0.0.1', '10.0.0.2'])
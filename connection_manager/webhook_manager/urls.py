@@ -5,10 +5,14 @@ urlpatterns = [
     # Endpoints principales del experimento
     path('webhook/', views.webhook_endpoint, name='webhook_endpoint'),
     path('webhook/long/', views.long_webhook, name='long_webhook'),
+    # Fuera de /webhook/ para que el middleware no lo registre como conexión webhook
+    path('jobs/<uuid:job_id>/', views.webhook_job_status, name='webhook_job_status'),
     
     # Endpoints de monitoreo
     path('connections/status/', views.connection_status, name='connection_status'),
+    path('connections/stream/', views.connection_stream, name='connection_stream'),
     path('connections/cleanup/', views.manual_cleanup, name='manual_cleanup'),
     path('system/stats/', views.system_stats, name='system_stats'),
     path('health/', views.health_check, name='health_check'),
+    path('metrics/', views.metrics_endpoint, name='metrics'),
 ]
\ No newline at end of file
@@ -1,25 +1,51 @@
 from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.urls import reverse
 from django.utils import timezone
 from django.conf import settings
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import ActiveConnection, ConnectionCleanupLog, SuspiciousIP
-from .services import ConnectionCleanupService
+from . import metrics
+from .jobs import QueueFull, enqueue_webhook
+from .models import WebhookJob
+from .scheduler import get_expiry_scheduler
+from .services import ConnectionCleanupService, get_connection_stats, get_system_stats
+from .stats_cache import get_stats_cache
+from .streaming import format_event, get_stats_broadcaster, read_stream_state, stream_events
+from functools import wraps
+import asyncio
 import json
 import logging
-import threading
-import time
 
 logger = logging.getLogger('webhook_manager')
 
-@csrf_exempt
-@require_http_methods(["GET", "POST"])
-def webhook_endpoint(request):
+def async_csrf_exempt(view_func):
+    """csrf_exempt para vistas async (el decorador de Django 4.2 solo envuelve vistas síncronas)"""
+    view_func.csrf_exempt = True
+    return view_func
+
+def async_require_http_methods(methods):
+    """require_http_methods para vistas async"""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def inner(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view_func(request, *args, **kwargs)
+        return inner
+    return decorator
+
+@async_csrf_exempt
+@async_require_http_methods(["GET", "POST"])
+async def webhook_endpoint(request):
     """Endpoint principal para recibir webhooks"""
     
+    # Modo cola: validar, guardar y responder 202 sin esperar el procesamiento
+    if request.method == 'POST' and settings.WEBHOOK_QUEUE_ENABLED:
+        return await enqueue_webhook_request(request)
+    
     # Simular procesamiento de webhook
     if request.method == 'POST':
         try:
@@ -27,8 +53,8 @@ def webhook_endpoint(request):
             
             logger.info(f"Webhook recibido de {request.META.get('REMOTE_ADDR')}: {data}")
             
-            # Simular tiempo de procesamiento para mantener la conexión activa
-            time.sleep(2)
+            # Simular tiempo de procesamiento sin bloquear el worker
+            await asyncio.sleep(settings.WEBHOOK_PROCESSING_SECONDS)
             
             response_data = {
                 'status': 'success',
@@ -54,37 +80,107 @@ def webhook_endpoint(request):
             'timestamp': timezone.now().isoformat()
         })
 
+async def enqueue_webhook_request(request):
+    """Encolar el webhook y devolver 202 con el job_id (429 si la cola está llena)"""
+    
+    try:
+        data = json.loads(request.body) if request.body else {}
+    except ValueError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Payload JSON inválido: {e}'
+        }, status=400)
+    
+    try:
+        job = await sync_to_async(enqueue_webhook)(
+            data,
+            client_ip=request.META.get('REMOTE_ADDR'),
+            connection_id=getattr(request, 'connection_id', None),
+            endpoint=request.path
+        )
+    except QueueFull as e:
+        logger.warning(f"Webhook rechazado: {e}")
+        response = JsonResponse({
+            'status': 'rejected',
+            'message': 'Cola de webhooks llena, reintente más tarde'
+        }, status=429)
+        response['Retry-After'] = str(settings.WEBHOOK_QUEUE_RETRY_AFTER)
+        return response
+    
+    return JsonResponse({
+        'status': 'accepted',
+        'message': 'Webhook encolado para procesamiento',
+        'job_id': str(job.job_id),
+        'status_url': reverse('webhook_job_status', args=[job.job_id]),
+        'timestamp': timezone.now().isoformat()
+    }, status=202)
+
+@api_view(['GET'])
+def webhook_job_status(request, job_id):
+    """Estado de un webhook encolado"""
+    
+    try:
+        job = WebhookJob.objects.get(job_id=job_id)
+    except WebhookJob.DoesNotExist:
+        return Response({'status': 'error', 'message': 'Trabajo no encontrado'}, status=404)
+    
+    return Response({
+        'job_id': str(job.job_id),
+        'status': job.status,
+        'attempts': job.attempts,
+        'max_attempts': job.max_attempts,
+        'next_attempt_at': job.next_attempt_at.isoformat() if job.status == 'PENDING' else None,
+        'last_error': job.last_error,
+        'result': job.result,
+        'created_at': job.created_at.isoformat(),
+        'updated_at': job.updated_at.isoformat()
+    })
+
 @api_view(['GET'])
 def connection_status(request):
     """Endpoint para verificar el estado de las conexiones"""
     
-    total_connections = ActiveConnection.objects.filter(status='ACTIVE').count()
-    inactive_connections = [
-        conn for conn in ActiveConnection.objects.filter(status='ACTIVE') 
-        if conn.is_inactive
-    ]
-    
-    webhook_connections = ActiveConnection.objects.filter(
-        status='ACTIVE', 
-        is_webhook=True
-    ).count()
+    connection_stats, age = get_stats_cache().get('connection_stats', get_connection_stats)
     
     response_data = {
-        'total_active_connections': total_connections,
-        'inactive_connections': len(inactive_connections),
-        'webhook_connections': webhook_connections,
-        'threshold_reached': len(inactive_connections) > settings.MAX_CONNECTIONS,
-        'cleanup_needed': len(inactive_connections) > settings.MAX_CONNECTIONS,
+        'total_active_connections': connection_stats['total'],
+        'inactive_connections': connection_stats['inactive'],
+        'webhook_connections': connection_stats['webhook'],
+        'threshold_reached': connection_stats['threshold_reached'],
+        'cleanup_needed': connection_stats['threshold_reached'],
+        'snapshot_age': round(age, 3),
         'timestamp': timezone.now().isoformat()
     }
     
     # Si se alcanza el umbral, disparar limpieza automática
-    if len(inactive_connections) > settings.MAX_CONNECTIONS:
-        logger.warning(f"Umbral alcanzado: {len(inactive_connections)} conexiones inactivas")
-        cleanup_service = ConnectionCleanupService()
-        threading.Thread(target=cleanup_service.cleanup_connections).start()
-    
-    return Response(response_data)
+    if connection_stats['threshold_reached']:
+        logger.warning(f"Umbral alcanzado: {connection_stats['inactive']} conexiones inactivas")
+        # El planificador agrupa las peticiones y ejecuta una sola limpieza a la vez
+        get_expiry_scheduler().request_cleanup()
+    
+    response = Response(response_data)
+    response['Age'] = str(int(age))
+    return response
+
+@async_require_http_methods(["GET"])
+async def connection_stream(request):
+    """Stream SSE con los cambios del estado de las conexiones"""
+    
+    if not isinstance(request, ASGIRequest):
+        # En WSGI un stream abierto ocupa un worker: enviar el snapshot y dejar
+        # que EventSource reconecte tras `retry`
+        state, _, _ = await sync_to_async(read_stream_state)()
+        interval = getattr(settings, 'STATS_STREAM_INTERVAL', 1.0)
+        body = format_event('snapshot', dict(state, cleanups=[]), retry=interval * 1000)
+        return HttpResponse(body, content_type='text/event-stream')
+    
+    response = StreamingHttpResponse(
+        stream_events(get_stats_broadcaster()),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @api_view(['POST'])
 def manual_cleanup(request):
@@ -104,68 +200,40 @@ def manual_cleanup(request):
 def system_stats(request):
     """Endpoint para estadísticas del sistema"""
     
-    total_connections = ActiveConnection.objects.filter(status='ACTIVE').count()
-    inactive_connections = [
-        conn for conn in ActiveConnection.objects.filter(status='ACTIVE') 
-        if conn.is_inactive
-    ]
-    
-    recent_cleanups = ConnectionCleanupLog.objects.all()[:5]
-    suspicious_ips = SuspiciousIP.objects.filter(connection_count__gte=5)
-    
-    stats = {
-        'connections': {
-            'total_active': total_connections,
-            'inactive_count': len(inactive_connections),
-            'webhook_connections': ActiveConnection.objects.filter(is_webhook=True, status='ACTIVE').count(),
-            'max_allowed': settings.MAX_CONNECTIONS,
-            'cleanup_threshold_reached': len(inactive_connections) > settings.MAX_CONNECTIONS
-        },
-        'cleanup_history': [
-            {
-                'timestamp': cleanup.timestamp.isoformat(),
-                'connections_closed': cleanup.connections_closed,
-                'reason': cleanup.cleanup_reason
-            } for cleanup in recent_cleanups
-        ],
-        'suspicious_ips': [
-            {
-                'ip': ip.ip_address,
-                'connection_count': ip.connection_count,
-                'backup_count': ip.backup_connection_count,  # RAID 1 backup
-                'is_blocked': ip.is_blocked
-            } for ip in suspicious_ips
-        ],
-        'raid1_status': {
-            'enabled': True,
-            'backup_synchronized': all(
-                ip.connection_count == ip.backup_connection_count 
-                for ip in suspicious_ips
-            )
-        }
-    }
+    stats, age = get_stats_cache().get('system_stats', get_system_stats)
     
-    return Response(stats)
+    response = Response(dict(stats, snapshot_age=round(age, 3)))
+    response['Age'] = str(int(age))
+    return response
 
-@csrf_exempt
-def long_webhook(request):
+@async_csrf_exempt
+async def long_webhook(request):
     """Webhook que simula una conexión que permanece abierta por mucho tiempo"""
     
     if request.method == 'POST':
         logger.info(f"Long webhook iniciado desde {request.META.get('REMOTE_ADDR')}")
         
         # Simular procesamiento largo (más de 30 segundos para que sea marcado como inactivo)
-        time.sleep(45)
+        # asyncio.sleep libera el event loop: miles de webhooks abiertos en un proceso
+        await asyncio.sleep(settings.LONG_WEBHOOK_SECONDS)
         
         return JsonResponse({
             'status': 'completed',
             'message': 'Procesamiento largo completado',
-            'duration': '45 segundos',
+            'duration': f'{settings.LONG_WEBHOOK_SECONDS} segundos',
             'timestamp': timezone.now().isoformat()
         })
     
     return JsonResponse({'message': 'Long webhook endpoint activo'})
 
+def metrics_endpoint(request):
+    """Métricas del proceso en formato de texto de Prometheus"""
+    
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    
+    return HttpResponse(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 def health_check(request):
     """Health check del sistema"""
     